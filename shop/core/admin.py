@@ -1,35 +1,163 @@
+from django import forms
 from django.contrib import admin
-from .models import Item, Order, OrderItem, Category, Refund, Report
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from .catalog_io import export_rows, format_rows
+from .inventory import restock
+from .jobs import retry
+from .models import ArchivedOrder, Item, Job, Order, OrderItem, Category, Promotion, Refund, Report, StockShard
+from .pagination import EstimatedCountPaginator
+from .ref_codes import is_valid_ref_code
+from .rollups import record_refunds
+
+
+def grant_refunds(orders):
+    """Grant the refunds requested for ``orders`` in a fixed number of queries, whatever their number.
+
+    Orders already granted are skipped, so their lines are added to the
+    refund rollups exactly once.
+    """
+    with transaction.atomic():
+        pks = list(orders.filter(refund_requested=True, refund_granted=False)
+                   .order_by().select_for_update().values_list('pk', flat=True))
+        if not pks:
+            return 0
+        Refund.objects.filter(order__in=pks).update(accepted=True)
+        granted = Order.objects.filter(pk__in=pks).update(refund_granted=True)
+        record_refunds(pks)
+        return granted
 
 
 def make_refund_accepted(modeladmin, request, queryset):
-    queryset.update(refund_granted=True)
+    granted = grant_refunds(queryset)
+    modeladmin.message_user(request, f'Granted {granted} refund(s).')
 
 
 make_refund_accepted.short_description = 'Update orders to refund granted'
 
 
+def accept_refunds(modeladmin, request, queryset):
+    granted = grant_refunds(Order.objects.filter(pk__in=queryset.values('order_id')))
+    modeladmin.message_user(request, f'Granted {granted} refund(s).')
+
+
+accept_refunds.short_description = 'Accept refunds and mark their orders refund granted'
+
+
+def retry_jobs(modeladmin, request, queryset):
+    retried = retry(queryset)
+    modeladmin.message_user(request, f'Queued {retried} dead job(s) again.')
+
+
+retry_jobs.short_description = 'Retry dead jobs'
+
+
+def export_items(modeladmin, request, queryset):
+    response = StreamingHttpResponse(format_rows(export_rows(queryset), 'csv'), content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="catalog.csv"'
+    return response
+
+
+export_items.short_description = 'Export selected items as CSV'
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Changelist settings for tables that grow with every order.
+
+    No unfiltered ``COUNT(*)`` is run next to the filtered one, an estimate
+    replaces it for big tables, and rows are listed newest first along the
+    primary key.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ['-pk']
+
+
+class StockShardInline(admin.TabularInline):
+    # Read-only: writing a quantity back would undo reservations made while
+    # the page was open. Stock is added through ItemAdminForm.add_stock.
+    model = StockShard
+    extra = 0
+    readonly_fields = ['shard', 'quantity']
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+class ItemAdminForm(forms.ModelForm):
+    add_stock = forms.IntegerField(
+        min_value=1, required=False,
+        help_text='Units to add to the stock. An item whose stock is not tracked yet starts being tracked.',
+    )
+
+    class Meta:
+        model = Item
+        fields = '__all__'
+
+
 class ItemAdmin(admin.ModelAdmin):
+    form = ItemAdminForm
     list_display = ['title', 'price', 'discount_price', 'label', 'category']
+    list_select_related = ['category']
     search_fields = ['title']
     list_filter = ['category']
+    autocomplete_fields = ['category']
+    inlines = [StockShardInline]
+    actions = [export_items]
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if form.cleaned_data.get('add_stock'):
+            restock(obj, form.cleaned_data['add_stock'])
 
 
 admin.site.register(Item, ItemAdmin)
 
 
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(LargeTableAdmin):
     list_display = ['user', 'ref_code', 'ordered_date', 'ordered', 'received', 'refund_requested', 'refund_granted']
+    list_select_related = ['user']
+    list_filter = ['ordered', 'refund_requested', 'refund_granted', 'ordered_date']
     search_fields = ['user__username', 'ref_code']
+    autocomplete_fields = ['user']
+    raw_id_fields = ['items', 'billing_address']
     actions = [make_refund_accepted]
 
+    def get_search_results(self, request, queryset, search_term):
+        # A well-formed ref code is looked up through its unique index.
+        term = search_term.strip().upper()
+        if is_valid_ref_code(term):
+            return queryset.filter(ref_code=term), False
+        return super().get_search_results(request, queryset, search_term)
+
 
 admin.site.register(Order, OrderAdmin)
 
 
-class OrderItemAdmin(admin.ModelAdmin):
+class ArchivedOrderAdmin(LargeTableAdmin):
+    list_display = ['user', 'ref_code', 'ordered_date', 'received', 'refund_granted', 'archived_at']
+    list_select_related = ['user']
+    list_filter = ['ordered_date']
+    search_fields = ['user__username', 'ref_code']
+    raw_id_fields = ['user', 'billing_address']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+admin.site.register(ArchivedOrder, ArchivedOrderAdmin)
+
+
+class OrderItemAdmin(LargeTableAdmin):
     list_display = ['item', 'quantity', 'user', 'ordered']
-    # search_fields = ['name']
+    list_select_related = ['item', 'user']
+    list_filter = ['ordered']
+    search_fields = ['item__title', 'user__username']
+    autocomplete_fields = ['item', 'user']
 
 
 admin.site.register(OrderItem, OrderItemAdmin)
@@ -43,17 +171,50 @@ class CategoryAdmin(admin.ModelAdmin):
 admin.site.register(Category, CategoryAdmin)
 
 
-class ReportAdmin(admin.ModelAdmin):
+class PromotionAdmin(admin.ModelAdmin):
+    list_display = ['name', 'kind', 'item', 'category', 'percent', 'amount', 'starts_at', 'ends_at', 'active']
+    list_select_related = ['item', 'category']
+    list_filter = ['kind', 'active']
+    search_fields = ['name']
+    autocomplete_fields = ['item', 'category']
+
+
+admin.site.register(Promotion, PromotionAdmin)
+
+
+class ReportAdmin(LargeTableAdmin):
     list_display = ['ref_code', 'reason', 'full_name', 'phone_number', 'email']
     search_fields = ['ref_code']
+    autocomplete_fields = ['order']
 
 
 admin.site.register(Report, ReportAdmin)
 
 
-# class RefundAdmin(admin.ModelAdmin):
-#     list_display = ['order__ref_code', 'accepted']
-#     search_fields = ['order__ref_code']
+class RefundAdmin(LargeTableAdmin):
+    list_display = ['order_ref_code', 'accepted', 'email', 'phone_number']
+    list_select_related = ['order']
+    list_filter = ['accepted']
+    search_fields = ['order__ref_code', 'email']
+    autocomplete_fields = ['order']
+    actions = [accept_refunds]
+
+    @admin.display(description='Order', ordering='order__ref_code')
+    def order_ref_code(self, refund):
+        return refund.order.ref_code
+
+
+admin.site.register(Refund, RefundAdmin)
+
+
+class JobAdmin(LargeTableAdmin):
+    list_display = ['name', 'state', 'priority', 'attempts', 'max_attempts', 'run_at', 'locked_by']
+    list_filter = ['state', 'name']
+    readonly_fields = ['name', 'payload', 'attempts', 'locked_by', 'locked_until', 'last_error', 'created_at']
+    actions = [retry_jobs]
+
+    def has_add_permission(self, request):
+        return False
 
 
-# admin.site.register(Refund, RefundAdmin)
+admin.site.register(Job, JobAdmin)
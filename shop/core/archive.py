@@ -0,0 +1,81 @@
+"""Compaction of the order tables.
+
+Carts idle for too long are deleted, and placed orders past a cut-off
+are moved, with their lines, into ``ArchivedOrder`` and
+``ArchivedOrderItem`` under their original primary keys, so the hot
+``Order`` and ``OrderItem`` tables only grow with recent activity. Both
+work in batches of one short transaction each.
+
+Orders that have a refund or a report attached stay where they are,
+since those rows point at the order.
+"""
+import calendar
+from datetime import date
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from .cart import invalidate_cart_summary
+from .models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem, Refund, Report
+
+ARCHIVED_FIELDS = [
+    'id', 'user_id', 'ref_code', 'start_date', 'ordered_date', 'billing_address_id', 'received',
+    'refund_requested', 'refund_granted', 'subtotal', 'discount', 'promotion_discount', 'item_count',
+]
+ARCHIVED_LINE_FIELDS = ['item_id', 'quantity', 'unit_price', 'unit_discount_price', 'promotion_discount', 'category_id']
+
+
+def months_before(day, months):
+    month = day.month - 1 - months
+    year, month = day.year + month // 12, month % 12 + 1
+    return date(year, month, min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def delete_stale_carts(before, batch_size=1000):
+    """Delete open carts last changed before ``before``, with their lines; returns how many."""
+    deleted = 0
+    carts = Order.objects.filter(ordered=False, updated_at__lt=before).order_by('pk')
+    while True:
+        with transaction.atomic():
+            batch = list(carts.select_for_update().values_list('pk', 'user_id')[:batch_size])
+            if not batch:
+                break
+            pks = [pk for pk, _ in batch]
+            OrderItem.objects.filter(order__in=pks).delete()
+            Order.objects.filter(pk__in=pks).delete()
+            user_ids = [user_id for _, user_id in batch]
+            transaction.on_commit(lambda user_ids=user_ids: invalidate_cart_summary(*user_ids))
+        deleted += len(batch)
+    # Open lines that never made it into an order.
+    orphans = OrderItem.objects.filter(ordered=False, order__isnull=True).order_by('pk')
+    while True:
+        pks = list(orphans.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        OrderItem.objects.filter(pk__in=pks).delete()
+
+
+def archivable_orders(before):
+    return Order.objects.filter(ordered=True, ordered_date__lt=before).filter(
+        ~Exists(Refund.objects.filter(order=OuterRef('pk'))),
+        ~Exists(Report.objects.filter(order=OuterRef('pk'))),
+    ).order_by('pk')
+
+
+def archive_orders(before, batch_size=1000):
+    """Move placed orders dated before ``before`` into the archive tables; returns how many."""
+    archived = 0
+    orders = archivable_orders(before)
+    while True:
+        with transaction.atomic():
+            rows = list(orders.select_for_update().values(*ARCHIVED_FIELDS)[:batch_size])
+            if not rows:
+                return archived
+            pks = [row['id'] for row in rows]
+            lines = OrderItem.objects.filter(order__in=pks)
+            ArchivedOrder.objects.bulk_create([ArchivedOrder(**row) for row in rows])
+            ArchivedOrderItem.objects.bulk_create([
+                ArchivedOrderItem(order_id=row.pop('order'), **row)
+                for row in lines.values('order', *ARCHIVED_LINE_FIELDS)
+            ], batch_size=batch_size)
+            lines.delete()
+            Order.objects.filter(pk__in=pks).delete()
+        archived += len(rows)
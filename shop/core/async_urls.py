@@ -0,0 +1,19 @@
+from django.urls import URLPattern, URLResolver
+from . import async_views, urls
+
+ASYNC_VIEWS = {
+    'home': async_views.home,
+    'product': async_views.product,
+    'filter-by-category': async_views.filter_by_category,
+    'search': async_views.search,
+}
+
+# core/urls.py with its read-only storefront views and the catalog API
+# swapped for their async versions; every URL and name stays the same.
+urlpatterns = []
+for pattern in urls.urlpatterns:
+    if isinstance(pattern, URLPattern) and pattern.name in ASYNC_VIEWS:
+        pattern = URLPattern(pattern.pattern, ASYNC_VIEWS[pattern.name], pattern.default_args, pattern.name)
+    elif isinstance(pattern, URLResolver) and pattern.urlconf_name is urls.router.urls:
+        pattern = URLResolver(pattern.pattern, async_views.async_catalog_urls(urls.router.urls))
+    urlpatterns.append(pattern)
@@ -0,0 +1,112 @@
+"""Async versions of the read-only storefront views, served under ASGI.
+
+Django 4.0 has no async ORM, so each view awaits its queries through
+``sync_to_async`` (thread-sensitive, as Django's own async ORM does later)
+and renders the same templates as its synchronous counterpart in
+``core.views``. The coroutine itself holds no thread while the client,
+the cache or the database is slow.
+"""
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.http import HttpResponseNotModified
+from django.shortcuts import get_object_or_404, render
+from django.urls import URLPattern
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
+from .catalog import CATALOG_VERSION_KEY, render_item_grid, versioned_etag
+from .categories import categories
+from .middleware import query_budget
+from .models import Item
+from .promotions import annotate_items
+from .search import get_search_backend
+from . import views
+
+render_async = sync_to_async(render)
+render_item_grid_async = sync_to_async(render_item_grid)
+
+
+@sync_to_async
+def load_user(request):
+    # request.user is resolved lazily from the session; do it off the loop.
+    return request.user.is_authenticated
+
+
+@query_budget(views.HomeView.query_budget)
+async def home(request):
+    await load_user(request)
+    item_grid = await render_item_grid_async(request, Item.objects.all(), 'home')
+    return await render_async(request, 'core/home.html', {'item_grid': item_grid})
+
+
+@query_budget(views.ItemDetailView.query_budget)
+async def product(request, slug):
+    await load_user(request)
+    item = await sync_to_async(get_object_or_404)(Item.objects.select_related('category'), slug=slug)
+    await sync_to_async(annotate_items)([item])
+    return await render_async(request, 'core/product.html', {'object': item, 'item': item})
+
+
+@query_budget(views.filter_by_category.query_budget)
+async def filter_by_category(request, slug):
+    await load_user(request)
+    category = await sync_to_async(categories.get_or_404)(slug)
+    item_grid = await render_item_grid_async(request, Item.objects.filter(category_id=category.id),
+                                             'category', category.id)
+    return await render_async(request, 'core/filter_by_category.html', {
+        'category': category,
+        'item_grid': item_grid,
+    })
+
+
+@sync_to_async
+def search_page(query, number):
+    results = get_search_backend().search(query) if query else Item.objects.none()
+    page = Paginator(results, views.SearchView.paginate_by).get_page(number)
+    page.object_list = annotate_items(list(page.object_list))
+    return page
+
+
+@query_budget(views.SearchView.query_budget)
+async def search(request):
+    await load_user(request)
+    query = request.GET.get('search', '').strip()
+    page = await search_page(query, request.GET.get('page'))
+    return await render_async(request, 'core/search.html', {
+        'all_search_results': page.object_list,
+        'page_obj': page,
+        'paginator': page.paginator,
+        'is_paginated': page.has_other_pages(),
+        'search_query': query,
+    })
+
+
+def async_catalog_view(view):
+    """Wrap a catalog API view so unchanged catalogs get a 304 from the cache alone.
+
+    Only requests that need a body reach the synchronous DRF view.
+    """
+    run_view = sync_to_async(view)
+
+    @wraps(view)
+    async def catalog_view(request, *args, **kwargs):
+        if request.method in ('GET', 'HEAD') and 'If-None-Match' in request.headers:
+            version = await cache.aget(CATALOG_VERSION_KEY)
+            if version is not None:
+                etag = quote_etag(versioned_etag(version, request))
+                if etag in parse_etags(request.headers['If-None-Match']):
+                    response = HttpResponseNotModified()
+                    response['ETag'] = etag
+                    patch_vary_headers(response, ['Accept'])
+                    return response
+        return await run_view(request, *args, **kwargs)
+
+    return catalog_view
+
+
+def async_catalog_urls(patterns):
+    return [
+        URLPattern(pattern.pattern, async_catalog_view(pattern.callback), pattern.default_args, pattern.name)
+        for pattern in patterns
+    ]
@@ -0,0 +1,63 @@
+from dataclasses import dataclass
+from typing import Callable, Optional
+from django.test import Client
+from django.urls import URLPattern, reverse
+from . import urls as core_urls
+from .models import Category, Item, Order
+
+
+@dataclass
+class Route:
+    name: str
+    path: str
+    setup: Optional[Callable[[Client], object]] = None
+
+
+def route_patterns():
+    """Every named view in ``core/urls.py``, including the API router's."""
+    for pattern in [*core_urls.urlpatterns, *core_urls.router.urls]:
+        if isinstance(pattern, URLPattern) and pattern.name:
+            yield pattern
+
+
+def build_routes(user):
+    """A request for every route in ``core/urls.py`` against the current data.
+
+    Cart mutations are paired with a setup request that puts the item in
+    the cart first, so repeated runs keep measuring the same code path.
+    """
+    item = Item.objects.order_by('pk').first()
+    category = Category.objects.order_by('pk').first()
+    order = Order.objects.filter(user=user, ordered=True).order_by('-pk').first()
+    if item is None or category is None or order is None:
+        raise ValueError('The database needs items, categories and a placed order; run generate_dataset.')
+
+    def add_item(client):
+        return client.get(reverse('core:add-to-cart', kwargs={'slug': item.slug}))
+
+    kwargs = {
+        'product': {'slug': item.slug},
+        'add-to-cart': {'slug': item.slug},
+        'remove-single-item-from-cart': {'slug': item.slug},
+        'remove-from-cart': {'slug': item.slug},
+        'order-detail': {'pk': order.pk},
+        'report': {'pk': order.pk},
+        'filter-by-category': {'slug': category.slug},
+        'item-detail': {'pk': item.pk},
+        'category-detail': {'pk': category.pk},
+        'image-derivative': {'preset': 'card', 'name': item.image.name},
+    }
+    query = {'search': '?search=' + item.title.split()[0]}
+    setups = {'remove-single-item-from-cart': add_item, 'remove-from-cart': add_item}
+    routes = []
+    for pattern in route_patterns():
+        namespace = 'core:' + pattern.name
+        path = reverse(namespace, kwargs=kwargs.get(pattern.name)) + query.get(pattern.name, '')
+        routes.append(Route(pattern.name, path, setups.get(pattern.name)))
+    return routes
+
+
+def make_client(user):
+    client = Client()
+    client.force_login(user)
+    return client
@@ -0,0 +1,310 @@
+from dataclasses import dataclass
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Value, When
+from django.utils import timezone
+from . import inventory
+from .inventory import OutOfStock
+from .models import Item, Order, OrderItem, order_line_totals, order_total_subqueries
+from .promotions import promotions
+from .rollups import record_sales
+
+CART_SUMMARY_KEY = 'cart-summary:{}'
+SESSION_CART_KEY = 'cart'
+
+
+@dataclass(frozen=True)
+class CartSummary:
+    count: int = 0
+    subtotal: float = 0
+    total: float = 0
+    order_id: int = None
+
+
+EMPTY_CART = CartSummary()
+
+
+def cart_summary_key(user_id):
+    return CART_SUMMARY_KEY.format(user_id)
+
+
+def load_cart_summary(user):
+    order = Order.objects.filter(user=user, ordered=False).only(
+        'pk', 'item_count', 'subtotal', 'discount', 'promotion_discount'
+    ).first()
+    if order is None:
+        return EMPTY_CART
+    return CartSummary(
+        count=order.item_count,
+        subtotal=order.subtotal,
+        total=order.get_total(),
+        order_id=order.pk,
+    )
+
+
+def get_cart_summary(request):
+    """Return the cart summary for ``request.user``.
+
+    The summary is computed at most once per request and shared between
+    requests through the cache until one of the cart views invalidates it.
+    Anonymous visitors get the count of their session cart.
+    """
+    if not hasattr(request, '_cart_summary'):
+        user = request.user
+        if not user.is_authenticated:
+            summary = SessionCart(request.session).summary()
+        else:
+            key = cart_summary_key(user.pk)
+            summary = cache.get(key)
+            if summary is None:
+                summary = load_cart_summary(user)
+                cache.set(key, summary, settings.CART_SUMMARY_CACHE_TIMEOUT)
+        request._cart_summary = summary
+    return request._cart_summary
+
+
+def invalidate_cart_summary(*user_ids):
+    cache.delete_many([cart_summary_key(user_id) for user_id in user_ids])
+
+
+class CartError(Exception):
+    pass
+
+
+class NoActiveOrder(CartError):
+    pass
+
+
+class ItemNotInCart(CartError):
+    pass
+
+
+class CartService:
+    """Cart mutations for a single user.
+
+    Every operation runs in one transaction, looks the open order up once
+    and changes quantities with ``F()`` expressions, so concurrent requests
+    cannot lose updates. The partial unique constraints on ``Order`` and
+    ``OrderItem`` guarantee at most one open order and one open line per
+    item, which lets inserts fall back to updates when a request races.
+    Units of items with tracked stock are held for the cart as they are
+    added and released as they are removed; ``OutOfStock`` rolls the
+    operation back.
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    def get_open_order(self):
+        return Order.objects.select_for_update().filter(user=self.user, ordered=False).first()
+
+    def get_or_create_open_order(self):
+        """Return the locked open order and whether this call created it."""
+        order = self.get_open_order()
+        if order is not None:
+            return order, False
+        try:
+            with transaction.atomic():
+                return Order.objects.create(user=self.user, ordered_date=timezone.now()), True
+        except IntegrityError:
+            return Order.objects.select_for_update().get(user=self.user, ordered=False), False
+
+    def open_lines(self, item):
+        return OrderItem.objects.filter(user=self.user, item=item, ordered=False)
+
+    @transaction.atomic
+    def add(self, item):
+        """Add one ``item`` to the cart, returning True if it was already there."""
+        order, created = self.get_or_create_open_order()
+        inventory.hold(self.user, item, 1)
+        # A cart created just now has no lines to increment.
+        existed = not created and bool(self.open_lines(item).update(quantity=F('quantity') + 1))
+        if not existed:
+            try:
+                with transaction.atomic():
+                    order_item = OrderItem.objects.create(user=self.user, item=item)
+            except IntegrityError:
+                existed = bool(self.open_lines(item).update(quantity=F('quantity') + 1))
+            else:
+                order.items.add(order_item)
+        self.changed(order)
+        return existed
+
+    @transaction.atomic
+    def merge(self, quantities):
+        """Add ``{item_id: quantity}`` to the cart in one UPDATE and one INSERT.
+
+        Items whose stock cannot cover their quantity are left out.
+        """
+        quantities = {int(pk): quantity for pk, quantity in quantities.items() if quantity > 0}
+        items = Item.objects.only('pk', 'stock_shards').in_bulk(quantities)
+        if not items:
+            return
+        order, _ = self.get_or_create_open_order()
+        item_ids = set()
+        for pk, item in items.items():
+            try:
+                inventory.hold(self.user, item, quantities[pk])
+            except OutOfStock:
+                continue
+            item_ids.add(pk)
+        lines = OrderItem.objects.filter(user=self.user, item_id__in=item_ids, ordered=False)
+        existing = set(lines.values_list('item_id', flat=True))
+        if existing:
+            lines.update(quantity=F('quantity') + Case(
+                *[When(item_id=pk, then=Value(quantities[pk])) for pk in existing],
+                output_field=IntegerField(),
+            ))
+        created = OrderItem.objects.bulk_create([
+            OrderItem(user=self.user, item_id=pk, quantity=quantities[pk]) for pk in item_ids - existing
+        ])
+        order.items.add(*created)
+        self.changed(order)
+
+    @transaction.atomic
+    def remove(self, item):
+        """Drop every unit of ``item`` from the cart."""
+        order = self.get_open_order()
+        if order is None:
+            raise NoActiveOrder
+        deleted, _ = self.open_lines(item).delete()
+        if not deleted:
+            raise ItemNotInCart
+        inventory.unhold(self.user, item)
+        self.changed(order)
+
+    @transaction.atomic
+    def remove_single(self, item):
+        """Take one unit of ``item`` out of the cart, dropping the line at zero."""
+        order = self.get_open_order()
+        if order is None:
+            raise NoActiveOrder
+        if not self.open_lines(item).filter(quantity__gt=1).update(quantity=F('quantity') - 1):
+            deleted, _ = self.open_lines(item).delete()
+            if not deleted:
+                raise ItemNotInCart
+        inventory.unhold(self.user, item, 1)
+        self.changed(order)
+
+    @transaction.atomic
+    def checkout(self, billing_address, ref_code):
+        """Turn the open cart into a placed order.
+
+        The order row stays locked for the whole pipeline: the cart's stock
+        holds are claimed, topping up any that expired, the billing
+        address is saved, every line gets its unit and discount price and
+        its item's category snapshotted and is marked ordered in one UPDATE, the promotions in
+        force are applied to the lines in another, and the totals, ref code
+        and status are written in a third, whatever the cart size. The
+        order's lines are then added to the daily sales rollups.
+        """
+        order = self.get_open_order()
+        if order is None:
+            raise NoActiveOrder
+        lines = list(OrderItem.objects.filter(order=order).select_related('item'))
+        inventory.claim(self.user, [(line.item, line.quantity) for line in lines])
+        billing_address.save()
+        items = Item.objects.filter(pk=OuterRef('item_id'))
+        OrderItem.objects.filter(order=order).update(
+            ordered=True,
+            unit_price=Subquery(items.values('price')),
+            unit_discount_price=Subquery(items.values('discount_price')),
+            category_id=Subquery(items.values('category_id')),
+        )
+        compiled = promotions.compiled()
+        if compiled:
+            compiled.price_cart(lines)
+            OrderItem.objects.bulk_update(lines, ['promotion_discount'])
+        totals = order.items.aggregate(**order_line_totals())
+        Order.objects.filter(pk=order.pk).update(
+            ordered=True,
+            ordered_date=timezone.now(),
+            ref_code=ref_code,
+            billing_address=billing_address,
+            **totals,
+        )
+        record_sales([order.pk])
+        self.invalidate_summary()
+        return order
+
+    def changed(self, order):
+        if promotions.compiled():
+            order.update_totals()
+        else:
+            Order.objects.filter(pk=order.pk).update(updated_at=timezone.now(), **order_total_subqueries())
+        self.invalidate_summary()
+
+    def invalidate_summary(self):
+        user_id = self.user.pk
+        transaction.on_commit(lambda: invalidate_cart_summary(user_id))
+
+
+class SessionCart:
+    """Cart of an anonymous visitor, kept in the session as ``{item_id: quantity}``.
+
+    It offers the same mutations as ``CartService`` without touching the
+    database; the lines are merged into the customer's open order at login.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.quantities = session.get(SESSION_CART_KEY, {})
+
+    def save(self):
+        if self.quantities:
+            self.session[SESSION_CART_KEY] = self.quantities
+        else:
+            self.session.pop(SESSION_CART_KEY, None)
+        self.session.modified = True
+
+    def add(self, item):
+        key = str(item.pk)
+        if item.stock_shards and inventory.get_stock(item) <= self.quantities.get(key, 0):
+            raise OutOfStock(item.pk, self.quantities.get(key, 0) + 1)
+        existed = key in self.quantities
+        self.quantities[key] = self.quantities.get(key, 0) + 1
+        self.save()
+        return existed
+
+    def check(self, item):
+        if not self.quantities:
+            raise NoActiveOrder
+        if str(item.pk) not in self.quantities:
+            raise ItemNotInCart
+
+    def remove(self, item):
+        self.check(item)
+        del self.quantities[str(item.pk)]
+        self.save()
+
+    def remove_single(self, item):
+        self.check(item)
+        key = str(item.pk)
+        self.quantities[key] -= 1
+        if not self.quantities[key]:
+            del self.quantities[key]
+        self.save()
+
+    def lines(self):
+        """Unsaved ``OrderItem`` rows for display, priced like an open order."""
+        items = Item.objects.in_bulk([int(pk) for pk in self.quantities])
+        return [
+            OrderItem(item=items[int(pk)], quantity=quantity)
+            for pk, quantity in self.quantities.items() if int(pk) in items
+        ]
+
+    def summary(self):
+        return CartSummary(count=len(self.quantities))
+
+
+def get_cart(request):
+    if request.user.is_authenticated:
+        return CartService(request.user)
+    return SessionCart(request.session)
+
+
+def merge_session_cart(request, user):
+    quantities = request.session.pop(SESSION_CART_KEY, None)
+    if quantities:
+        CartService(user).merge(quantities)
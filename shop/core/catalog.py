@@ -0,0 +1,87 @@
+import hashlib
+import time
+from datetime import datetime, timezone
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from .pagination import CursorPaginator
+from .promotions import promotions
+
+CATALOG_VERSION_KEY = 'catalog-version'
+CATALOG_MODIFIED_KEY = 'catalog-modified'
+ITEMS_PER_PAGE = 12
+
+
+def get_catalog_version():
+    """Return the counter that changes whenever an item or category does.
+
+    It starts from the current time so that a counter evicted from the
+    cache can never come back with a value older fragments were keyed on.
+    """
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, int(time.time()), None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        get_catalog_version()
+    cache.set(CATALOG_MODIFIED_KEY, time.time(), None)
+
+
+def get_catalog_modified():
+    """Timestamp of the last catalog change, as known to the cache."""
+    modified = cache.get(CATALOG_MODIFIED_KEY)
+    if modified is None:
+        modified = time.time()
+        cache.add(CATALOG_MODIFIED_KEY, modified, None)
+    return modified
+
+
+def catalog_etag(request, *args, **kwargs):
+    return versioned_etag(get_catalog_version(), request)
+
+
+def versioned_etag(version, request):
+    accept = hashlib.md5(request.headers.get('Accept', '').encode()).hexdigest()[:8]
+    return f'{version}-{accept}'
+
+
+def catalog_last_modified(request, *args, **kwargs):
+    return datetime.fromtimestamp(get_catalog_modified(), tz=timezone.utc)
+
+
+def catalog_cache_key(*parts):
+    return ':'.join(['catalog', str(get_catalog_version()), *map(str, parts)])
+
+
+def render_item_grid(request, items, *key_parts, ordering=('id',)):
+    """Render the product card grid and pagination for ``items``.
+
+    The HTML is cached under the catalog version and the live promotions,
+    so a warm page never evaluates ``items`` and any catalog or promotion
+    change is picked up immediately. Pages are addressed by ``?cursor=``
+    tokens from ``CursorPaginator``.
+    """
+    paginator = CursorPaginator(items.select_related('category'), ITEMS_PER_PAGE, ordering)
+    # Keyed on the decoded cursor, so made-up tokens cannot fill the cache.
+    cursor = paginator.normalize_cursor(request.GET.get('cursor', ''))
+    compiled = promotions.compiled()
+    key = catalog_cache_key('grid', *key_parts, compiled.state(), cursor)
+    html = cache.get(key)
+    if html is None:
+        page = paginator.get_page(cursor)
+        compiled.annotate_items(page)
+        context = {
+            'page_obj': page,
+            'total': paginator.approximate_count(
+                catalog_cache_key('count', *key_parts), settings.CATALOG_CACHE_TIMEOUT),
+        }
+        html = render_to_string('core/include/item_grid.html', context, request=request)
+        cache.set(key, html, settings.CATALOG_CACHE_TIMEOUT)
+    return mark_safe(html)
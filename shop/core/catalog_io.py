@@ -0,0 +1,259 @@
+"""Bulk catalog import and export as CSV or JSON lines.
+
+Both directions stream: the importer reads the input one batch of rows at
+a time and the exporter walks the items with a chunked ``iterator()``, so
+memory stays flat whatever the size of the file. Only the categories,
+which are few, are kept in memory.
+
+Rows carry an item's ``slug``, which is how an import finds the item to
+update. Rows without one create an item under a slug generated from its
+title and made unique against the table. Categories are matched by name
+and created as needed. Each batch is written in its own transaction with
+one ``bulk_create`` and one ``bulk_update``, and the side effects the
+``Item`` signals would have had, search indexing and refreshing the
+totals of open carts, are applied to the batch as a whole.
+"""
+import csv
+import json
+from collections import OrderedDict
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_slug
+from django.db import transaction
+from django.utils.text import slugify
+from .cart import invalidate_cart_summary
+from .catalog import bump_catalog_version
+from .categories import bump_category_version
+from .models import Category, Item, Order, label_choices, recompute_order_totals
+from .search import get_search_backend
+
+FORMATS = ('csv', 'jsonl')
+FIELDS = ['slug', 'title', 'category', 'price', 'discount_price', 'label', 'description', 'image']
+ITEM_FIELDS = ['title', 'category', 'price', 'discount_price', 'label', 'description', 'image']
+COMPARED_FIELDS = ['title', 'category_id', 'price', 'discount_price', 'label', 'description', 'image']
+LABELS = {code for code, _ in label_choices}
+# Leaves room for a numeric suffix within the 50 characters of a SlugField.
+SLUG_BASE_LENGTH = 40
+# Bases whose next free suffix is remembered between batches.
+SLUG_CACHE_SIZE = 10000
+# Row errors kept for the report; the rest are only counted.
+ERROR_LIMIT = 20
+
+
+def guess_format(path):
+    return 'jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+def read_rows(stream, fmt):
+    """Yield ``(line_number, row)`` for each record in ``stream``; JSON errors are yielded as the row."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(stream, 1):
+        if line.strip():
+            try:
+                yield line_number, json.loads(line)
+            except ValueError as e:
+                yield line_number, e
+
+
+def export_rows(items, chunk_size=2000):
+    """Yield one dict per item of the ``items`` queryset, in primary key order."""
+    rows = items.order_by('pk').values_list(
+        'slug', 'title', 'category__name', 'price', 'discount_price', 'label', 'description', 'image',
+    )
+    for row in rows.iterator(chunk_size=chunk_size):
+        yield dict(zip(FIELDS, row))
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def format_rows(rows, fmt):
+    """Yield ``rows`` as lines of text, the CSV header first."""
+    if fmt == 'jsonl':
+        for row in rows:
+            yield json.dumps(row) + '\n'
+        return
+    writer = csv.DictWriter(Echo(), FIELDS)
+    yield writer.writeheader()
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def parse_float(value, field, required=False):
+    if value is None or value == '':
+        if required:
+            raise ValueError(f'{field} is required')
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{field} is not a number: {value!r}')
+    if value < 0:
+        raise ValueError(f'{field} is negative')
+    return value
+
+
+def parse_row(row):
+    """Return the cleaned fields of one input row, raising ``ValueError`` for a bad one."""
+    if isinstance(row, Exception):
+        raise ValueError(f'invalid JSON: {row}')
+    if not isinstance(row, dict):
+        raise ValueError('expected an object')
+    text = {field: str(row.get(field) or '').strip() for field in ('slug', 'title', 'category', 'label', 'image')}
+    if not text['title'] or len(text['title']) > 100:
+        raise ValueError('title must be 1 to 100 characters')
+    if not text['category'] or len(text['category']) > 100:
+        raise ValueError('category must be 1 to 100 characters')
+    if text['slug']:
+        try:
+            validate_slug(text['slug'])
+        except ValidationError:
+            raise ValueError(f'invalid slug {text["slug"]!r}')
+        if len(text['slug']) > 50:
+            raise ValueError('slug is longer than 50 characters')
+    label = text['label'] or 'P'
+    if label not in LABELS:
+        raise ValueError(f'label must be one of {", ".join(sorted(LABELS))}')
+    return {
+        'slug': text['slug'],
+        'title': text['title'],
+        'category': text['category'],
+        'price': parse_float(row.get('price'), 'price', required=True),
+        'discount_price': parse_float(row.get('discount_price'), 'discount_price'),
+        'label': label,
+        'description': str(row.get('description') or ''),
+        'image': text['image'],
+    }
+
+
+class CatalogImporter:
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self.categories = {category.name: category for category in Category.objects.all()}
+        self.category_slugs = {category.slug for category in self.categories.values()}
+        self.slug_suffixes = OrderedDict()
+        self.created = self.updated = self.unchanged = self.skipped = 0
+        self.created_categories = 0
+        self.errors = []
+
+    @property
+    def rows(self):
+        return self.created + self.updated + self.unchanged + self.skipped
+
+    def run(self, rows, progress=None):
+        """Import ``(line_number, row)`` pairs; ``progress`` is called after each batch."""
+        batch = []
+        for line_number, row in rows:
+            try:
+                batch.append(parse_row(row))
+            except ValueError as e:
+                self.skipped += 1
+                if len(self.errors) < ERROR_LIMIT:
+                    self.errors.append(f'line {line_number}: {e}')
+            if len(batch) >= self.batch_size:
+                self.write(batch)
+                batch = []
+                if progress:
+                    progress(self)
+        if batch:
+            self.write(batch)
+        bump_catalog_version()
+        if self.created_categories:
+            bump_category_version()
+        return self
+
+    def write(self, rows):
+        with transaction.atomic():
+            self.create_categories({row['category'] for row in rows})
+            existing = {
+                slug: (pk, values) for slug, pk, *values in
+                Item.objects.filter(slug__in={row['slug'] for row in rows if row['slug']})
+                .order_by('-pk').values_list('slug', 'pk', *COMPARED_FIELDS)
+            }
+            # A slug repeated in the batch updates the same item; the last row wins.
+            updates, creates = {}, {}
+            generated = []
+            for row in rows:
+                category = self.categories[row['category']]
+                item = Item(**dict(row, category=category))
+                if row['slug'] in existing:
+                    pk, values = existing[row['slug']]
+                    item.pk = pk
+                    # Rows that change nothing skip the UPDATE, the reindex and the cart refresh.
+                    if values != [category.pk if field == 'category_id' else row[field] for field in COMPARED_FIELDS]:
+                        updates[item.slug] = item
+                    else:
+                        updates.pop(item.slug, None)
+                elif row['slug']:
+                    creates[item.slug] = item
+                else:
+                    generated.append(item)
+            self.assign_slugs(generated, reserved=set(creates))
+            created = Item.objects.bulk_create([*creates.values(), *generated])
+            updated = list(updates.values())
+            Item.objects.bulk_update(updated, ITEM_FIELDS)
+            get_search_backend().index(created + updated)
+            if updated:
+                self.refresh_open_orders([item.pk for item in updated])
+        self.created += len(created)
+        self.updated += len(updated)
+        self.unchanged += len(rows) - len(created) - len(updated)
+
+    def create_categories(self, names):
+        missing = []
+        for name in sorted(names - self.categories.keys()):
+            missing.append(Category(name=name, slug=self.unique_category_slug(name)))
+        for category in Category.objects.bulk_create(missing):
+            self.categories[category.name] = category
+        self.created_categories += len(missing)
+
+    def unique_category_slug(self, name):
+        base = slugify(name)[:SLUG_BASE_LENGTH].strip('-') or 'category'
+        slug, n = base, 1
+        while slug in self.category_slugs:
+            n += 1
+            slug = f'{base}-{n}'
+        self.category_slugs.add(slug)
+        return slug
+
+    def assign_slugs(self, items, reserved):
+        """Give each of ``items`` a slug from its title that no item, and none of ``reserved``, has.
+
+        Each round checks all candidates in one query. The first collision
+        on a base looks up how many suffixed slugs it already has and
+        continues from there.
+        """
+        pending = items
+        seeded = set()
+        while pending:
+            for item in pending:
+                base = slugify(item.title)[:SLUG_BASE_LENGTH].strip('-') or 'item'
+                n = self.slug_suffixes.pop(base, 1)
+                item.slug = base if n == 1 else f'{base}-{n}'
+                self.slug_suffixes[base] = n + 1
+                item.slug_base = base
+            while len(self.slug_suffixes) > SLUG_CACHE_SIZE:
+                self.slug_suffixes.popitem(last=False)
+            taken = set(Item.objects.filter(slug__in=[item.slug for item in pending]).values_list('slug', flat=True))
+            collided = []
+            for item in pending:
+                if item.slug in taken or item.slug in reserved:
+                    collided.append(item)
+                else:
+                    reserved.add(item.slug)
+            pending = collided
+            for base in {item.slug_base for item in pending} - seeded:
+                count = Item.objects.filter(slug__startswith=f'{base}-').count()
+                self.slug_suffixes[base] = max(self.slug_suffixes.get(base, 1), count + 2)
+                seeded.add(base)
+
+    def refresh_open_orders(self, item_ids):
+        orders = Order.objects.filter(ordered=False, items__item__in=item_ids).distinct()
+        if recompute_order_totals(orders):
+            user_ids = list(orders.values_list('user_id', flat=True))
+            transaction.on_commit(lambda: invalidate_cart_summary(*user_ids))
@@ -0,0 +1,84 @@
+import threading
+import time
+from dataclasses import dataclass
+from django.core.cache import cache
+from django.http import Http404
+from django.urls import reverse
+from .models import Category
+
+CATEGORY_VERSION_KEY = 'category-registry-version'
+
+
+@dataclass(frozen=True)
+class CategoryEntry:
+    id: int
+    name: str
+    slug: str
+    url: str
+
+    def __str__(self):
+        return self.name
+
+    def get_category_url(self):
+        return self.url
+
+
+def get_category_version():
+    version = cache.get(CATEGORY_VERSION_KEY)
+    if version is None:
+        cache.add(CATEGORY_VERSION_KEY, int(time.time()), None)
+        version = cache.get(CATEGORY_VERSION_KEY)
+    return version
+
+
+def bump_category_version():
+    try:
+        cache.incr(CATEGORY_VERSION_KEY)
+    except ValueError:
+        get_category_version()
+
+
+class CategoryRegistry:
+    """Every category, loaded once per worker and looked up by slug.
+
+    Each worker keeps its own copy and reloads it with a single query when
+    the version in the shared cache moves on, which any category save or
+    delete does; in between, lookups cost no queries at all.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.entries = ()
+        self.by_slug = {}
+
+    def refresh(self):
+        version = get_category_version()
+        if version != self.version:
+            with self.lock:
+                if version != self.version:
+                    # The version is read before the rows, so a change racing
+                    # the load only causes one more reload.
+                    entries = tuple(
+                        CategoryEntry(pk, name, slug, reverse('core:filter-by-category', kwargs={'slug': slug}))
+                        for pk, name, slug in Category.objects.order_by('pk').values_list('pk', 'name', 'slug')
+                    )
+                    self.entries = entries
+                    self.by_slug = {entry.slug: entry for entry in reversed(entries)}
+                    self.version = version
+        return self
+
+    def all(self):
+        return self.refresh().entries
+
+    def get(self, slug):
+        return self.refresh().by_slug.get(slug)
+
+    def get_or_404(self, slug):
+        entry = self.get(slug)
+        if entry is None:
+            raise Http404('No category matches the given query.')
+        return entry
+
+
+categories = CategoryRegistry()
@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+from .cart import get_cart_summary
+from .catalog import get_catalog_version
+from .categories import categories
+
+
+def cart(request):
+    return {
+        'cart_summary': SimpleLazyObject(lambda: get_cart_summary(request)),
+    }
+
+
+def catalog(request):
+    return {
+        'catalog_version': SimpleLazyObject(get_catalog_version),
+        'catalog_cache_timeout': settings.CATALOG_CACHE_TIMEOUT,
+        'categories': SimpleLazyObject(categories.all),
+    }
@@ -1,6 +1,7 @@
 from django import forms
 from django_countries.fields import CountryField
 from django_countries.widgets import CountrySelectWidget
+from .ref_codes import REF_CODE_LENGTH, validate_ref_code
 
 PAYMENT_CHOICES = (
     ('L', 'LiqPay (not available yet)'),
@@ -8,6 +9,17 @@ PAYMENT_CHOICES = (
 )
 
 
+class RefCodeField(forms.CharField):
+    default_validators = [validate_ref_code]
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('max_length', REF_CODE_LENGTH)
+        super().__init__(**kwargs)
+
+    def to_python(self, value):
+        return super().to_python(value).replace(' ', '').upper()
+
+
 class ReportForm(forms.Form):
     message = forms.CharField(label='Report details', widget=forms.Textarea(attrs={
         'rows': 4,
@@ -17,13 +29,13 @@ class ReportForm(forms.Form):
     }))
     phone_number = forms.CharField()
     email = forms.EmailField()
-    ref_code = forms.CharField(widget=forms.TextInput(attrs={
+    ref_code = RefCodeField(widget=forms.TextInput(attrs={
         'class': 'form-control',
     }))
 
 
 class RefundForm(forms.Form):
-    ref_code = forms.CharField()
+    ref_code = RefCodeField()
     message = forms.CharField(widget=forms.Textarea(attrs={
         'rows': 4,
     }))
@@ -0,0 +1,125 @@
+import hashlib
+import os
+import tempfile
+from dataclasses import dataclass
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from PIL import Image, ImageOps
+
+SOURCE_DIGEST_KEY = 'image-source:{}:{}:{}'
+DERIVATIVE_FORMAT = 'WEBP'
+DERIVATIVE_CONTENT_TYPE = 'image/webp'
+DERIVATIVE_EXTENSION = '.webp'
+# Characters of the source digest carried in a derivative URL's ``v`` parameter.
+VERSION_LENGTH = 16
+
+
+class DerivativeError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class Preset:
+    width: int
+    height: int
+    # Cropped presets fill the box exactly; the others fit inside it.
+    crop: bool = True
+
+    @property
+    def signature(self):
+        quality = settings.IMAGE_DERIVATIVE_QUALITY
+        return f'{self.width}x{self.height}:{"crop" if self.crop else "fit"}:{DERIVATIVE_FORMAT}:{quality}'
+
+
+PRESETS = {
+    'thumb': Preset(100, 100),
+    'card': Preset(210, 243),
+    'detail': Preset(372, 431),
+    'zoom': Preset(1600, 1600, crop=False),
+}
+
+
+def derivative_url(name, preset):
+    """URL of the derivative, versioned by the digest of its source.
+
+    A replaced original gets a new URL, so the versioned one can be cached
+    for good. Missing sources get the bare URL, which answers 404.
+    """
+    url = reverse('core:image-derivative', kwargs={'preset': preset, 'name': name})
+    try:
+        return f'{url}?v={source_version(name)}'
+    except DerivativeError:
+        return url
+
+
+def source_digest(name):
+    """Hash of the original's bytes, cached for as long as its size and mtime hold."""
+    path = default_storage.path(name)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        raise DerivativeError(f'{name} does not exist.')
+    key = SOURCE_DIGEST_KEY.format(hashlib.md5(name.encode()).hexdigest(), stat.st_size, stat.st_mtime_ns)
+    digest = cache.get(key)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as source:
+            for chunk in iter(lambda: source.read(1 << 16), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        cache.set(key, digest, None)
+    return digest
+
+
+def source_version(name):
+    return source_digest(name)[:VERSION_LENGTH]
+
+
+def derivative_path(name, preset):
+    """Where the derivative of ``name`` lives: the hash of its source and preset.
+
+    Identical uploads share one file, and a replaced original or a changed
+    preset gets a new path instead of serving a stale rendition.
+    """
+    key = hashlib.sha256(f'{source_digest(name)}:{PRESETS[preset].signature}'.encode()).hexdigest()
+    return os.path.join(settings.IMAGE_DERIVATIVE_ROOT, key[:2], key + DERIVATIVE_EXTENSION)
+
+
+def render_derivative(name, preset, target):
+    spec = PRESETS[preset]
+    try:
+        with Image.open(default_storage.path(name)) as original:
+            image = ImageOps.exif_transpose(original)
+            if spec.crop:
+                image = ImageOps.fit(image, (spec.width, spec.height), Image.LANCZOS)
+            else:
+                image.thumbnail((spec.width, spec.height), Image.LANCZOS)
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if image.mode in ('LA', 'P', 'PA') else 'RGB')
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # Write next to the target and rename, so that concurrent workers
+            # never serve a half-written file.
+            fd, temporary = tempfile.mkstemp(dir=os.path.dirname(target), suffix=DERIVATIVE_EXTENSION)
+            try:
+                with os.fdopen(fd, 'wb') as output:
+                    image.save(output, DERIVATIVE_FORMAT, quality=settings.IMAGE_DERIVATIVE_QUALITY, method=4)
+                os.replace(temporary, target)
+            except BaseException:
+                os.unlink(temporary)
+                raise
+    except (OSError, Image.DecompressionBombError) as error:
+        raise DerivativeError(f'Cannot render {name}: {error}')
+
+
+def get_derivative(name, preset, force=False):
+    """Return the path of the derivative, rendering it on first use.
+
+    Returns a ``(path, created)`` pair.
+    """
+    path = derivative_path(name, preset)
+    if force or not os.path.exists(path):
+        render_derivative(name, preset, path)
+        return path, True
+    return path, False
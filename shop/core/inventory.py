@@ -0,0 +1,209 @@
+"""Stock kept in sharded counters and reserved by conditional UPDATEs.
+
+An item's stock is spread over ``Item.stock_shards`` ``StockShard`` rows.
+Reserving tries one ``UPDATE ... SET quantity = quantity - n WHERE
+quantity >= n`` on a random shard and moves on to the next one if it
+comes back empty, so concurrent checkouts of the same item mostly touch
+different rows, never read before they write and can never drive a
+counter below zero. Only when no single shard holds enough are the shards
+locked and drained together.
+
+Carts hold what they reserve in ``StockHold`` rows. Every change to what
+a cart holds renews all of its holds, which otherwise expire after
+``STOCK_HOLD_TTL`` seconds; ``release_expired`` hands abandoned holds
+back in bulk.
+"""
+import random
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, F, Q, Sum, Value, When
+from django.utils import timezone
+from .models import Item, StockHold, StockShard
+
+
+class OutOfStock(Exception):
+    def __init__(self, item_id, quantity):
+        super().__init__(f'Item {item_id} has fewer than {quantity} unit(s) in stock.')
+        self.item_id = item_id
+        self.quantity = quantity
+
+
+def hold_expiry():
+    return timezone.now() + timedelta(seconds=settings.STOCK_HOLD_TTL)
+
+
+def set_stock(item, quantity, shards=None):
+    """Replace the stock of ``item`` with ``quantity`` units spread evenly over ``shards`` counters.
+
+    ``shards`` defaults to the item's current count, or 1; 0 stops tracking.
+    """
+    shards = (item.stock_shards or 1) if shards is None else shards
+    with transaction.atomic():
+        StockShard.objects.filter(item=item).delete()
+        StockShard.objects.bulk_create([
+            StockShard(item=item, shard=shard, quantity=quantity // shards + (shard < quantity % shards))
+            for shard in range(shards)
+        ])
+        Item.objects.filter(pk=item.pk).update(stock_shards=shards)
+    item.stock_shards = shards
+
+
+def restock(item, quantity):
+    """Add ``quantity`` units to the stock of ``item``, spread evenly over its shards.
+
+    The shards are incremented in place, so units reserved meanwhile stay
+    reserved. An untracked item starts being tracked over ``STOCK_SHARDS``
+    counters.
+    """
+    with transaction.atomic():
+        shards = Item.objects.select_for_update().values_list('stock_shards', flat=True).get(pk=item.pk)
+        if not shards:
+            set_stock(item, quantity, settings.STOCK_SHARDS)
+            return
+        release({(item.pk, shard): quantity // shards + (shard < quantity % shards) for shard in range(shards)})
+    item.stock_shards = shards
+
+
+def get_stock(item):
+    """Units of ``item`` left, or None if its stock is not tracked."""
+    if not item.stock_shards:
+        return None
+    return StockShard.objects.filter(item=item).aggregate(quantity=Sum('quantity'))['quantity'] or 0
+
+
+def reserve(item, quantity):
+    """Take ``quantity`` units of ``item``, returning ``[(shard, units)]``; untracked items return ``[]``.
+
+    Must run inside the caller's transaction. Raises ``OutOfStock``.
+    """
+    shards = item.stock_shards
+    if not shards:
+        return []
+    start = random.randrange(shards)
+    for n in range(shards):
+        shard = (start + n) % shards
+        if StockShard.objects.filter(item_id=item.pk, shard=shard, quantity__gte=quantity).update(
+                quantity=F('quantity') - quantity):
+            return [(shard, quantity)]
+    # No single shard holds enough: drain several under row locks.
+    rows = list(StockShard.objects.select_for_update().filter(item_id=item.pk, quantity__gt=0).order_by('shard'))
+    if sum(row.quantity for row in rows) < quantity:
+        raise OutOfStock(item.pk, quantity)
+    taken = []
+    for row in rows:
+        units = min(row.quantity, quantity - sum(units for _, units in taken))
+        if units:
+            row.quantity -= units
+            taken.append((row.shard, units))
+    StockShard.objects.bulk_update(rows, ['quantity'])
+    return taken
+
+
+def release(units):
+    """Give ``{(item_id, shard): units}`` back to the shards in one UPDATE."""
+    units = {key: count for key, count in units.items() if count}
+    if not units:
+        return
+    rows = Q()
+    for item_id, shard in units:
+        rows |= Q(item_id=item_id, shard=shard)
+    StockShard.objects.filter(rows).update(quantity=F('quantity') + Case(
+        *[When(item_id=item_id, shard=shard, then=Value(count)) for (item_id, shard), count in units.items()],
+        default=Value(0),
+    ))
+
+
+def hold(user, item, quantity):
+    """Reserve ``quantity`` units of ``item`` for ``user``'s cart."""
+    taken = reserve(item, quantity)
+    if taken:
+        touch(user)
+        expires_at = hold_expiry()
+        StockHold.objects.bulk_create([
+            StockHold(user=user, item=item, shard=shard, quantity=units, expires_at=expires_at)
+            for shard, units in taken
+        ])
+
+
+def unhold(user, item, quantity=None):
+    """Give back ``quantity`` units, or all, of what ``user``'s cart holds of ``item``."""
+    if not item.stock_shards:
+        return
+    holds = list(StockHold.objects.select_for_update().filter(user=user, item=item).order_by('-pk'))
+    released = defaultdict(int)
+    changed = []
+    remaining = quantity
+    for stock_hold in holds:
+        if remaining == 0:
+            break
+        units = stock_hold.quantity if remaining is None else min(stock_hold.quantity, remaining)
+        released[item.pk, stock_hold.shard] += units
+        stock_hold.quantity -= units
+        changed.append(stock_hold)
+        if remaining is not None:
+            remaining -= units
+    StockHold.objects.filter(pk__in=[h.pk for h in changed if not h.quantity]).delete()
+    StockHold.objects.bulk_update([h for h in changed if h.quantity], ['quantity'])
+    release(released)
+    touch(user)
+
+
+def touch(user):
+    """Push back the expiry of all of ``user``'s holds."""
+    StockHold.objects.filter(user=user).update(expires_at=hold_expiry())
+
+
+def claim(user, lines):
+    """Turn ``user``'s holds into sold stock for ``lines`` of ``(item, quantity)``.
+
+    Units the holds do not cover, e.g. because they expired and were swept,
+    are reserved now, raising ``OutOfStock``; units held beyond the lines
+    go back to the shards. The holds are deleted either way.
+    """
+    held = defaultdict(lambda: defaultdict(int))
+    for item_id, shard, units in StockHold.objects.select_for_update().filter(user=user).values_list(
+            'item_id', 'shard', 'quantity'):
+        held[item_id][shard] += units
+    had_holds = bool(held)
+    surplus = defaultdict(int)
+    for item, quantity in lines:
+        shards = held.pop(item.pk, {})
+        missing = quantity - sum(shards.values())
+        if missing > 0:
+            reserve(item, missing)
+        for shard, units in shards.items():
+            excess = min(units, max(-missing, 0))
+            surplus[item.pk, shard] += excess
+            missing += excess
+    for item_id, shards in held.items():
+        for shard, units in shards.items():
+            surplus[item_id, shard] += units
+    release(surplus)
+    if had_holds:
+        StockHold.objects.filter(user=user).delete()
+
+
+def release_expired(batch_size=1000, now=None):
+    """Give the stock of holds expired at ``now`` back in batches, returning how many holds were released.
+
+    Holds locked by a checkout in progress are skipped where the database
+    supports ``SKIP LOCKED``.
+    """
+    now = now or timezone.now()
+    released = 0
+    while True:
+        with transaction.atomic():
+            holds = StockHold.objects.filter(expires_at__lte=now).order_by('pk')
+            if connection.features.has_select_for_update_skip_locked:
+                holds = holds.select_for_update(skip_locked=True)
+            batch = list(holds.values_list('pk', 'item_id', 'shard', 'quantity')[:batch_size])
+            if not batch:
+                return released
+            units = defaultdict(int)
+            for _, item_id, shard, quantity in batch:
+                units[item_id, shard] += quantity
+            StockHold.objects.filter(pk__in=[row[0] for row in batch]).delete()
+            release(units)
+        released += len(batch)
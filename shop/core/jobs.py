@@ -0,0 +1,145 @@
+"""A job queue kept in the ``Job`` table and worked off by ``run_workers``.
+
+Request paths call ``enqueue``, which is one INSERT in the caller's
+transaction, so a job exists exactly when the request's own writes
+commit. Workers claim ready jobs highest priority first. Where the
+database has ``SELECT ... FOR UPDATE SKIP LOCKED`` the claim locks a
+batch and skips rows other workers hold; elsewhere, SQLite included, each
+job is taken by an UPDATE that only matches while it is still claimable,
+so two workers can never both win it.
+
+A claim is a lease of ``JOB_LEASE`` seconds: a job whose worker died is
+claimed again once it runs out. A job is deleted in the transaction its
+handler writes in, so its database writes commit at most once; effects
+outside the database, such as sending mail, may be repeated after a
+crash. A failing job is queued again after an exponential, jittered
+backoff and goes dead after its last attempt.
+"""
+import logging
+import random
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DEAD = 'Q', 'R', 'D'
+
+registry = {}
+
+
+def job(name, priority=0, max_attempts=None):
+    """Register the decorated function as the handler of jobs named ``name``.
+
+    The handler is called with the job's payload as keyword arguments.
+    """
+    def register(handler):
+        handler.job_name = name
+        handler.priority = priority
+        handler.max_attempts = max_attempts
+        registry[name] = handler
+        return handler
+    return register
+
+
+def enqueue(name, payload=None, priority=None, delay=0):
+    """Queue a ``name`` job to run ``delay`` seconds from now; returns the ``Job``."""
+    handler = registry[name]
+    return Job.objects.create(
+        name=name,
+        payload=payload or {},
+        priority=handler.priority if priority is None else priority,
+        max_attempts=handler.max_attempts or settings.JOB_MAX_ATTEMPTS,
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )
+
+
+def claimable(now):
+    return Job.objects.filter(
+        Q(state=QUEUED, run_at__lte=now) | Q(state=RUNNING, locked_until__lt=now)
+    ).order_by('-priority', 'run_at', 'pk')
+
+
+def claim(worker, limit=1, now=None):
+    """Take up to ``limit`` ready jobs for ``worker``, highest priority first."""
+    now = now or timezone.now()
+    ready = claimable(now)
+    lease = {
+        'state': RUNNING,
+        'locked_by': worker,
+        'locked_until': now + timedelta(seconds=settings.JOB_LEASE),
+        'attempts': F('attempts') + 1,
+    }
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            pks = list(ready.select_for_update(skip_locked=True).values_list('pk', flat=True)[:limit])
+            Job.objects.filter(pk__in=pks).update(**lease)
+    else:
+        pks = []
+        for pk in ready.values_list('pk', flat=True)[:limit]:
+            if claimable(now).filter(pk=pk).update(**lease):
+                pks.append(pk)
+    return list(Job.objects.filter(pk__in=pks, locked_by=worker).order_by('-priority', 'run_at', 'pk'))
+
+
+def backoff(attempts):
+    """Seconds to wait before attempt ``attempts + 1``."""
+    delay = min(settings.JOB_RETRY_BACKOFF * 2 ** (attempts - 1), settings.JOB_RETRY_BACKOFF_MAX)
+    return delay * random.uniform(0.5, 1)
+
+
+def run(job, worker):
+    """Run one claimed ``job``; returns whether it succeeded.
+
+    The handler runs in the transaction that deletes the job: a failure
+    rolls back its writes along with the deletion, and once it commits
+    the job is gone and cannot run again. Nothing is run or recorded if
+    the lease was lost to another worker meanwhile.
+    """
+    mine = Job.objects.filter(pk=job.pk, state=RUNNING, locked_by=worker)
+    try:
+        handler = registry.get(job.name)
+        if handler is None:
+            raise LookupError(f'No handler is registered for {job.name!r} jobs.')
+        with transaction.atomic():
+            deleted, _ = mine.delete()
+            if not deleted:
+                return False
+            handler(**job.payload)
+    except Exception:
+        logger.exception('Job %s failed on attempt %s of %s.', job, job.attempts, job.max_attempts)
+        failure = {'last_error': traceback.format_exc(), 'locked_by': '', 'locked_until': None}
+        if job.attempts >= job.max_attempts:
+            mine.update(state=DEAD, **failure)
+        else:
+            mine.update(state=QUEUED, run_at=timezone.now() + timedelta(seconds=backoff(job.attempts)), **failure)
+        return False
+    return True
+
+
+def work(worker, stop=None, burst=False, batch_size=1, poll_interval=1.0):
+    """Claim and run jobs until ``stop`` is set, or until none are ready if ``burst``.
+
+    Returns the number of jobs run.
+    """
+    done = 0
+    while stop is None or not stop.is_set():
+        jobs = claim(worker, batch_size)
+        if not jobs:
+            if burst or stop is None:
+                break
+            stop.wait(poll_interval)
+            continue
+        for claimed in jobs:
+            run(claimed, worker)
+            done += 1
+    return done
+
+
+def retry(jobs):
+    """Queue dead ``jobs`` to run again now with their attempts reset; returns how many."""
+    return jobs.filter(state=DEAD).update(state=QUEUED, attempts=0, run_at=timezone.now(), last_error='')
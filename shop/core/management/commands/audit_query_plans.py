@@ -0,0 +1,86 @@
+import re
+from collections import defaultdict
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from core.benchmark import build_routes, make_client
+from core.management.commands.benchmark_views import Command as BenchmarkCommand
+
+FULL_SCAN_PATTERNS = {
+    # "SCAN t" is a full table scan; "SCAN t USING [COVERING] INDEX" walks an index instead.
+    'sqlite': re.compile(r'\bSCAN (?:TABLE )?(?P<table>\w+)(?! USING| VIRTUAL)(?:\s|$)'),
+    'postgresql': re.compile(r'Seq Scan on (?P<table>\w+)'),
+}
+EXPLAIN_PREFIX = {
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+    'postgresql': 'EXPLAIN ',
+}
+AUDITED_STATEMENTS = ('SELECT', 'UPDATE', 'DELETE')
+
+
+def is_bounded_walk(sql, plan):
+    return (re.search(r'\bLIMIT\b', sql, re.IGNORECASE) is not None
+            and re.search(r'\bWHERE\b', sql, re.IGNORECASE) is None
+            and not any('TEMP B-TREE' in line for line in plan))
+
+
+class Command(BaseCommand):
+    help = 'Replay every route in core/urls.py and flag queries whose EXPLAIN plan scans a whole table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', help='Customer to log in as; defaults to the one with most orders.')
+        parser.add_argument('--ignore-table', action='append', default=[],
+                            help='Table whose full scans are expected, e.g. a small lookup table.')
+        parser.add_argument('--fail', action='store_true', help='Exit with an error if any scan is flagged.')
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        if vendor not in FULL_SCAN_PATTERNS:
+            raise CommandError(f'Query plan auditing is not supported on {vendor}.')
+        user = BenchmarkCommand().get_user(options['username'])
+        ignored = set(options['ignore_table'])
+        findings = defaultdict(list)
+
+        setup_test_environment()
+        try:
+            # Cart routes write; replay everything in a transaction that is rolled back.
+            with transaction.atomic():
+                client = make_client(user)
+                for route in build_routes(user):
+                    if route.setup:
+                        route.setup(client)
+                    with CaptureQueriesContext(connection) as captured:
+                        client.get(route.path)
+                    for query in captured:
+                        for table, plan in self.full_scans(vendor, query['sql']):
+                            if table not in ignored:
+                                findings[route.name].append((table, plan, query['sql']))
+                transaction.set_rollback(True)
+        finally:
+            teardown_test_environment()
+
+        for name, scans in sorted(findings.items()):
+            self.stdout.write(self.style.WARNING(f'{name}:'))
+            for table, plan, sql in scans:
+                self.stdout.write(f'  full scan of {table}: {plan}\n    {sql[:300]}')
+        total = sum(len(scans) for scans in findings.values())
+        if total and options['fail']:
+            raise CommandError(f'{total} full table scan(s) found.')
+        self.stdout.write(self.style.SUCCESS(f'{total} full table scan(s) found.'))
+
+    def full_scans(self, vendor, sql):
+        if not sql.lstrip().upper().startswith(AUDITED_STATEMENTS):
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(EXPLAIN_PREFIX[vendor] + sql)
+            plan = [' '.join(str(column) for column in row) for row in cursor.fetchall()]
+        # An unfiltered walk in the requested order stops at the LIMIT, which
+        # is how the first keyset page over the primary key is planned. A
+        # filtered scan under a LIMIT, like a .get() on an unindexed column,
+        # still reads the whole table when nothing matches.
+        if is_bounded_walk(sql, plan):
+            return
+        for line in plan:
+            match = FULL_SCAN_PATTERNS[vendor].search(line)
+            if match:
+                yield match.group('table'), line.strip()
@@ -0,0 +1,107 @@
+import http.client
+import itertools
+import json
+import threading
+import time
+from urllib.parse import urlsplit
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+from core.management.commands.benchmark_views import percentile
+from core.models import Category, Item
+
+
+def default_paths():
+    """The anonymous read-only pages served by ``core.async_views``, on the current data."""
+    item = Item.objects.order_by('pk').first()
+    category = Category.objects.order_by('pk').first()
+    if item is None or category is None:
+        raise CommandError('The database needs items and categories; run generate_dataset.')
+    return [
+        reverse('core:home'),
+        reverse('core:product', kwargs={'slug': item.slug}),
+        reverse('core:filter-by-category', kwargs={'slug': category.slug}),
+        reverse('core:search') + '?search=' + item.title.split()[0],
+        reverse('core:item-list'),
+    ]
+
+
+class Command(BaseCommand):
+    help = ('Load running servers with concurrent keep-alive connections and report throughput and latency '
+            'as JSON, e.g. to compare a WSGI and an ASGI deployment of the same database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', action='append', required=True, metavar='LABEL=URL',
+                            help='Server to load, e.g. wsgi=http://127.0.0.1:8000; may be repeated.')
+        parser.add_argument('--concurrency', type=int, action='append',
+                            help='Open connections per run; may be repeated. Defaults to 1, 8, 32 and 128.')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds per run.')
+        parser.add_argument('--path', action='append', help='Path to request; defaults to the read-only pages.')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+
+    def handle(self, *args, **options):
+        targets = {}
+        for target in options['target']:
+            label, _, url = target.partition('=')
+            if not url or urlsplit(url).scheme not in ('http', 'https'):
+                raise CommandError(f'Expected LABEL=http://host:port, got "{target}".')
+            targets[label] = url
+        paths = options['path'] or default_paths()
+        report = {'paths': paths, 'duration_s': options['duration'], 'targets': {}}
+        for label, url in targets.items():
+            report['targets'][label] = {
+                str(concurrency): self.run(url, paths, concurrency, options['duration'])
+                for concurrency in options['concurrency'] or [1, 8, 32, 128]
+            }
+
+        output = json.dumps(report, indent=2, sort_keys=True) + '\n'
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output, ending='')
+
+    def run(self, url, paths, concurrency, duration):
+        split = urlsplit(url)
+        connection_class = http.client.HTTPSConnection if split.scheme == 'https' else http.client.HTTPConnection
+        prefix = split.path.rstrip('/')
+        timings, errors, lock = [], [0], threading.Lock()
+        deadline = time.perf_counter() + duration
+
+        def client(offset):
+            connection = connection_class(split.netloc, timeout=30)
+            local_timings, local_errors = [], 0
+            for path in itertools.islice(itertools.cycle(paths), offset, None):
+                if time.perf_counter() >= deadline:
+                    break
+                start = time.perf_counter()
+                try:
+                    connection.request('GET', prefix + path, headers={'Accept-Encoding': 'gzip'})
+                    response = connection.getresponse()
+                    response.read()
+                    if response.status >= 500:
+                        local_errors += 1
+                    else:
+                        local_timings.append((time.perf_counter() - start) * 1000)
+                except (OSError, http.client.HTTPException):
+                    local_errors += 1
+                    connection.close()
+            connection.close()
+            with lock:
+                timings.extend(local_timings)
+                errors[0] += local_errors
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        result = {'requests': len(timings), 'errors': errors[0], 'rps': round(len(timings) / elapsed, 1)}
+        if timings:
+            result.update({
+                'p50_ms': round(percentile(timings, 50), 2),
+                'p95_ms': round(percentile(timings, 95), 2),
+                'p99_ms': round(percentile(timings, 99), 2),
+            })
+        return result
@@ -0,0 +1,114 @@
+import json
+import random
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from core.catalog import ITEMS_PER_PAGE
+from core.management.commands.benchmark_views import percentile
+from core.models import Item, OrderItem
+from core.promotions import BUY_X_GET_Y, CART_THRESHOLD, PERCENT_OFF, CompiledPromotions, Rule
+
+
+def make_rules(rng, count, items, categories):
+    """A mix like a busy sale: mostly category and item rules, a few store-wide deals and thresholds."""
+    now = timezone.now()
+    rules = []
+    for n in range(count):
+        roll = rng.random()
+        window = {'starts_at': now - timedelta(days=1), 'ends_at': now + timedelta(days=rng.randint(1, 30))}
+        if roll < 0.05:
+            rules.append(Rule(n, f'Spend {n}', CART_THRESHOLD, min_subtotal=rng.choice([50, 100, 200]),
+                              percent=rng.choice([5, 10]), **window))
+        elif roll < 0.1:
+            rules.append(Rule(n, f'Store {n}', PERCENT_OFF, percent=rng.uniform(1, 5), **window))
+        elif roll < 0.3:
+            rules.append(Rule(n, f'Bundle {n}', BUY_X_GET_Y, item_id=rng.choice(items).pk,
+                              buy_quantity=2, get_quantity=1, **window))
+        elif roll < 0.6:
+            rules.append(Rule(n, f'Category {n}', PERCENT_OFF, category_id=rng.choice(categories),
+                              percent=rng.uniform(5, 40), **window))
+        else:
+            rules.append(Rule(n, f'Item {n}', PERCENT_OFF, item_id=rng.choice(items).pk,
+                              percent=rng.uniform(5, 50), **window))
+    return rules
+
+
+def scan_price(rules, lines, now):
+    """The unindexed baseline: every rule is tested against every line."""
+    total = 0
+    for line in lines:
+        price = line.item.price
+        best = line.quantity * (line.item.discount_price or price)
+        for rule in rules:
+            if rule.kind == CART_THRESHOLD or not rule.is_live(now):
+                continue
+            if rule.item_id is not None and rule.item_id != line.item_id:
+                continue
+            if rule.category_id is not None and rule.category_id != line.item.category_id:
+                continue
+            best = min(best, rule.line_total(price, line.quantity))
+        total += best
+    return total
+
+
+class Command(BaseCommand):
+    help = ('Time pricing carts and listing pages with the compiled promotion rules against testing every '
+            'rule on every line, and report the timings as JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rules', type=int, action='append',
+                            help='Active rules; may be repeated. Defaults to 10, 100 and 1000.')
+        parser.add_argument('--lines', type=int, default=50, help='Lines per cart.')
+        parser.add_argument('--items', type=int, default=5000, help='Catalog size.')
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--iterations', type=int, default=500)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        # Unsaved rows: the engine works on in-memory lines, so no database is needed.
+        categories = list(range(1, options['categories'] + 1))
+        items = []
+        for pk in range(1, options['items'] + 1):
+            price = round(rng.lognormvariate(3.5, 0.8), 2)
+            items.append(Item(pk=pk, category_id=rng.choice(categories), price=price,
+                              discount_price=round(price * 0.8, 2) if rng.random() < 0.2 else None))
+        carts = [
+            [OrderItem(item=item, quantity=rng.randint(1, 4)) for item in rng.sample(items, options['lines'])]
+            for _ in range(50)
+        ]
+        pages = [rng.sample(items, ITEMS_PER_PAGE) for _ in range(50)]
+        report = {'lines': options['lines'], 'iterations': options['iterations'], 'rules': {}}
+        for count in options['rules'] or [10, 100, 1000]:
+            rules = make_rules(rng, count, items, categories)
+            compiled = CompiledPromotions(rules)
+            now = timezone.now()
+            report['rules'][str(count)] = {
+                'cart_compiled': self.measure(lambda n: compiled.price_cart(carts[n % len(carts)], now),
+                                              options['iterations']),
+                'cart_scan': self.measure(lambda n: scan_price(rules, carts[n % len(carts)], now),
+                                          options['iterations']),
+                'listing_page_compiled': self.measure(lambda n: compiled.annotate_items(pages[n % len(pages)], now),
+                                                      options['iterations']),
+            }
+
+        output = json.dumps(report, indent=2, sort_keys=True) + '\n'
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output, ending='')
+
+    def measure(self, run, iterations):
+        timings = []
+        for n in range(iterations):
+            start = time.perf_counter()
+            run(n)
+            timings.append((time.perf_counter() - start) * 1e6)
+        return {
+            'p50_us': round(percentile(timings, 50), 1),
+            'p95_us': round(percentile(timings, 95), 1),
+            'p99_us': round(percentile(timings, 99), 1),
+        }
@@ -0,0 +1,85 @@
+import json
+import statistics
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from core.benchmark import build_routes, make_client
+from core.models import Item, Order
+
+
+def percentile(samples, p):
+    if len(samples) == 1:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method='inclusive')[p - 1]
+
+
+class Command(BaseCommand):
+    help = 'Request every route in core/urls.py through the test client and report latency and query counts as JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--username', help='Customer to log in as; defaults to the one with most orders.')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['username'])
+        setup_test_environment()
+        try:
+            client = make_client(user)
+            report = {
+                'dataset': {
+                    'items': Item.objects.count(),
+                    'orders': Order.objects.count(),
+                    'user_orders': Order.objects.filter(user=user).count(),
+                },
+                'routes': {},
+            }
+            for route in build_routes(user):
+                report['routes'][route.name] = self.measure(client, route, options['iterations'], options['warmup'])
+        finally:
+            teardown_test_environment()
+
+        output = json.dumps(report, indent=2, sort_keys=True) + '\n'
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output, ending='')
+
+    def get_user(self, username):
+        if username:
+            try:
+                return User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(f'User "{username}" does not exist.')
+        user = (User.objects.filter(order__ordered=False).filter(order__ordered=True)
+                .annotate(orders=Count('order')).order_by('-orders').first())
+        if user is None:
+            raise CommandError('No customer with an open cart and placed orders; run generate_dataset first.')
+        return user
+
+    def measure(self, client, route, iterations, warmup):
+        timings, queries, statuses = [], [], set()
+        for n in range(warmup + iterations):
+            if route.setup:
+                route.setup(client)
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response = client.get(route.path)
+                elapsed = (time.perf_counter() - start) * 1000
+            if n >= warmup:
+                timings.append(elapsed)
+                queries.append(len(captured))
+                statuses.add(response.status_code)
+        return {
+            'path': route.path,
+            'status': sorted(statuses),
+            'queries': {'min': min(queries), 'max': max(queries)},
+            'p50_ms': round(percentile(timings, 50), 2),
+            'p95_ms': round(percentile(timings, 95), 2),
+            'p99_ms': round(percentile(timings, 99), 2),
+        }
@@ -0,0 +1,26 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from core.archive import archive_orders, delete_stale_carts, months_before
+
+
+class Command(BaseCommand):
+    help = ('Delete carts nobody has touched for a while and move old placed orders into the archive tables, '
+            'in batches; schedule it daily.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cart-age-days', type=int, default=settings.STALE_CART_DAYS,
+                            help='Delete open carts idle for longer than this.')
+        parser.add_argument('--archive-after-months', type=int, default=settings.ORDER_ARCHIVE_MONTHS,
+                            help='Archive placed orders older than this; 0 disables archiving.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        deleted = delete_stale_carts(timezone.now() - timedelta(days=options['cart_age_days']), batch_size)
+        archived = 0
+        if options['archive_after_months']:
+            before = months_before(timezone.localdate(), options['archive_after_months'])
+            archived = archive_orders(before, batch_size)
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} stale cart(s) and archived {archived} order(s).'))
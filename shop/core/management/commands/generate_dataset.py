@@ -0,0 +1,166 @@
+import random
+from itertools import accumulate
+from datetime import timedelta
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import DateTimeField
+from django.db.models.functions import Cast
+from django.utils import timezone
+from django.utils.text import slugify
+from core.catalog import bump_catalog_version
+from core.models import BillingAddress, Category, Item, Order, OrderItem, StockShard, recompute_order_totals
+from core.rollups import rebuild as rebuild_rollups
+from core.search import get_search_backend
+from core.ref_codes import allocator
+
+WORDS = (
+    'classic slim cotton linen denim wool leather canvas summer winter vintage urban sport travel '
+    'organic light heavy soft casual formal oversized cropped striped plain printed knitted'
+).split()
+NOUNS = 'shirt jacket coat dress skirt jeans sweater hoodie sneakers boots scarf hat bag belt socks'.split()
+
+
+def zipf_weights(n, s=1.1):
+    return [1 / (rank ** s) for rank in range(1, n + 1)]
+
+
+def geometric(rng, mean, maximum):
+    """Line counts: most carts are small, a few are large."""
+    p = 1 / mean
+    n = 1
+    while n < maximum and rng.random() > p:
+        n += 1
+    return n
+
+
+class Command(BaseCommand):
+    help = 'Generate a synthetic catalog, customers, open carts and order history with bulk inserts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--items', type=int, default=5000)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--carts', type=int, default=300, help='Users with an open cart.')
+        parser.add_argument('--orders', type=int, default=10000, help='Placed orders to generate.')
+        parser.add_argument('--stock', type=int, default=0,
+                            help='Units in stock per item; 0 leaves stock untracked.')
+        parser.add_argument('--stock-shards', type=int, default=4, help='Counters to spread each item\'s stock over.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        prefix = f'gen{options["seed"]}'
+        with transaction.atomic():
+            categories = Category.objects.bulk_create([
+                Category(name=f'{rng.choice(WORDS).title()} {noun.title()}s {n}', slug=f'{prefix}-{noun}s-{n}')
+                for n, noun in enumerate(rng.choices(NOUNS, k=options['categories']))
+            ])
+            items = self.create_items(rng, prefix, categories, options['items'], batch_size)
+            if options['stock']:
+                self.create_stock(items, options['stock'], options['stock_shards'], batch_size)
+            users = self.create_users(prefix, options['users'], batch_size)
+            self.create_orders(rng, users, items, options['orders'], batch_size)
+            self.create_carts(rng, users[:options['carts']], items, batch_size)
+            recompute_order_totals(Order.objects.filter(user__in=users, ordered=False), batch_size=batch_size)
+            rebuild_rollups(batch_size=batch_size)
+        get_search_backend().rebuild()
+        bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(categories)} categories, {len(items)} items, {len(users)} users, '
+            f'{options["orders"]} orders and {min(options["carts"], len(users))} open carts.'
+        ))
+
+    def create_items(self, rng, prefix, categories, count, batch_size):
+        category_for = rng.choices(categories, weights=zipf_weights(len(categories)), k=count)
+        items = []
+        for n, category in enumerate(category_for):
+            title = f'{rng.choice(WORDS).title()} {rng.choice(WORDS)} {rng.choice(NOUNS)}'
+            price = round(rng.lognormvariate(3.5, 0.8), 2)
+            on_sale = rng.random() < 0.2
+            items.append(Item(
+                title=title,
+                price=price,
+                discount_price=round(price * rng.uniform(0.6, 0.9), 2) if on_sale else None,
+                category=category,
+                label=rng.choice('PSD'),
+                description=' '.join(rng.choices(WORDS + NOUNS, k=rng.randint(8, 40))),
+                slug=f'{prefix}-{slugify(title)}-{n}',
+                image='item.jpg',
+            ))
+        return Item.objects.bulk_create(items, batch_size=batch_size)
+
+    def create_stock(self, items, stock, shards, batch_size):
+        StockShard.objects.bulk_create([
+            StockShard(item=item, shard=shard, quantity=stock // shards + (shard < stock % shards))
+            for item in items for shard in range(shards)
+        ], batch_size=batch_size)
+        Item.objects.filter(pk__in=[item.pk for item in items]).update(stock_shards=shards)
+
+    def create_users(self, prefix, count, batch_size):
+        password = make_password('password')
+        User.objects.bulk_create([
+            User(username=f'{prefix}-user{n}', email=f'{prefix}-user{n}@example.com', password=password)
+            for n in range(count)
+        ], batch_size=batch_size)
+        return list(User.objects.filter(username__startswith=f'{prefix}-user').order_by('pk'))
+
+    def create_orders(self, rng, users, items, count, batch_size):
+        now = timezone.now()
+        item_weights = list(accumulate(zipf_weights(len(items), s=0.8)))
+        # A few loyal customers place most of the orders.
+        buyers = rng.choices(users, weights=[rng.paretovariate(1.2) for _ in users], k=count)
+        ref_codes = iter(allocator.allocate(count))
+        addresses = {
+            address.user_id: address for address in BillingAddress.objects.bulk_create([
+                BillingAddress(user=user, first_name=user.username, last_name='Customer', email=user.email,
+                               phone_number='0500000000', street_address=f'{n} Main St', country='UA',
+                               zip=f'{n % 100000:05d}')
+                for n, user in enumerate(set(buyers))
+            ], batch_size=batch_size)
+        }
+        for start in range(0, count, batch_size):
+            orders, lines = [], []
+            for user in buyers[start:start + batch_size]:
+                placed = now - timedelta(days=rng.expovariate(1 / 120))
+                chosen = set(rng.choices(items, cum_weights=item_weights, k=geometric(rng, 2.5, 15)))
+                order_lines = [
+                    OrderItem(user=user, item=item, quantity=geometric(rng, 1.3, 5), ordered=True,
+                              unit_price=item.price, unit_discount_price=item.discount_price,
+                              category_id=item.category_id)
+                    for item in chosen
+                ]
+                subtotal = sum(line.get_total_item_price() for line in order_lines)
+                orders.append(Order(user=user, ref_code=next(ref_codes), ordered_date=placed.date(), ordered=True,
+                                    billing_address=addresses[user.pk], received=rng.random() < 0.8,
+                                    subtotal=subtotal,
+                                    discount=subtotal - sum(line.get_final_price() for line in order_lines),
+                                    item_count=len(order_lines)))
+                lines.append(order_lines)
+            self.link_lines(Order.objects.bulk_create(orders), lines)
+        # start_date is auto_now_add, so backdate it to the order date once the rows exist.
+        Order.objects.filter(user__in=users, ordered=True).update(
+            start_date=Cast('ordered_date', output_field=DateTimeField()))
+
+    def create_carts(self, rng, users, items, batch_size):
+        orders = Order.objects.bulk_create([Order(user=user, ordered_date=timezone.now()) for user in users],
+                                           batch_size=batch_size)
+        lines = [
+            [OrderItem(user=order.user, item=item) for item in rng.sample(items, geometric(rng, 3, 12))]
+            for order in orders
+        ]
+        self.link_lines(orders, lines)
+
+    def link_lines(self, orders, lines):
+        created = OrderItem.objects.bulk_create([line for order_lines in lines for line in order_lines])
+        through = Order.items.through
+        links = []
+        position = 0
+        for order, order_lines in zip(orders, lines):
+            for line in created[position:position + len(order_lines)]:
+                links.append(through(order_id=order.pk, orderitem_id=line.pk))
+            position += len(order_lines)
+        through.objects.bulk_create(links)
@@ -0,0 +1,40 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from core.images import PRESETS, DerivativeError, get_derivative
+from core.models import Item
+
+
+class Command(BaseCommand):
+    help = 'Render every image preset for the whole catalog ahead of the first request.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--preset', action='append', choices=sorted(PRESETS),
+                            help='Preset to render; may be repeated. Defaults to all of them.')
+        parser.add_argument('--force', action='store_true', help='Re-render derivatives that already exist.')
+        parser.add_argument('--workers', type=int, default=4, help='Images rendered in parallel.')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1.')
+        presets = options['preset'] or sorted(PRESETS)
+        names = Item.objects.exclude(image='').order_by().values_list('image', flat=True).distinct()
+        jobs = ((name, preset) for name in names.iterator() for preset in presets)
+        created = existing = failed = 0
+
+        def render(job):
+            try:
+                return get_derivative(*job, force=options['force'])[1]
+            except DerivativeError as error:
+                self.stderr.write(str(error))
+
+        # Pillow releases the GIL while resizing and encoding, so threads scale.
+        with ThreadPoolExecutor(options['workers']) as pool:
+            for result in pool.map(render, jobs):
+                if result is None:
+                    failed += 1
+                elif result:
+                    created += 1
+                else:
+                    existing += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Rendered {created} derivative(s); {existing} already existed, {failed} failed.'))
@@ -0,0 +1,39 @@
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from core.catalog_io import FORMATS, CatalogImporter, guess_format, read_rows
+
+
+class Command(BaseCommand):
+    help = ('Create and update items from a CSV or JSON lines file with the columns slug, title, category, '
+            'price, discount_price, label, description and image. Rows whose slug names an item update it; '
+            'the rest create items.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to read, or - for standard input.')
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to jsonl for .jsonl files, else csv.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or guess_format(path)
+        start = time.monotonic()
+
+        def progress(importer):
+            if options['verbosity'] > 1:
+                self.stderr.write(f'{importer.rows} rows, {importer.rows / (time.monotonic() - start):.0f} rows/s')
+
+        try:
+            stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        except OSError as e:
+            raise CommandError(f'Cannot read {path}: {e}')
+        with stream:
+            importer = CatalogImporter(batch_size=options['batch_size']).run(read_rows(stream, fmt), progress)
+        elapsed = time.monotonic() - start
+        for error in importer.errors:
+            self.stderr.write(f'Skipped {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Read {importer.rows} row(s) in {elapsed:.1f}s ({importer.rows / max(elapsed, 1e-6):.0f} rows/s): '
+            f'created {importer.created} item(s) and {importer.created_categories} category(ies), '
+            f'updated {importer.updated}, left {importer.unchanged} unchanged and skipped {importer.skipped}.'
+        ))
@@ -0,0 +1,21 @@
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from core.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily sales rollups from placed orders, e.g. to backfill or repair a date range.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='First day to recompute, as YYYY-MM-DD. Defaults to all history.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = date.fromisoformat(options['since'])
+            except ValueError:
+                raise CommandError(f'Expected --since as YYYY-MM-DD, got "{options["since"]}".')
+        written = rebuild(since, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} rollup row(s).'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from core.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product search index from scratch.'
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        indexed = backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} item(s) with {type(backend).__name__}.'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from core.models import Order, recompute_order_totals
+
+
+class Command(BaseCommand):
+    help = 'Backfill or repair the stored subtotal, discount and item count of orders.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--open-only', action='store_true',
+                            help='Only recompute carts that have not been checked out.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        orders = Order.objects.all()
+        if options['open_only']:
+            orders = orders.filter(ordered=False)
+        changed = recompute_order_totals(orders, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Updated totals of {changed} order(s).'))
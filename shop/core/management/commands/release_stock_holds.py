@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from core.inventory import release_expired
+
+
+class Command(BaseCommand):
+    help = 'Give the stock held by abandoned carts back once their holds expire; run it every few minutes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        released = release_expired(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Released {released} expired stock hold(s).'))
@@ -0,0 +1,43 @@
+import os
+import signal
+import socket
+import threading
+from django.core.management.base import BaseCommand
+from django.db import connection
+from core.jobs import work
+
+
+class Command(BaseCommand):
+    help = ('Run a pool of worker threads that work off the background job queue until stopped with '
+            'SIGINT or SIGTERM, or until it is empty with --burst.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Worker threads.')
+        parser.add_argument('--batch-size', type=int, default=1, help='Jobs each worker claims at a time.')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds an idle worker waits before looking for jobs again.')
+        parser.add_argument('--burst', action='store_true', help='Exit once no job is ready.')
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stop.set())
+        name = f'{socket.gethostname()}:{os.getpid()}'
+        done = [0] * options['workers']
+
+        def worker(n):
+            try:
+                done[n] = work(f'{name}:{n}', stop, burst=options['burst'], batch_size=options['batch_size'],
+                               poll_interval=options['poll_interval'])
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(n,), name=f'job-worker-{n}')
+                   for n in range(options['workers'])]
+        for thread in threads:
+            thread.start()
+        # Joining with a timeout keeps the main thread free to take signals.
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(0.5)
+        self.stdout.write(self.style.SUCCESS(f'Ran {sum(done)} job(s).'))
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import threading
+import time
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+from django.utils.deprecation import MiddlewareMixin
+
+logger = logging.getLogger('core.performance')
+
+_view_stats = {}
+_view_stats_lock = threading.Lock()
+
+
+def query_budget(budget):
+    """Declare the most queries a function view may run per request."""
+    def decorator(view):
+        view.query_budget = budget
+        return view
+    return decorator
+
+
+def get_query_budget(view):
+    """The budget declared on a view function, view class or viewset."""
+    for target in (view, getattr(view, 'view_class', None), getattr(view, 'cls', None)):
+        budget = getattr(target, 'query_budget', None)
+        if budget is not None:
+            return budget
+    return getattr(settings, 'QUERY_BUDGET_DEFAULT', None)
+
+
+class QueryStats:
+    """Database execute wrapper counting and timing every query it sees."""
+
+    def __init__(self, keep_slowest=3):
+        self.count = 0
+        self.duration = 0.0
+        self.keep_slowest = keep_slowest
+        self.slowest = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.count += 1
+            self.duration += duration
+            self.slowest.append((duration, sql))
+            self.slowest.sort(key=lambda query: query[0], reverse=True)
+            del self.slowest[self.keep_slowest:]
+
+    def capture(self):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(self))
+        return stack
+
+
+def record_view_stats(view_name, stats):
+    with _view_stats_lock:
+        totals = _view_stats.setdefault(view_name, {
+            'requests': 0, 'queries': 0, 'sql_ms': 0.0, 'max_queries': 0, 'slowest': [],
+        })
+        totals['requests'] += 1
+        totals['queries'] += stats.count
+        totals['sql_ms'] += stats.duration * 1000
+        totals['max_queries'] = max(totals['max_queries'], stats.count)
+        totals['slowest'] = sorted(totals['slowest'] + stats.slowest, key=lambda query: query[0],
+                                   reverse=True)[:stats.keep_slowest]
+
+
+def get_view_stats():
+    """Per-view query counts and SQL time recorded by this process."""
+    with _view_stats_lock:
+        return {name: dict(totals) for name, totals in _view_stats.items()}
+
+
+class QueryInstrumentationMiddleware(MiddlewareMixin):
+    """Counts and times the SQL run for each request.
+
+    The figures are logged to ``core.performance`` at DEBUG level and
+    accumulated per resolved view name, and a warning is logged whenever a
+    view runs more queries than its declared ``query_budget`` or spends
+    more than ``SQL_TIME_BUDGET_MS`` in the database. They tell a client
+    which endpoints are expensive, so the ``Server-Timing`` header only
+    carries them when ``SERVER_TIMING`` is on, as it is under ``DEBUG``.
+
+    Under ASGI it stays async, so async views are not forced onto a
+    thread; database connections follow the request's context into
+    ``sync_to_async`` calls, and so does the wrapper.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.keep_slowest = getattr(settings, 'QUERY_INSTRUMENTATION_SLOWEST', 3)
+        self.time_budget = getattr(settings, 'SQL_TIME_BUDGET_MS', None)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = QueryStats(self.keep_slowest)
+        start = time.perf_counter()
+        with stats.capture():
+            response = self.get_response(request)
+        return self.report(request, response, stats, start)
+
+    async def __acall__(self, request):
+        stats = QueryStats(self.keep_slowest)
+        start = time.perf_counter()
+        with stats.capture():
+            response = await self.get_response(request)
+        return self.report(request, response, stats, start)
+
+    def report(self, request, response, stats, start):
+        total_ms = (time.perf_counter() - start) * 1000
+        sql_ms = stats.duration * 1000
+        if getattr(settings, 'SERVER_TIMING', settings.DEBUG):
+            response['Server-Timing'] = (
+                f'db;dur={sql_ms:.1f};desc="{stats.count} queries", app;dur={total_ms:.1f}'
+            )
+
+        match = request.resolver_match
+        logger.debug('%s %s ran %d queries in %.1f ms of SQL, %.1f ms in all', request.method,
+                     match.view_name if match else request.path, stats.count, sql_ms, total_ms)
+        if match is None:
+            return response
+        record_view_stats(match.view_name, stats)
+        budget = get_query_budget(match.func)
+        over_count = budget is not None and stats.count > budget
+        over_time = self.time_budget is not None and sql_ms > self.time_budget
+        if over_count or over_time:
+            logger.warning(
+                '%s ran %d queries (budget %s) in %.1f ms of SQL; slowest: %s',
+                match.view_name, stats.count, budget, sql_ms,
+                '; '.join(f'{duration * 1000:.1f} ms {sql[:200]}' for duration, sql in stats.slowest),
+            )
+        return response
@@ -0,0 +1,55 @@
+# Generated by Django 4.0.2 on 2026-10-18 20:46
+
+from django.db import migrations, models
+from django.db.models import Case, Count, F, FloatField, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+
+def order_line_totals(prefix=''):
+    quantity = F(f'{prefix}quantity')
+    price = F(f'{prefix}item__price')
+    discount_price = F(f'{prefix}item__discount_price')
+    saved = Case(
+        When(**{f'{prefix}item__discount_price__gt': 0}, then=quantity * (price - discount_price)),
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+    return {
+        'subtotal': Coalesce(Sum(quantity * price, output_field=FloatField()), Value(0.0)),
+        'discount': Coalesce(Sum(saved), Value(0.0)),
+        'item_count': Count(f'{prefix}id'),
+    }
+
+
+def backfill_order_totals(apps, schema_editor):
+    Order = apps.get_model('core', 'Order')
+    through = Order.items.through
+    rows = through.objects.values('order_id').annotate(**order_line_totals('orderitem__'))
+    for row in rows.iterator():
+        Order.objects.filter(pk=row.pop('order_id')).update(**row)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0033_alter_category_slug'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='discount',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='subtotal',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(backfill_order_totals, migrations.RunPython.noop),
+    ]
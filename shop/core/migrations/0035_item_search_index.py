@@ -0,0 +1,34 @@
+from django.db import migrations
+
+CREATE_TABLE_SQL = (
+    'CREATE VIRTUAL TABLE IF NOT EXISTS core_item_search '
+    "USING fts5(title, description, category, tokenize='unicode61 remove_diacritics 2')"
+)
+POPULATE_SQL = (
+    'INSERT INTO core_item_search (rowid, title, description, category) '
+    'SELECT item.id, item.title, item.description, category.name '
+    'FROM core_item item INNER JOIN core_category category ON category.id = item.category_id'
+)
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(CREATE_TABLE_SQL)
+    schema_editor.execute(POPULATE_SQL)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS core_item_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0034_order_totals'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
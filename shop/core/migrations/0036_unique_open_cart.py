@@ -0,0 +1,70 @@
+# Generated by Django 4.0.2 on 2026-10-18 20:48
+
+from django.db import migrations, models
+from django.db.models import Case, Count, F, FloatField, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+
+def order_line_totals(prefix=''):
+    quantity = F(f'{prefix}quantity')
+    price = F(f'{prefix}item__price')
+    discount_price = F(f'{prefix}item__discount_price')
+    saved = Case(
+        When(**{f'{prefix}item__discount_price__gt': 0}, then=quantity * (price - discount_price)),
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+    return {
+        'subtotal': Coalesce(Sum(quantity * price, output_field=FloatField()), Value(0.0)),
+        'discount': Coalesce(Sum(saved), Value(0.0)),
+        'item_count': Count(f'{prefix}id'),
+    }
+
+
+def merge_duplicate_carts(apps, schema_editor):
+    Order = apps.get_model('core', 'Order')
+    OrderItem = apps.get_model('core', 'OrderItem')
+    # Lines dropped by the old remove views were left behind, open but in no order.
+    OrderItem.objects.filter(ordered=False).exclude(order__ordered=False).delete()
+
+    users = Order.objects.filter(ordered=False).values('user_id').annotate(n=Count('id')).filter(n__gt=1)
+    for row in users:
+        keep, *extra = Order.objects.filter(user_id=row['user_id'], ordered=False).order_by('pk')
+        for order in extra:
+            keep.items.add(*order.items.all())
+            order.delete()
+
+    lines = (OrderItem.objects.filter(ordered=False).values('user_id', 'item_id')
+             .annotate(n=Count('id'), total_quantity=Sum('quantity')).filter(n__gt=1))
+    for row in lines:
+        keep, *extra = OrderItem.objects.filter(
+            user_id=row['user_id'], item_id=row['item_id'], ordered=False).order_by('pk')
+        keep.quantity = row['total_quantity']
+        keep.save(update_fields=['quantity'])
+        OrderItem.objects.filter(pk__in=[line.pk for line in extra]).delete()
+
+    Order.objects.filter(ordered=False).update(subtotal=0, discount=0, item_count=0)
+    through = Order.items.through
+    totals = through.objects.filter(order__ordered=False).values('order_id').annotate(
+        **order_line_totals('orderitem__'))
+    for row in totals:
+        Order.objects.filter(pk=row.pop('order_id')).update(**row)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0035_item_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_carts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(('ordered', False)), fields=('user',), name='unique_open_order'),
+        ),
+        migrations.AddConstraint(
+            model_name='orderitem',
+            constraint=models.UniqueConstraint(condition=models.Q(('ordered', False)), fields=('user', 'item'), name='unique_open_order_item'),
+        ),
+    ]
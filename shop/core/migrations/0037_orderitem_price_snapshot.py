@@ -0,0 +1,35 @@
+# Generated by Django 4.0.2 on 2026-10-18 20:49
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def snapshot_ordered_prices(apps, schema_editor):
+    Item = apps.get_model('core', 'Item')
+    OrderItem = apps.get_model('core', 'OrderItem')
+    items = Item.objects.filter(pk=OuterRef('item_id'))
+    OrderItem.objects.filter(ordered=True).update(
+        unit_price=Subquery(items.values('price')),
+        unit_discount_price=Subquery(items.values('discount_price')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0036_unique_open_cart'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='unit_discount_price',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='unit_price',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.RunPython(snapshot_ordered_prices, migrations.RunPython.noop),
+    ]
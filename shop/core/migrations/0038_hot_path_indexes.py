@@ -0,0 +1,26 @@
+# Generated by Django 4.0.2 on 2026-10-18 20:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0037_orderitem_price_snapshot'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='ref_code',
+            field=models.CharField(db_index=True, max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['category', 'id'], name='item_category_listing'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-start_date'], name='order_user_history'),
+        ),
+    ]
@@ -0,0 +1,84 @@
+from django.db import migrations, models
+
+# Frozen copy of core.ref_codes as of this migration.
+ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+BASE = len(ALPHABET)
+PAYLOAD_LENGTH = 9
+CAPACITY = BASE ** PAYLOAD_LENGTH
+MULTIPLIER = 62767505111981
+OFFSET = 28064150371433
+SEQUENCE_NAME = 'ref-code'
+
+
+def check_character(payload):
+    factor, total = 2, 0
+    for char in reversed(payload):
+        addend = factor * ALPHABET.index(char)
+        total += addend // BASE + addend % BASE
+        factor = 3 - factor
+    return ALPHABET[-total % BASE]
+
+
+def encode_ref_code(number):
+    value = (number * MULTIPLIER + OFFSET) % CAPACITY
+    payload = ''
+    for _ in range(PAYLOAD_LENGTH):
+        value, digit = divmod(value, BASE)
+        payload = ALPHABET[digit] + payload
+    return payload + check_character(payload)
+
+
+def reissue_ref_codes(apps, schema_editor):
+    """Give placed orders without a usable code a unique, check-digited one.
+
+    Customers quote the codes they were sent, so every existing code is
+    kept, and the first order holding a duplicate keeps it too. Blank and
+    duplicate codes get new ones; sequence numbers whose code an order
+    already holds are passed over.
+    """
+    Order = apps.get_model('core', 'Order')
+    Sequence = apps.get_model('core', 'Sequence')
+    Order.objects.filter(ordered=False).update(ref_code=None)
+    Order.objects.filter(ordered=True, ref_code='').update(ref_code=None)
+    kept, reissued = set(), []
+    for order in Order.objects.filter(ordered=True).only('pk', 'ref_code').order_by('pk').iterator():
+        if order.ref_code is None or order.ref_code in kept:
+            reissued.append(order)
+        else:
+            kept.add(order.ref_code)
+    number = 0
+    for order in reissued:
+        while encode_ref_code(number) in kept:
+            number += 1
+        order.ref_code = encode_ref_code(number)
+        number += 1
+    Order.objects.bulk_update(reissued, ['ref_code'], batch_size=1000)
+    Sequence.objects.update_or_create(name=SEQUENCE_NAME, defaults={'next_value': number})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0038_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Sequence',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('next_value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='ref_code',
+            field=models.CharField(blank=True, db_index=True, max_length=10, null=True),
+        ),
+        migrations.RunPython(reissue_ref_codes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='order',
+            name='ref_code',
+            field=models.CharField(blank=True, max_length=10, null=True, unique=True),
+        ),
+    ]
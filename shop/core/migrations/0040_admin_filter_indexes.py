@@ -0,0 +1,21 @@
+# Generated by Django 4.0.2 on 2026-10-18 21:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0039_ref_code_allocator'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['ordered_date'], name='order_ordered_date'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('refund_requested', True)), fields=['id'], name='order_refund_requested'),
+        ),
+    ]
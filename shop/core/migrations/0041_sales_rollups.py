@@ -0,0 +1,37 @@
+# Generated by Django 4.0.2 on 2026-10-18 21:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0040_admin_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('orders', models.IntegerField(default=0)),
+                ('units', models.IntegerField(default=0)),
+                ('revenue', models.FloatField(default=0)),
+                ('discount', models.FloatField(default=0)),
+                ('refunded_units', models.IntegerField(default=0)),
+                ('refunds', models.FloatField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.category')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.item')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='salesrollup',
+            index=models.Index(fields=['category', 'day'], name='sales_rollup_category_day'),
+        ),
+        migrations.AddConstraint(
+            model_name='salesrollup',
+            constraint=models.UniqueConstraint(fields=('day', 'category', 'item'), name='unique_sales_rollup'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.0.2 on 2026-10-18 21:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0041_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='promotion_discount',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='promotion_discount',
+            field=models.FloatField(default=0),
+        ),
+        migrations.CreateModel(
+            name='Promotion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('kind', models.CharField(choices=[('P', 'percent off'), ('B', 'buy X get Y free'), ('T', 'cart threshold')], max_length=1)),
+                ('percent', models.FloatField(blank=True, null=True)),
+                ('amount', models.FloatField(blank=True, null=True)),
+                ('buy_quantity', models.PositiveIntegerField(blank=True, null=True)),
+                ('get_quantity', models.PositiveIntegerField(blank=True, null=True)),
+                ('min_subtotal', models.FloatField(blank=True, null=True)),
+                ('starts_at', models.DateTimeField(blank=True, null=True)),
+                ('ends_at', models.DateTimeField(blank=True, null=True)),
+                ('active', models.BooleanField(default=True)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='core.category')),
+                ('item', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='core.item')),
+            ],
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 4.0.2 on 2026-10-18 21:20
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0042_promotions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='stock_shards',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='StockShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('quantity', models.IntegerField(default=0)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.item')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StockHold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('quantity', models.IntegerField()),
+                ('expires_at', models.DateTimeField()),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.item')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='stockshard',
+            constraint=models.UniqueConstraint(fields=('item', 'shard'), name='unique_stock_shard'),
+        ),
+        migrations.AddConstraint(
+            model_name='stockshard',
+            constraint=models.CheckConstraint(check=models.Q(('quantity__gte', 0)), name='stock_shard_not_negative'),
+        ),
+        migrations.AddIndex(
+            model_name='stockhold',
+            index=models.Index(fields=['user', 'item'], name='stock_hold_user_item'),
+        ),
+        migrations.AddIndex(
+            model_name='stockhold',
+            index=models.Index(fields=['expires_at'], name='stock_hold_expires_at'),
+        ),
+    ]
@@ -0,0 +1,88 @@
+# Generated by Django 4.0.2 on 2026-10-18 21:24
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def backfill_updated_at(apps, schema_editor):
+    # Open carts count as idle since they were started.
+    Order = apps.get_model('core', 'Order')
+    Order.objects.update(updated_at=models.F('start_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0043_stock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('ref_code', models.CharField(blank=True, max_length=10, null=True, unique=True)),
+                ('start_date', models.DateTimeField()),
+                ('ordered_date', models.DateField()),
+                ('received', models.BooleanField(default=False)),
+                ('refund_requested', models.BooleanField(default=False)),
+                ('refund_granted', models.BooleanField(default=False)),
+                ('subtotal', models.FloatField(default=0)),
+                ('discount', models.FloatField(default=0)),
+                ('promotion_discount', models.FloatField(default=0)),
+                ('item_count', models.IntegerField(default=0)),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrderItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField(default=1)),
+                ('unit_price', models.FloatField(blank=True, null=True)),
+                ('unit_discount_price', models.FloatField(blank=True, null=True)),
+                ('promotion_discount', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(backfill_updated_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('ordered', False)), fields=['updated_at'], name='order_open_updated'),
+        ),
+        migrations.AddField(
+            model_name='archivedorderitem',
+            name='item',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.item'),
+        ),
+        migrations.AddField(
+            model_name='archivedorderitem',
+            name='order',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='core.archivedorder'),
+        ),
+        migrations.AddField(
+            model_name='archivedorder',
+            name='billing_address',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.billingaddress'),
+        ),
+        migrations.AddField(
+            model_name='archivedorder',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['user', '-start_date'], name='archived_order_user_history'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['ordered_date'], name='archived_order_ordered_date'),
+        ),
+    ]
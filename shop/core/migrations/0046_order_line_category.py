@@ -0,0 +1,40 @@
+# Generated by Django 4.0.2 on 2026-10-18 22:15
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+def snapshot_line_categories(apps, schema_editor):
+    """Give placed and archived lines their item's category.
+
+    The category at the time of sale was never stored, so the current one
+    is the best record there is.
+    """
+    Item = apps.get_model('core', 'Item')
+    items = Item.objects.filter(pk=OuterRef('item_id'))
+    apps.get_model('core', 'OrderItem').objects.filter(ordered=True).update(
+        category_id=Subquery(items.values('category_id')),
+    )
+    apps.get_model('core', 'ArchivedOrderItem').objects.update(category_id=Subquery(items.values('category_id')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0045_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedorderitem',
+            name='category',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.category'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='category',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.category'),
+        ),
+        migrations.RunPython(snapshot_line_categories, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,13 @@
+from collections import defaultdict
+from math import isclose
 from django.db import models
+from django.db.models import Case, Count, F, FloatField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import GreaterThan
 from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.shortcuts import reverse
+from django.utils import timezone
 from django_countries.fields import CountryField
 
 
@@ -38,6 +45,13 @@ class Item(models.Model):
     description = models.TextField()
     slug = models.SlugField()
     image = models.ImageField()
+    # Number of StockShard rows holding the item's stock; 0 means untracked.
+    stock_shards = models.PositiveSmallIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['category', 'id'], name='item_category_listing'),
+        ]
 
     def __str__(self):
         return self.title
@@ -58,33 +72,194 @@ class Item(models.Model):
         })
 
 
+class StockShard(models.Model):
+    """One of the counters an item's stock is spread over.
+
+    Checkouts of a hot item decrement different rows, so they do not queue
+    on a single row lock.
+    """
+    item = models.ForeignKey(Item, on_delete=models.CASCADE)
+    shard = models.PositiveSmallIntegerField()
+    quantity = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['item', 'shard'], name='unique_stock_shard'),
+            models.CheckConstraint(check=models.Q(quantity__gte=0), name='stock_shard_not_negative'),
+        ]
+
+    def __str__(self):
+        return f'{self.item_id}/{self.shard}: {self.quantity}'
+
+
+class StockHold(models.Model):
+    """Stock taken from a shard for an open cart, given back if it expires."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    item = models.ForeignKey(Item, on_delete=models.CASCADE)
+    shard = models.PositiveSmallIntegerField()
+    quantity = models.IntegerField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'item'], name='stock_hold_user_item'),
+            models.Index(fields=['expires_at'], name='stock_hold_expires_at'),
+        ]
+
+    def __str__(self):
+        return f'{self.quantity} of {self.item_id} for {self.user_id}'
+
+
 class OrderItem(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     item = models.ForeignKey(Item, on_delete=models.CASCADE)
     quantity = models.IntegerField(default=1)
     ordered = models.BooleanField(default=False)
+    unit_price = models.FloatField(blank=True, null=True)
+    unit_discount_price = models.FloatField(blank=True, null=True)
+    promotion_discount = models.FloatField(default=0)
+    # The item's category when the order was placed, which the sales
+    # rollups count the line under; empty while the line is in a cart.
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, blank=True, null=True, editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'item'],
+                condition=models.Q(ordered=False),
+                name='unique_open_order_item',
+            ),
+        ]
 
     def __str__(self):
         return f'{self.quantity} of {self.item.title}'
 
+    def get_unit_price(self):
+        if self.unit_price is None:
+            return self.item.price
+        return self.unit_price
+
+    def get_unit_discount_price(self):
+        if self.unit_price is None:
+            return self.item.discount_price
+        return self.unit_discount_price
+
     def get_total_item_price(self):
-        return self.quantity * self.item.price
+        return self.quantity * self.get_unit_price()
 
     def get_total_item_discount_price(self):
-        return self.quantity * self.item.discount_price
+        return self.quantity * self.get_unit_discount_price()
 
     def get_amount_saved(self):
         return int(self.get_total_item_price() - self.get_total_item_discount_price())
 
     def get_final_price(self):
-        if self.item.discount_price:
-            return self.get_total_item_discount_price()
-        return self.get_total_item_price()
+        if self.get_unit_discount_price():
+            return self.get_total_item_discount_price() - self.promotion_discount
+        return self.get_total_item_price() - self.promotion_discount
+
+
+def order_line_totals(prefix=''):
+    """Aggregates matching ``OrderItem.get_final_price`` summed over order lines.
+
+    ``prefix`` is the lookup path from the queried model to ``OrderItem``.
+    Lines priced at checkout use their snapshot, open lines the live item.
+    """
+    quantity = F(f'{prefix}quantity')
+    price = Coalesce(f'{prefix}unit_price', f'{prefix}item__price')
+    discount_price = Case(
+        When(**{f'{prefix}unit_price__isnull': True}, then=F(f'{prefix}item__discount_price')),
+        default=F(f'{prefix}unit_discount_price'),
+    )
+    saved = Case(
+        When(GreaterThan(discount_price, 0), then=quantity * (price - discount_price)),
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+    return {
+        'subtotal': Coalesce(Sum(quantity * price, output_field=FloatField()), Value(0.0)),
+        'discount': Coalesce(Sum(saved), Value(0.0)),
+        'promotion_discount': Coalesce(Sum(f'{prefix}promotion_discount'), Value(0.0)),
+        'item_count': Count(f'{prefix}id'),
+    }
+
+
+def order_total_subqueries():
+    """``order_line_totals`` as subqueries correlated with ``Order``.
+
+    Passing them to ``update()`` stores an order's totals in one statement
+    instead of an aggregate followed by an UPDATE.
+    """
+    lines = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+    empty = {'subtotal': 0.0, 'discount': 0.0, 'promotion_discount': 0.0, 'item_count': 0}
+    return {
+        field: Coalesce(Subquery(lines.annotate(total=total).values('total')), Value(empty[field]))
+        for field, total in order_line_totals().items()
+    }
+
+
+promotion_kinds = (
+    ('P', 'percent off'),
+    ('B', 'buy X get Y free'),
+    ('T', 'cart threshold'),
+)
+
+
+class Promotion(models.Model):
+    """A discount rule, applied by ``core.promotions`` on top of ``Item.discount_price``.
+
+    Percent-off and buy-X-get-Y rules apply to ``item``, to every item of
+    ``category`` or, with neither, to the whole store. Cart thresholds take
+    ``percent`` or ``amount`` off carts worth at least ``min_subtotal``.
+    """
+    name = models.CharField(max_length=100)
+    kind = models.CharField(choices=promotion_kinds, max_length=1)
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, blank=True, null=True)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, blank=True, null=True)
+    percent = models.FloatField(blank=True, null=True)
+    amount = models.FloatField(blank=True, null=True)
+    buy_quantity = models.PositiveIntegerField(blank=True, null=True)
+    get_quantity = models.PositiveIntegerField(blank=True, null=True)
+    min_subtotal = models.FloatField(blank=True, null=True)
+    starts_at = models.DateTimeField(blank=True, null=True)
+    ends_at = models.DateTimeField(blank=True, null=True)
+    active = models.BooleanField(default=True)
+
+    def __str__(self):
+        return self.name
+
+    def clean(self):
+        errors = {}
+        if self.kind in ('P', 'T') and self.percent is not None and not 0 < self.percent <= 100:
+            errors['percent'] = 'Enter a percentage between 0 and 100.'
+        if self.kind == 'P' and self.percent is None:
+            errors['percent'] = 'Percent-off promotions need a percentage.'
+        if self.kind == 'B' and not (self.buy_quantity and self.get_quantity):
+            errors['get_quantity'] = 'Buy-X-get-Y promotions need both quantities.'
+        if self.kind == 'T':
+            if self.min_subtotal is None:
+                errors['min_subtotal'] = 'Cart thresholds need a minimum subtotal.'
+            if (self.percent is None) == (self.amount is None):
+                errors['amount'] = 'Cart thresholds take either a percentage or an amount off.'
+            if self.item_id or self.category_id:
+                errors['category'] = 'Cart thresholds apply to the whole cart.'
+        if self.starts_at and self.ends_at and self.ends_at <= self.starts_at:
+            errors['ends_at'] = 'The promotion must end after it starts.'
+        if errors:
+            raise ValidationError(errors)
+
+
+class Sequence(models.Model):
+    name = models.CharField(max_length=50, primary_key=True)
+    next_value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return self.name
 
 
 class Order(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    ref_code = models.CharField(max_length=10)
+    ref_code = models.CharField(max_length=10, unique=True, null=True, blank=True)
     items = models.ManyToManyField(OrderItem)
     start_date = models.DateTimeField(auto_now_add=True)
     ordered_date = models.DateField()
@@ -93,15 +268,43 @@ class Order(models.Model):
     received = models.BooleanField(default=False)
     refund_requested = models.BooleanField(default=False)
     refund_granted = models.BooleanField(default=False)
+    subtotal = models.FloatField(default=0)
+    discount = models.FloatField(default=0)
+    promotion_discount = models.FloatField(default=0)
+    item_count = models.IntegerField(default=0)
+    # Last cart change, so carts nobody touches can be cleaned up.
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user'],
+                condition=models.Q(ordered=False),
+                name='unique_open_order',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-start_date'], name='order_user_history'),
+            models.Index(fields=['updated_at'], condition=models.Q(ordered=False), name='order_open_updated'),
+            # Admin changelist filters.
+            models.Index(fields=['ordered_date'], name='order_ordered_date'),
+            models.Index(fields=['id'], condition=models.Q(refund_requested=True), name='order_refund_requested'),
+        ]
 
     def __str__(self):
         return self.user.username
 
     def get_total(self):
-        total = 0
-        for order_item in self.items.all():
-            total += order_item.get_final_price()
-        return total
+        return round(self.subtotal - self.discount - self.promotion_discount, 2)
+
+    def update_totals(self):
+        totals = self.items.aggregate(**order_line_totals())
+        if not self.ordered:
+            totals['promotion_discount'] = cart_promotion_discounts([self.pk]).get(self.pk, 0.0)
+        totals['updated_at'] = timezone.now()
+        Order.objects.filter(pk=self.pk).update(**totals)
+        for field, value in totals.items():
+            setattr(self, field, value)
 
     def get_absolute_url(self):
         return reverse('core:order-detail', kwargs={
@@ -114,6 +317,103 @@ class Order(models.Model):
         })
 
 
+def cart_promotion_discounts(order_ids):
+    """``{order_id: promotion_discount}`` for the open orders among ``order_ids`` under the promotions in force.
+
+    Placed orders keep the discounts their lines were given at checkout;
+    open ones are priced like the cart page prices them.
+    """
+    from .promotions import promotions
+    compiled = promotions.compiled()
+    if not compiled:
+        return {}
+    carts = defaultdict(list)
+    links = Order.items.through.objects.filter(order_id__in=order_ids, order__ordered=False).select_related(
+        'orderitem__item')
+    for link in links:
+        carts[link.order_id].append(link.orderitem)
+    return {order_id: compiled.price_cart(lines).promotion_discount for order_id, lines in carts.items()}
+
+
+def recompute_order_totals(orders, batch_size=1000):
+    """Rewrite the stored totals of ``orders``, returning how many changed."""
+    through = Order.items.through
+    fields = ['subtotal', 'discount', 'promotion_discount', 'item_count']
+    empty = {'subtotal': 0.0, 'discount': 0.0, 'promotion_discount': 0.0, 'item_count': 0}
+    orders = orders.order_by('pk').only('pk', 'ordered', *fields)
+    changed = 0
+    last_pk = 0
+    while True:
+        batch = list(orders.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            return changed
+        last_pk = batch[-1].pk
+        totals = {
+            row.pop('order_id'): row
+            for row in through.objects.filter(order__in=[order.pk for order in batch])
+            .values('order_id')
+            .annotate(**order_line_totals('orderitem__'))
+        }
+        carts = [order.pk for order in batch if not order.ordered]
+        discounts = cart_promotion_discounts(carts) if carts else {}
+        stale = []
+        for order in batch:
+            row = totals.get(order.pk, empty)
+            if not order.ordered:
+                row = dict(row, promotion_discount=discounts.get(order.pk, 0.0))
+            if not all(isclose(getattr(order, field), value, abs_tol=1e-6) for field, value in row.items()):
+                for field, value in row.items():
+                    setattr(order, field, value)
+                stale.append(order)
+        Order.objects.bulk_update(stale, fields)
+        changed += len(stale)
+
+
+class ArchivedOrder(models.Model):
+    """A placed order moved out of ``Order`` by ``core.archive``, under its original primary key."""
+    is_archived = True
+
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    ref_code = models.CharField(max_length=10, unique=True, null=True, blank=True)
+    start_date = models.DateTimeField()
+    ordered_date = models.DateField()
+    billing_address = models.ForeignKey('BillingAddress', on_delete=models.SET_NULL, blank=True, null=True)
+    received = models.BooleanField(default=False)
+    refund_requested = models.BooleanField(default=False)
+    refund_granted = models.BooleanField(default=False)
+    subtotal = models.FloatField(default=0)
+    discount = models.FloatField(default=0)
+    promotion_discount = models.FloatField(default=0)
+    item_count = models.IntegerField(default=0)
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-start_date'], name='archived_order_user_history'),
+            models.Index(fields=['ordered_date'], name='archived_order_ordered_date'),
+        ]
+
+    def __str__(self):
+        return self.user.username
+
+    get_total = Order.get_total
+    get_absolute_url = Order.get_absolute_url
+
+
+class ArchivedOrderItem(models.Model):
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name='items')
+    item = models.ForeignKey(Item, on_delete=models.CASCADE)
+    quantity = models.IntegerField(default=1)
+    unit_price = models.FloatField(blank=True, null=True)
+    unit_discount_price = models.FloatField(blank=True, null=True)
+    promotion_discount = models.FloatField(default=0)
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, blank=True, null=True, editable=False)
+
+    def __str__(self):
+        return f'{self.quantity} of {self.item.title}'
+
+
 class BillingAddress(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     first_name = models.CharField(max_length=100)
@@ -146,3 +446,69 @@ class Report(models.Model):
     phone_number = models.CharField(max_length=13)
     email = models.EmailField()
     ref_code = models.CharField(max_length=10)
+
+
+class SalesRollup(models.Model):
+    """Sales of one item on one day, kept up to date at checkout and refund.
+
+    ``category`` is the item's category when the sale was recorded, so the
+    history stays put if the item is moved later. Refunds count against
+    the day the order was placed.
+    """
+    day = models.DateField()
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    item = models.ForeignKey(Item, on_delete=models.CASCADE)
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = models.FloatField(default=0)
+    discount = models.FloatField(default=0)
+    refunded_units = models.IntegerField(default=0)
+    refunds = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'category', 'item'], name='unique_sales_rollup'),
+        ]
+        indexes = [
+            models.Index(fields=['category', 'day'], name='sales_rollup_category_day'),
+        ]
+
+    def __str__(self):
+        return f'{self.day} {self.item_id}'
+
+
+job_states = (
+    ('Q', 'queued'),
+    ('R', 'running'),
+    ('D', 'dead'),
+)
+
+
+class Job(models.Model):
+    """A unit of background work, run by the ``run_workers`` command; see ``core.jobs``.
+
+    Jobs that succeed are deleted. Failed ones are queued again with a
+    growing delay until ``max_attempts`` is reached and then kept as dead
+    for inspection and manual retry.
+    """
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    # Higher runs first.
+    priority = models.SmallIntegerField(default=0)
+    state = models.CharField(choices=job_states, max_length=1, default='Q')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_until = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-priority', 'run_at'], name='job_ready', condition=models.Q(state='Q')),
+            models.Index(fields=['locked_until'], name='job_lease', condition=models.Q(state='R')),
+        ]
+
+    def __str__(self):
+        return f'{self.name} #{self.pk}'
@@ -0,0 +1,221 @@
+import base64
+import binascii
+import datetime
+import json
+from functools import cmp_to_key, reduce
+from operator import or_
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder that keeps microseconds, which it would round away.
+
+    A cursor position must compare exactly equal to the row it came from.
+    """
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+class CursorPage:
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    def next_cursor(self):
+        if self._has_next and self.object_list:
+            return self.paginator.encode_cursor(self.object_list[-1])
+        return None
+
+    def previous_cursor(self):
+        if self._has_previous and self.object_list:
+            return self.paginator.encode_cursor(self.object_list[0], reverse=True)
+        return None
+
+
+class CursorPaginator:
+    """Keyset pagination over ``queryset`` ordered by ``ordering``.
+
+    The position of a page boundary is carried in an opaque cursor token
+    instead of an OFFSET, and no COUNT is run, so every page costs the
+    same indexed range scan. ``ordering`` must be a unique, non-null key,
+    e.g. ``('id',)`` or ``('price', 'id')``; prefix a field with ``-`` to
+    sort it descending.
+    """
+
+    def __init__(self, queryset, per_page, ordering=('id',)):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = tuple(ordering)
+        self.fields = [field.lstrip('-') for field in self.ordering]
+
+    def encode_cursor(self, obj, reverse=False):
+        return self.encode_position([getattr(obj, field) for field in self.fields], reverse)
+
+    def encode_position(self, position, reverse):
+        payload = json.dumps({'p': position, 'r': reverse}, cls=CursorEncoder, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            position, reverse = payload['p'], payload['r']
+            if len(position) != len(self.fields):
+                raise ValueError
+            model_fields = [self.queryset.model._meta.get_field(field) for field in self.fields]
+            return [field.to_python(value) for field, value in zip(model_fields, position)], bool(reverse)
+        except (binascii.Error, UnicodeDecodeError, ValueError, TypeError, KeyError, ValidationError) as e:
+            raise InvalidCursor(cursor) from e
+
+    def normalize_cursor(self, cursor):
+        """The canonical token for ``cursor``, or '' for none or an invalid one, which start at the first page."""
+        if not cursor:
+            return ''
+        try:
+            return self.encode_position(*self.decode_cursor(cursor))
+        except InvalidCursor:
+            return ''
+
+    def after(self, position, reverse):
+        """Q matching rows that sort strictly after ``position``."""
+        clauses = []
+        for i, field in enumerate(self.ordering):
+            descending = field.startswith('-') != reverse
+            lookup = 'lt' if descending else 'gt'
+            equal = {name: value for name, value in zip(self.fields[:i], position[:i])}
+            clauses.append(Q(**equal, **{f'{self.fields[i]}__{lookup}': position[i]}))
+        return reduce(or_, clauses)
+
+    def fetch(self, condition, ordering):
+        """Up to ``per_page + 1`` rows matching ``condition`` (if any) in ``ordering``."""
+        queryset = self.queryset if condition is None else self.queryset.filter(condition)
+        return list(queryset.order_by(*ordering)[:self.per_page + 1])
+
+    def page(self, cursor=None):
+        if not cursor:
+            rows = self.fetch(None, self.ordering)
+            return CursorPage(rows[:self.per_page], self, len(rows) > self.per_page, False)
+        position, reverse = self.decode_cursor(cursor)
+        ordering = [field[1:] if field.startswith('-') else f'-{field}' for field in self.ordering] \
+            if reverse else self.ordering
+        rows = self.fetch(self.after(position, reverse), ordering)
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+            return CursorPage(rows, self, True, more)
+        return CursorPage(rows, self, more, True)
+
+    def get_page(self, cursor=None):
+        """Like ``page`` but falls back to the first page on a bad cursor."""
+        try:
+            return self.page(cursor)
+        except InvalidCursor:
+            return self.page()
+
+    def approximate_count(self, key, timeout=None):
+        """A COUNT of the queryset, cached under ``key``."""
+        return cache.get_or_set(key, self.queryset.count, timeout)
+
+
+class ChainedCursorPaginator(CursorPaginator):
+    """Keyset pagination over several querysets read as one, e.g. a table and its archive.
+
+    The querysets must have the ordering fields and no row in common.
+    Each page costs one range scan per queryset, merged in Python.
+    """
+
+    def __init__(self, querysets, per_page, ordering=('id',)):
+        super().__init__(querysets[0], per_page, ordering)
+        self.querysets = querysets
+
+    def fetch(self, condition, ordering):
+        rows = []
+        for queryset in self.querysets:
+            if condition is not None:
+                queryset = queryset.filter(condition)
+            rows.extend(queryset.order_by(*ordering)[:self.per_page + 1])
+
+        def compare(a, b):
+            for field in ordering:
+                name = field.lstrip('-')
+                x, y = getattr(a, name), getattr(b, name)
+                if x != y:
+                    return (-1 if x < y else 1) * (-1 if field.startswith('-') else 1)
+            return 0
+
+        return sorted(rows, key=cmp_to_key(compare))[:self.per_page + 1]
+
+
+def estimated_count(queryset):
+    """The database's cheap estimate of the rows in the queryset's table.
+
+    Returns None where the backend keeps no estimate.
+    """
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+        elif connection.vendor == 'mysql':
+            cursor.execute('SELECT table_rows FROM information_schema.tables '
+                           'WHERE table_schema = DATABASE() AND table_name = %s', [table])
+        elif connection.vendor == 'sqlite':
+            # Rowids are handed out upwards, so the largest is an upper bound
+            # found with a single index probe.
+            cursor.execute(f'SELECT MAX(rowid) FROM {connection.ops.quote_name(table)}')
+        else:
+            return None
+        row = cursor.fetchone()
+    # PostgreSQL reports -1 for a table that was never analyzed.
+    return row[0] if row and row[0] is not None and row[0] >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that skips ``COUNT(*)`` for large unfiltered querysets.
+
+    Below ``exact_count_threshold`` rows, and whenever the queryset is
+    filtered, the count is exact; otherwise the planner's estimate stands in
+    for it, so paging through a huge table costs one LIMIT query per page.
+    """
+    exact_count_threshold = 10000
+
+    @cached_property
+    def count(self):
+        if hasattr(self.object_list, 'query') and not self.object_list.query.where:
+            estimate = estimated_count(self.object_list)
+            if estimate is not None and estimate > self.exact_count_threshold:
+                return estimate
+        return super().count
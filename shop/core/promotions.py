@@ -0,0 +1,250 @@
+"""Promotion rules compiled into lookup tables and applied to whole carts.
+
+The active ``Promotion`` rows are loaded once per worker, like the
+category registry, and compiled into rules indexed by item, by category
+and store-wide, with cart thresholds kept apart. Pricing a cart is a
+single pass over its lines that only looks at the rules indexed under
+each line's item and category, so its cost grows with the number of
+lines, not with the number of promotions. Listing pages price a page of
+items through the same pass.
+
+Each line gets the best single offer among its sale price and the rules
+that apply to it; offers do not stack. The best cart threshold the cart
+reaches then comes off the discounted total and is shared out across the
+lines in proportion to what they cost.
+"""
+import hashlib
+import logging
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+from .models import Promotion
+
+logger = logging.getLogger(__name__)
+
+PROMOTION_VERSION_KEY = 'promotion-registry-version'
+PERCENT_OFF, BUY_X_GET_Y, CART_THRESHOLD = 'P', 'B', 'T'
+# Differences below this are float noise, not a better offer.
+EPSILON = 1e-9
+
+
+@dataclass(frozen=True)
+class Rule:
+    id: int
+    name: str
+    kind: str
+    item_id: int = None
+    category_id: int = None
+    percent: float = None
+    amount: float = None
+    buy_quantity: int = None
+    get_quantity: int = None
+    min_subtotal: float = None
+    starts_at: datetime = None
+    ends_at: datetime = None
+
+    @classmethod
+    def from_promotion(cls, promotion):
+        return cls(promotion.pk, promotion.name, promotion.kind, promotion.item_id, promotion.category_id,
+                   promotion.percent, promotion.amount, promotion.buy_quantity, promotion.get_quantity,
+                   promotion.min_subtotal, promotion.starts_at, promotion.ends_at)
+
+    def is_valid(self):
+        """Whether the rule has what its kind needs; ``Promotion.clean`` only runs for forms."""
+        if self.percent is not None and not 0 < self.percent <= 100:
+            return False
+        if self.kind == PERCENT_OFF:
+            return self.percent is not None
+        if self.kind == BUY_X_GET_Y:
+            return bool(self.buy_quantity and self.get_quantity)
+        if self.kind == CART_THRESHOLD:
+            return (self.min_subtotal is not None and (self.percent is None) != (self.amount is None)
+                    and (self.amount is None or self.amount >= 0))
+        return False
+
+    def is_live(self, now):
+        return (self.starts_at is None or self.starts_at <= now) and (self.ends_at is None or now < self.ends_at)
+
+    def line_total(self, price, quantity):
+        if self.kind == PERCENT_OFF:
+            return quantity * price * (1 - self.percent / 100)
+        free = quantity // (self.buy_quantity + self.get_quantity) * self.get_quantity
+        return (quantity - free) * price
+
+    def cart_discount(self, total):
+        if self.percent is not None:
+            return total * self.percent / 100
+        return min(self.amount, total)
+
+
+@dataclass(frozen=True)
+class CartPrice:
+    subtotal: float = 0
+    discount: float = 0
+    promotion_discount: float = 0
+    cart_rule: Rule = None
+
+    @property
+    def total(self):
+        return round(self.subtotal - self.discount - self.promotion_discount, 2)
+
+
+class CompiledPromotions:
+    def __init__(self, rules):
+        self.by_item = defaultdict(list)
+        self.by_category = defaultdict(list)
+        self.store_wide = []
+        self.thresholds = []
+        valid = []
+        for rule in rules:
+            if not rule.is_valid():
+                logger.warning('Skipping promotion %s (%r), which is not a valid %r rule.', rule.id, rule.name,
+                               rule.kind)
+            else:
+                valid.append(rule)
+        self.rules = tuple(valid)
+        for rule in self.rules:
+            if rule.kind == CART_THRESHOLD:
+                self.thresholds.append(rule)
+            elif rule.item_id is not None:
+                self.by_item[rule.item_id].append(rule)
+            elif rule.category_id is not None:
+                self.by_category[rule.category_id].append(rule)
+            else:
+                self.store_wide.append(rule)
+        self.by_item = dict(self.by_item)
+        self.by_category = dict(self.by_category)
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def state(self, now=None):
+        """A short key naming the rules live at ``now``, for caching what they price."""
+        now = now or timezone.now()
+        live = repr([rule for rule in self.rules if rule.is_live(now)])
+        return hashlib.md5(live.encode()).hexdigest()[:8]
+
+    def line_rules(self, item_id, category_id, now):
+        for rules in (self.by_item.get(item_id), self.by_category.get(category_id), self.store_wide):
+            for rule in rules or ():
+                if rule.is_live(now):
+                    yield rule
+
+    def best_offer(self, item_id, category_id, price, discount_price, quantity, now):
+        """Return ``(total, rule)`` for the cheapest offer on one line; ``rule`` is None for the sale price."""
+        best = quantity * (discount_price if discount_price and discount_price > 0 else price)
+        best_rule = None
+        for rule in self.line_rules(item_id, category_id, now):
+            total = rule.line_total(price, quantity)
+            if total < best - EPSILON:
+                best, best_rule = total, rule
+        return best, best_rule
+
+    def price_cart(self, order_items, now=None):
+        """Price ``order_items`` in one pass, setting ``promotion_discount`` and ``promotion`` on each line.
+
+        Lines are ``OrderItem`` rows, saved or not, with ``item`` loaded.
+        """
+        now = now or timezone.now()
+        subtotal = discount = promotion_discount = 0
+        finals = []
+        for order_item in order_items:
+            price = order_item.get_unit_price()
+            discount_price = order_item.get_unit_discount_price()
+            quantity = order_item.quantity
+            sale_total = quantity * (discount_price if discount_price and discount_price > 0 else price)
+            final, rule = self.best_offer(order_item.item_id, order_item.item.category_id, price, discount_price,
+                                          quantity, now)
+            order_item.promotion_discount = sale_total - final
+            order_item.promotion = rule
+            subtotal += quantity * price
+            discount += quantity * price - sale_total
+            promotion_discount += order_item.promotion_discount
+            finals.append((order_item, final))
+
+        total = subtotal - discount - promotion_discount
+        cart_rule = None
+        cart_discount = 0
+        for rule in self.thresholds:
+            if rule.is_live(now) and total >= rule.min_subtotal:
+                candidate = rule.cart_discount(total)
+                if candidate > cart_discount + EPSILON:
+                    cart_rule, cart_discount = rule, candidate
+        if cart_rule is not None and total > 0:
+            for order_item, final in finals:
+                order_item.promotion_discount += cart_discount * final / total
+                order_item.promotion = order_item.promotion or cart_rule
+            promotion_discount += cart_discount
+        return CartPrice(subtotal, discount, promotion_discount, cart_rule)
+
+    def annotate_items(self, items, now=None):
+        """Set ``promotion`` and ``promotion_price`` on each of ``items``.
+
+        ``promotion_price`` is the price of one unit when a rule beats the
+        sale price, and None otherwise; ``promotion`` is that rule, or else
+        any live rule on the item, such as a buy-X-get-Y deal to advertise.
+        """
+        now = now or timezone.now()
+        for item in items:
+            price, rule = self.best_offer(item.pk, item.category_id, item.price, item.discount_price, 1, now)
+            item.promotion_price = round(price, 2) if rule is not None else None
+            item.promotion = rule or next(self.line_rules(item.pk, item.category_id, now), None)
+        return items
+
+
+def get_promotion_version():
+    version = cache.get(PROMOTION_VERSION_KEY)
+    if version is None:
+        cache.add(PROMOTION_VERSION_KEY, int(time.time()), None)
+        version = cache.get(PROMOTION_VERSION_KEY)
+    return version
+
+
+def bump_promotion_version():
+    try:
+        cache.incr(PROMOTION_VERSION_KEY)
+    except ValueError:
+        get_promotion_version()
+
+
+class PromotionRegistry:
+    """The compiled promotions, loaded once per worker.
+
+    Each worker reloads them with a single query when the version in the
+    shared cache moves on, which any promotion save or delete does.
+    Promotions that have ended are left out; ones that have not started
+    yet are compiled and skipped until their start time.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.promotions = CompiledPromotions(())
+
+    def compiled(self):
+        version = get_promotion_version()
+        if version != self.version:
+            with self.lock:
+                if version != self.version:
+                    rows = Promotion.objects.filter(active=True).filter(
+                        Q(ends_at__isnull=True) | Q(ends_at__gt=timezone.now())
+                    ).order_by('pk')
+                    self.promotions = CompiledPromotions(Rule.from_promotion(row) for row in rows)
+                    self.version = version
+        return self.promotions
+
+
+promotions = PromotionRegistry()
+
+
+def price_cart(order_items, now=None):
+    return promotions.compiled().price_cart(order_items, now)
+
+
+def annotate_items(items, now=None):
+    return promotions.compiled().annotate_items(items, now)
@@ -0,0 +1,122 @@
+import threading
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import F
+from .models import Order, Sequence
+
+ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+BASE = len(ALPHABET)
+PAYLOAD_LENGTH = 9
+REF_CODE_LENGTH = PAYLOAD_LENGTH + 1
+CAPACITY = BASE ** PAYLOAD_LENGTH
+# Coprime with 36, so n -> n * MULTIPLIER + OFFSET is a permutation of
+# [0, CAPACITY) and consecutive orders get unrelated-looking codes. These
+# constants are part of every issued code and must never change.
+MULTIPLIER = 62767505111981
+OFFSET = 28064150371433
+SEQUENCE_NAME = 'ref-code'
+# Codes checked against existing orders per query, within every backend's parameter limit.
+ISSUE_CHECK_SIZE = 500
+
+
+def check_character(payload):
+    """Luhn mod 36: catches any single mistyped character and most swaps."""
+    factor, total = 2, 0
+    for char in reversed(payload):
+        addend = factor * ALPHABET.index(char)
+        total += addend // BASE + addend % BASE
+        factor = 3 - factor
+    return ALPHABET[-total % BASE]
+
+
+def encode_ref_code(number):
+    if not 0 <= number < CAPACITY:
+        raise ValueError(f'Sequence number {number} is out of the ref code range.')
+    value = (number * MULTIPLIER + OFFSET) % CAPACITY
+    payload = ''
+    for _ in range(PAYLOAD_LENGTH):
+        value, digit = divmod(value, BASE)
+        payload = ALPHABET[digit] + payload
+    return payload + check_character(payload)
+
+
+def is_valid_ref_code(code):
+    return (
+        len(code) == REF_CODE_LENGTH
+        and all(char in ALPHABET for char in code)
+        and check_character(code[:-1]) == code[-1]
+    )
+
+
+def validate_ref_code(value):
+    """Accept a check-digited code, or a legacy one that an order holds.
+
+    Codes issued before the allocator were random, so one that fails the
+    check digit may still be real; it is looked up by the ``ref_code`` index.
+    """
+    if len(value) != REF_CODE_LENGTH or any(char not in ALPHABET for char in value):
+        raise ValidationError('This is not a valid order number.', code='invalid_ref_code')
+    if not is_valid_ref_code(value) and not Order.objects.filter(ref_code=value).exists():
+        raise ValidationError('This is not a valid order number.', code='invalid_ref_code')
+
+
+def reserve(size):
+    """Advance the shared counter by ``size`` and return the reserved range."""
+    with transaction.atomic():
+        counter = Sequence.objects.filter(name=SEQUENCE_NAME)
+        if not counter.update(next_value=F('next_value') + size):
+            Sequence.objects.get_or_create(name=SEQUENCE_NAME)
+            counter.update(next_value=F('next_value') + size)
+        end = Sequence.objects.get(name=SEQUENCE_NAME).next_value
+    return range(end - size, end)
+
+
+def issue(numbers):
+    """Codes for ``numbers``, less any that a legacy order already holds."""
+    codes = [encode_ref_code(number) for number in numbers]
+    taken = set()
+    for start in range(0, len(codes), ISSUE_CHECK_SIZE):
+        chunk = codes[start:start + ISSUE_CHECK_SIZE]
+        taken.update(Order.objects.filter(ref_code__in=chunk).values_list('ref_code', flat=True))
+    return [code for code in codes if code not in taken]
+
+
+class RefCodeAllocator:
+    """Hand out ref codes from blocks of sequence numbers reserved up front.
+
+    One UPDATE reserves ``block_size`` numbers for this process, so most
+    orders get their code without touching the database, and two processes
+    can never be handed the same number. A reservation made inside a
+    transaction could be rolled back after the block was cached, so there
+    only the numbers actually needed are reserved, as part of that
+    transaction. Numbers whose code a legacy order holds are skipped.
+    """
+
+    def __init__(self, block_size=None):
+        self.block_size = block_size
+        self.lock = threading.Lock()
+        self.block = iter(())
+
+    def allocate(self, count=1):
+        codes = []
+        if connection.in_atomic_block:
+            while len(codes) < count:
+                codes.extend(issue(reserve(count - len(codes))))
+            return codes
+        with self.lock:
+            while len(codes) < count:
+                code = next(self.block, None)
+                if code is None:
+                    size = max(count - len(codes), self.block_size or settings.REF_CODE_BLOCK_SIZE)
+                    self.block = iter(issue(reserve(size)))
+                    continue
+                codes.append(code)
+        return codes
+
+
+allocator = RefCodeAllocator()
+
+
+def create_ref_code():
+    return allocator.allocate()[0]
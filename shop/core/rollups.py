@@ -0,0 +1,114 @@
+"""Daily sales per category and item, kept in ``SalesRollup``.
+
+Checkout and refunds add their order lines to the matching rows with
+``F()`` increments, so the rows are current without a scheduled job and
+reports never scan orders. ``rebuild`` recomputes a date range from the
+orders for backfills and repairs.
+"""
+from django.db import transaction
+from django.db.models import Case, F, Q, Sum, Value, When
+from .models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem, SalesRollup, order_line_totals
+
+# Keys per UPDATE, which carries one CASE branch per key and field.
+UPDATE_CHUNK_SIZE = 200
+
+
+def line_totals(lines):
+    """Yield ``((day, category_id, item_id), totals)`` for ``lines`` in one grouped query.
+
+    ``lines`` are ``OrderItem`` or ``ArchivedOrderItem`` rows, which share
+    the fields the totals are computed from. Lines count under the
+    category they were sold in, so moving an item later changes neither
+    its past rollups nor where its refunds go.
+    """
+    rows = lines.order_by().values(
+        'order__ordered_date', 'category_id', 'item_id',
+    ).annotate(units=Sum('quantity'), **order_line_totals())
+    for row in rows:
+        yield (row['order__ordered_date'], row['category_id'], row['item_id']), row
+
+
+def sale_values(row):
+    return {
+        'orders': row['item_count'],
+        'units': row['units'],
+        'revenue': row['subtotal'] - row['discount'] - row['promotion_discount'],
+        'discount': row['discount'] + row['promotion_discount'],
+    }
+
+
+def refund_values(row):
+    return {
+        'refunded_units': row['units'],
+        'refunds': row['subtotal'] - row['discount'] - row['promotion_discount'],
+    }
+
+
+def increment(deltas):
+    """Add ``{(day, category_id, item_id): {field: amount}}`` to the rollups.
+
+    Missing rows are inserted empty first, ignoring the ones a concurrent
+    transaction created, then every row is incremented by one UPDATE per
+    chunk of keys.
+    """
+    if not deltas:
+        return
+    SalesRollup.objects.bulk_create([
+        SalesRollup(day=day, category_id=category_id, item_id=item_id) for day, category_id, item_id in deltas
+    ], ignore_conflicts=True)
+    keys = list(deltas)
+    fields = list(deltas[keys[0]])
+    for start in range(0, len(keys), UPDATE_CHUNK_SIZE):
+        chunk = keys[start:start + UPDATE_CHUNK_SIZE]
+        rows = Q()
+        for day, category_id, item_id in chunk:
+            rows |= Q(day=day, category_id=category_id, item_id=item_id)
+        SalesRollup.objects.filter(rows).update(**{
+            field: F(field) + Case(
+                *[When(day=key[0], category_id=key[1], item_id=key[2], then=Value(deltas[key][field]))
+                  for key in chunk],
+                default=Value(0),
+                output_field=SalesRollup._meta.get_field(field),
+            )
+            for field in fields
+        })
+
+
+def record_sales(orders):
+    """Count the lines of the placed ``orders`` (a queryset or primary keys) as sold."""
+    increment({key: sale_values(row) for key, row in line_totals(OrderItem.objects.filter(order__in=orders))})
+
+
+def record_refunds(orders):
+    """Count the lines of ``orders`` as refunded on the day each order was placed."""
+    increment({key: refund_values(row) for key, row in line_totals(OrderItem.objects.filter(order__in=orders))})
+
+
+def rebuild(since=None, batch_size=1000):
+    """Recompute the rollups from the orders placed on or after ``since``, or all of them, archived or not.
+
+    Returns the number of rows written. Checkouts committing while this
+    runs may be counted twice or not at all, so run it when the shop is
+    quiet.
+    """
+    orders = Order.objects.filter(ordered=True)
+    archived = ArchivedOrder.objects.all()
+    rollups = SalesRollup.objects.all()
+    if since is not None:
+        orders = orders.filter(ordered_date__gte=since)
+        archived = archived.filter(ordered_date__gte=since)
+        rollups = rollups.filter(day__gte=since)
+    rows = {}
+    for model, placed in ((OrderItem, orders), (ArchivedOrderItem, archived)):
+        for (day, category_id, item_id), row in line_totals(model.objects.filter(order__in=placed)):
+            rollup = rows.setdefault((day, category_id, item_id),
+                                     SalesRollup(day=day, category_id=category_id, item_id=item_id))
+            for field, value in sale_values(row).items():
+                setattr(rollup, field, getattr(rollup, field) + value)
+        for key, row in line_totals(model.objects.filter(order__in=placed.filter(refund_granted=True))):
+            for field, value in refund_values(row).items():
+                setattr(rows[key], field, getattr(rows[key], field) + value)
+    with transaction.atomic():
+        rollups.delete()
+        SalesRollup.objects.bulk_create(rows.values(), batch_size=batch_size)
+    return len(rows)
@@ -0,0 +1,11 @@
+from functools import lru_cache
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+DEFAULT_SEARCH_BACKEND = 'core.search.database.DatabaseSearchBackend'
+
+
+@lru_cache(maxsize=None)
+def get_search_backend():
+    backend_class = import_string(getattr(settings, 'SEARCH_BACKEND', DEFAULT_SEARCH_BACKEND))
+    return backend_class()
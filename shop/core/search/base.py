@@ -0,0 +1,42 @@
+import re
+
+WORD_RE = re.compile(r'\w+')
+TERM_RE = re.compile(r'"([^"]*)"|([^"\s]+)')
+
+
+def tokenize(query):
+    return WORD_RE.findall(query.lower())
+
+
+def parse_query(query):
+    """Split ``query`` into terms, each a tuple of words; a double-quoted phrase is one term."""
+    terms = []
+    for phrase, word in TERM_RE.findall(query):
+        if phrase:
+            words = tuple(tokenize(phrase))
+            if words:
+                terms.append(words)
+        else:
+            terms.extend((token,) for token in tokenize(word))
+    return terms
+
+
+class BaseSearchBackend:
+    """Interface every product search backend implements.
+
+    ``search`` returns a sliceable, countable result set that can be handed
+    straight to a ``Paginator``. The indexing hooks are called from model
+    signals and by the ``rebuild_search_index`` command.
+    """
+
+    def search(self, query):
+        raise NotImplementedError
+
+    def index(self, items):
+        pass
+
+    def remove(self, item_ids):
+        pass
+
+    def rebuild(self):
+        return 0
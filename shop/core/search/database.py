@@ -0,0 +1,25 @@
+import re
+from django.db.models import Q
+from core.models import Item
+from .base import BaseSearchBackend, parse_query
+
+
+class DatabaseSearchBackend(BaseSearchBackend):
+    """Unranked ``icontains`` search for databases without a full-text index."""
+
+    def search(self, query):
+        items = Item.objects.select_related('category').order_by('id')
+        terms = parse_query(query)
+        if not terms:
+            return items.none()
+        for words in terms:
+            if len(words) == 1:
+                lookup, value = 'icontains', words[0]
+            else:
+                # A phrase: its words in order, separated by anything but word characters.
+                lookup, value = 'iregex', r'\W+'.join(map(re.escape, words))
+            items = items.filter(
+                Q(**{f'title__{lookup}': value}) | Q(**{f'description__{lookup}': value})
+                | Q(**{f'category__name__{lookup}': value})
+            )
+        return items
@@ -0,0 +1,92 @@
+from django.db import connection, transaction
+from core.models import Item
+from .base import BaseSearchBackend, parse_query
+
+TABLE = 'core_item_search'
+# bm25() column weights for title, description and category.
+WEIGHTS = (10.0, 1.0, 4.0)
+
+POPULATE_SQL = (
+    f'INSERT INTO {TABLE} (rowid, title, description, category) '
+    'SELECT item.id, item.title, item.description, category.name '
+    'FROM core_item item INNER JOIN core_category category ON category.id = item.category_id'
+)
+
+
+def match_expression(query):
+    """Turn free text into an FTS5 query matching every term, the last word of each as a prefix."""
+    return ' '.join(f'"{" ".join(words)}"*' for words in parse_query(query))
+
+
+class FTS5SearchResults:
+    """Lazily evaluated, BM25-ranked search results.
+
+    Only the requested page of item ids is read from the index, so a
+    ``Paginator`` never materialises the full result set.
+    """
+
+    def __init__(self, match):
+        self.match = match
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            if not self.match:
+                self._count = 0
+            else:
+                with connection.cursor() as cursor:
+                    cursor.execute(f'SELECT COUNT(*) FROM {TABLE} WHERE {TABLE} MATCH %s', [self.match])
+                    self._count = cursor.fetchone()[0]
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return self[key:key + 1][0]
+        if not self.match:
+            return []
+        offset = key.start or 0
+        limit = -1 if key.stop is None else max(key.stop - offset, 0)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s '
+                f'ORDER BY bm25({TABLE}, %s, %s, %s) LIMIT %s OFFSET %s',
+                [self.match, *WEIGHTS, limit, offset],
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+        items = Item.objects.select_related('category').in_bulk(ids)
+        return [items[pk] for pk in ids if pk in items]
+
+
+class FTS5SearchBackend(BaseSearchBackend):
+    """Full-text search over title, description and category name using SQLite FTS5."""
+
+    def search(self, query):
+        return FTS5SearchResults(match_expression(query))
+
+    def index(self, items):
+        rows = [(item.pk, item.title, item.description, item.category.name) for item in items]
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+            cursor.executemany(
+                f'INSERT INTO {TABLE} (rowid, title, description, category) VALUES (%s, %s, %s, %s)', rows
+            )
+
+    def remove(self, item_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {TABLE} WHERE rowid = %s', [(pk,) for pk in item_ids])
+
+    def rebuild(self):
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {TABLE}')
+            cursor.execute(POPULATE_SQL)
+            indexed = cursor.rowcount
+            cursor.execute(f"INSERT INTO {TABLE} ({TABLE}) VALUES ('optimize')")
+        return indexed
@@ -1,8 +1,29 @@
 from rest_framework import serializers
-from .models import Item
+from .models import Category, Item
 
 
-class ItemSerializer(serializers.ModelSerializer):
+class DynamicFieldsModelSerializer(serializers.ModelSerializer):
+    """Drops every field not named in the request's ``?fields=`` parameter."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        fields = request.query_params.get('fields') if request is not None else None
+        if fields:
+            wanted = set(fields.split(','))
+            for name in set(self.fields) - wanted:
+                self.fields.pop(name)
+
+
+class CategorySerializer(DynamicFieldsModelSerializer):
+    class Meta:
+        model = Category
+        fields = ['id', 'name', 'slug']
+
+
+class ItemSerializer(DynamicFieldsModelSerializer):
+    category = CategorySerializer(read_only=True)
+
     class Meta:
         model = Item
-        fields = '__all__'
+        fields = ['id', 'title', 'price', 'discount_price', 'category', 'label', 'description', 'slug', 'image']
@@ -0,0 +1,99 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from .cart import invalidate_cart_summary, merge_session_cart
+from .catalog import bump_catalog_version
+from .categories import bump_category_version
+from .jobs import enqueue
+from .models import Category, Item, Order, Promotion, recompute_order_totals
+from .promotions import bump_promotion_version
+from .search import get_search_backend
+
+
+def open_orders_with(item):
+    return Order.objects.filter(ordered=False, items__item=item).distinct()
+
+
+@receiver(post_save, sender=Item)
+def refresh_open_order_totals(sender, instance, created, **kwargs):
+    if not created:
+        orders = open_orders_with(instance)
+        if recompute_order_totals(orders):
+            invalidate_cart_summary(*orders.values_list('user_id', flat=True))
+
+
+@receiver(pre_delete, sender=Item)
+def remember_open_orders(sender, instance, **kwargs):
+    instance._open_order_ids = list(open_orders_with(instance).values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Item)
+def refresh_open_order_totals_after_delete(sender, instance, **kwargs):
+    order_ids = getattr(instance, '_open_order_ids', None)
+    if order_ids:
+        orders = Order.objects.filter(pk__in=order_ids)
+        recompute_order_totals(orders)
+        invalidate_cart_summary(*orders.values_list('user_id', flat=True))
+
+
+@receiver(post_save, sender=Item)
+def index_item(sender, instance, **kwargs):
+    get_search_backend().index([instance])
+
+
+@receiver(post_delete, sender=Item)
+def unindex_item(sender, instance, **kwargs):
+    get_search_backend().remove([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_items(sender, instance, created, **kwargs):
+    if created:
+        return
+    backend = get_search_backend()
+    items = instance.item_set.order_by('pk')
+    last_pk = 0
+    while True:
+        batch = list(items.filter(pk__gt=last_pk)[:1000])
+        if not batch:
+            return
+        for item in batch:
+            item.category = instance
+        backend.index(batch)
+        last_pk = batch[-1].pk
+
+
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_catalog(sender, **kwargs):
+    # Bump again once the change is visible to other workers, in case one of
+    # them cached a grid or an ETag from the old rows under the first bump.
+    bump_catalog_version()
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_registry(sender, **kwargs):
+    # Bump again once the change is visible to other workers, in case one of
+    # them reloaded from the old rows under the first bump.
+    bump_category_version()
+    transaction.on_commit(bump_category_version)
+
+
+@receiver(post_save, sender=Promotion)
+@receiver(post_delete, sender=Promotion)
+def invalidate_promotion_registry(sender, **kwargs):
+    bump_promotion_version()
+    transaction.on_commit(bump_promotion_version)
+    # Open carts store their promotion discount; a worker reprices them.
+    enqueue('refresh-cart-totals')
+
+
+@receiver(user_logged_in)
+def merge_anonymous_cart(sender, request, user, **kwargs):
+    if request is not None and hasattr(request, 'session'):
+        merge_session_cart(request, user)
@@ -0,0 +1,144 @@
+import asyncio
+import gzip
+import mimetypes
+import os
+import posixpath
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.functional import cached_property
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.map', '.svg', '.json', '.txt', '.xml', '.html', '.ico', '.eot', '.ttf')
+# Below this the gzip framing costs about as much as it saves.
+MIN_COMPRESS_SIZE = 256
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Fingerprint collected files and write a ``.gz`` next to each text asset.
+
+    Files missing from the manifest (e.g. before the first collectstatic, or
+    a template referencing an asset that was never shipped) resolve to their
+    plain name instead of failing the page.
+    """
+    manifest_strict = False
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        names = set(paths) | set(self.hashed_files.values())
+        for name in sorted(names):
+            if name.endswith(COMPRESSIBLE_EXTENSIONS) and self.exists(name):
+                self.compress(name)
+
+    def compress(self, name):
+        path = self.path(name)
+        with open(path, 'rb') as source:
+            content = source.read()
+        if len(content) < MIN_COMPRESS_SIZE:
+            return
+        # mtime=0 keeps the output identical between builds of the same file.
+        compressed = gzip.compress(content, compresslevel=9, mtime=0)
+        if len(compressed) < len(content):
+            with open(path + '.gz', 'wb') as target:
+                target.write(compressed)
+
+
+def coding_weights(header):
+    """Map each content-coding in an ``Accept-Encoding`` header to its q-value.
+
+    A malformed q-value counts as 0, since the identity response is always safe.
+    """
+    weights = {}
+    for part in header.split(','):
+        coding, *params = [piece.strip() for piece in part.split(';')]
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[coding.lower()] = q
+    return weights
+
+
+def accepts_gzip(request):
+    """Whether gzip is acceptable: named with q > 0, or left to a ``*`` with q > 0."""
+    weights = coding_weights(request.headers.get('Accept-Encoding', ''))
+    for coding in ('gzip', 'x-gzip', '*'):
+        if coding in weights:
+            return weights[coding] > 0
+    return False
+
+
+class StaticFilesMiddleware(MiddlewareMixin):
+    """Serve collected static files, preferring their precompressed variant.
+
+    Fingerprinted names never change content, so they are cached for good;
+    anything else is cached briefly. Requests under ``STATIC_URL`` that do
+    not match a collected file fall through to the rest of the stack.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.prefix = '/' + settings.STATIC_URL.lstrip('/')
+
+    @cached_property
+    def hashed_names(self):
+        return set(getattr(staticfiles_storage, 'hashed_files', {}).values())
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.process_request(request) or self.get_response(request)
+
+    async def __acall__(self, request):
+        return self.process_request(request) or await self.get_response(request)
+
+    def process_request(self, request):
+        if settings.STATIC_ROOT and request.method in ('GET', 'HEAD') and request.path.startswith(self.prefix):
+            return self.serve(request, posixpath.normpath(request.path[len(self.prefix):]).lstrip('/'))
+        return None
+
+    def serve(self, request, name):
+        try:
+            path = safe_join(settings.STATIC_ROOT, name)
+        except SuspiciousFileOperation:
+            return None
+        if not os.path.isfile(path):
+            return None
+        content_type, _ = mimetypes.guess_type(path)
+        compressed = path + '.gz'
+        use_gzip = accepts_gzip(request) and os.path.isfile(compressed)
+        stat = os.stat(path)
+        if not was_modified_since(request.headers.get('If-Modified-Since'), stat.st_mtime):
+            response = HttpResponseNotModified()
+        else:
+            response = FileResponse(open(compressed if use_gzip else path, 'rb'),
+                                    content_type=content_type or 'application/octet-stream')
+            if use_gzip:
+                response['Content-Encoding'] = 'gzip'
+        response['Last-Modified'] = http_date(stat.st_mtime)
+        if name in self.hashed_names:
+            response['Cache-Control'] = f'public, max-age={settings.STATIC_HASHED_MAX_AGE}, immutable'
+        else:
+            response['Cache-Control'] = f'public, max-age={settings.STATIC_MAX_AGE}'
+        if os.path.isfile(compressed):
+            patch_vary_headers(response, ['Accept-Encoding'])
+        return response
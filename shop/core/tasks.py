@@ -0,0 +1,26 @@
+"""Handlers for the background jobs enqueued by request paths."""
+from django.db import transaction
+from .cart import invalidate_cart_summary
+from .jobs import job
+from .models import Order, Refund, Report, recompute_order_totals
+
+
+@job('save-refund', priority=10)
+def save_refund(order_id, reason, email, phone_number=''):
+    Order.objects.filter(pk=order_id).update(refund_requested=True)
+    Refund.objects.create(order_id=order_id, reason=reason, email=email, phone_number=phone_number)
+
+
+@job('save-report', priority=10)
+def save_report(order_id, reason, full_name, phone_number, email, ref_code):
+    Report.objects.create(order_id=order_id, reason=reason, full_name=full_name, phone_number=phone_number,
+                          email=email, ref_code=ref_code)
+
+
+@job('refresh-cart-totals')
+def refresh_cart_totals():
+    """Reprice every open cart after the promotions changed."""
+    carts = Order.objects.filter(ordered=False)
+    if recompute_order_totals(carts):
+        user_ids = list(carts.values_list('user_id', flat=True))
+        transaction.on_commit(lambda: invalidate_cart_summary(*user_ids))
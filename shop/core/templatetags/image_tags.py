@@ -0,0 +1,11 @@
+from django import template
+from core.images import derivative_url
+
+register = template.Library()
+
+
+@register.filter
+def derivative(image, preset):
+    if not image:
+        return ''
+    return derivative_url(image.name, preset)
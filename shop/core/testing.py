@@ -0,0 +1,81 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from .cart import CartService
+from .inventory import set_stock
+from .middleware import get_query_budget
+from .models import BillingAddress, Category, Item
+from .ref_codes import create_ref_code
+
+
+def seed_storefront(categories=3, items_per_category=20, orders=5, lines_per_order=3, stock=0, stock_shards=4):
+    """Create a small catalog and a customer with past orders and an open cart.
+
+    With ``stock``, every item starts with that many units spread over
+    ``stock_shards`` counters, so cart paths go through the holds.
+    """
+    user = User.objects.create_user('customer', email='customer@example.com', password='secret')
+    items = []
+    for c in range(categories):
+        category = Category.objects.create(name=f'Category {c}', slug=f'category-{c}')
+        for n in range(items_per_category):
+            items.append(Item.objects.create(
+                title=f'Item {c}-{n}',
+                price=10.0 + n,
+                discount_price=8.0 + n if n % 3 == 0 else None,
+                category=category,
+                label='P',
+                description=f'Description of item {c}-{n}',
+                slug=f'item-{c}-{n}',
+                image='item.jpg',
+            ))
+            if stock:
+                set_stock(items[-1], stock, stock_shards)
+    cart = CartService(user)
+    for o in range(orders):
+        for n in range(lines_per_order):
+            cart.add(items[(o * lines_per_order + n) % len(items)])
+        address = BillingAddress(user=user, first_name='Ann', last_name='Lee', email='ann@example.com',
+                                 phone_number='0500000000', street_address='Main St 1', country='UA',
+                                 zip='01001')
+        cart.checkout(address, ref_code=create_ref_code())
+    for item in items[:lines_per_order]:
+        cart.add(item)
+    return user
+
+
+def serialize_transactions(connection):
+    """Make ``connection`` take SQLite's write lock as soon as each transaction begins.
+
+    SQLite has no row locks: a transaction that read before another one
+    wrote fails with "database is locked" when it tries to write. Starting
+    with ``BEGIN IMMEDIATE`` makes it wait on the busy timeout instead, as a
+    locked row would on other databases.
+    """
+    if connection.vendor == 'sqlite':
+        connection._start_transaction_under_autocommit = lambda: connection.cursor().execute('BEGIN IMMEDIATE')
+
+
+class QueryBudgetTestCase(TestCase):
+    """Checks views against the ``query_budget`` they declare."""
+
+    def assertWithinQueryBudget(self, path, budget=None, data=None, **extra):
+        """GET ``path``, or POST ``data`` to it, and check the queries against the view's budget."""
+        if budget is None:
+            budget = get_query_budget(resolve(path.split('?')[0]).func)
+        if budget is None:
+            self.fail(f'{path} declares no query budget')
+        with CaptureQueriesContext(connection) as queries:
+            if data is None:
+                response = self.client.get(path, **extra)
+            else:
+                response = self.client.post(path, data, **extra)
+        self.assertLess(response.status_code, 400, f'{path} returned {response.status_code}')
+        self.assertLessEqual(
+            len(queries), budget,
+            f'{path} ran {len(queries)} queries, over its budget of {budget}:\n'
+            + '\n'.join(query['sql'] for query in queries),
+        )
+        return response
@@ -1,3 +1,1313 @@
-from django.test import TestCase
+import asyncio
+import importlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import URLPattern, resolve, reverse
+from django.utils import timezone
+from PIL import Image
+
+from .cart import CartService, ItemNotInCart, NoActiveOrder, cart_summary_key
+from .benchmark import route_patterns
+from .catalog import get_catalog_version
+from .categories import categories
+from . import urls as core_urls
+from .middleware import get_query_budget
+from .forms import RefundForm
+from .images import derivative_url
+from .inventory import OutOfStock, get_stock, release_expired, restock, set_stock
+from .jobs import claim, enqueue, retry, run, work
+from .admin import grant_refunds
+from .archive import archive_orders, delete_stale_carts
+from .pagination import CursorPaginator, InvalidCursor
+from .models import (ArchivedOrderItem, BillingAddress, Category, Item, Job, Order, OrderItem, Promotion, Refund,
+                     Report, SalesRollup, Sequence, StockHold, StockShard, recompute_order_totals)
+from .ref_codes import SEQUENCE_NAME, RefCodeAllocator, encode_ref_code, is_valid_ref_code
+from .promotions import bump_promotion_version, price_cart, promotions
+from .rollups import rebuild as rebuild_rollups
+from .search import get_search_backend
+from .staticfiles import CompressedManifestStaticFilesStorage, StaticFilesMiddleware
+from .testing import QueryBudgetTestCase, seed_storefront, serialize_transactions
+from .management.commands.audit_query_plans import Command as AuditCommand
+
+
+def create_item(category, slug, price=10.0, discount_price=None):
+    return Item.objects.create(
+        title=slug.title(),
+        price=price,
+        discount_price=discount_price,
+        category=category,
+        label='P',
+        description=f'{slug} description',
+        slug=slug,
+        image='item.jpg',
+    )
+
+
+class StoredTotalsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', password='secret')
+        category = Category.objects.create(name='Shirts', slug='shirts')
+        cls.shirt = create_item(category, 'shirt', price=10.0, discount_price=8.0)
+        cls.hat = create_item(category, 'hat', price=5.0)
+
+    def setUp(self):
+        cart = CartService(self.user)
+        cart.add(self.shirt)
+        cart.add(self.shirt)
+        cart.add(self.hat)
+        self.order = Order.objects.get(user=self.user, ordered=False)
+
+    def totals(self):
+        order = Order.objects.get(pk=self.order.pk)
+        return order.subtotal, order.discount, order.item_count
+
+    def test_item_changes_refresh_open_carts(self):
+        self.assertEqual(self.totals(), (25.0, 4.0, 2))
+        self.shirt.discount_price = None
+        self.shirt.price = 12.0
+        self.shirt.save()
+        self.assertEqual(self.totals(), (29.0, 0.0, 2))
+        self.hat.delete()
+        self.assertEqual(self.totals(), (24.0, 0.0, 1))
+
+    def test_recompute_command_repairs_stale_totals(self):
+        Order.objects.filter(pk=self.order.pk).update(subtotal=0, discount=0, item_count=0)
+        out = io.StringIO()
+        call_command('recompute_order_totals', '--open-only', stdout=out)
+        self.assertIn('Updated totals of 1 order(s).', out.getvalue())
+        self.assertEqual(self.totals(), (25.0, 4.0, 2))
+        call_command('recompute_order_totals', stdout=out)
+        self.assertIn('Updated totals of 0 order(s).', out.getvalue())
+
+
+class CartServiceTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', password='secret')
+        cls.category = Category.objects.create(name='Shirts', slug='shirts')
+        cls.shirt = create_item(cls.category, 'shirt', price=10.0, discount_price=8.0)
+        cls.hat = create_item(cls.category, 'hat', price=5.0)
+
+    def setUp(self):
+        self.cart = CartService(self.user)
+
+    def test_add_creates_one_open_order_and_line(self):
+        self.assertFalse(self.cart.add(self.shirt))
+        self.assertTrue(self.cart.add(self.shirt))
+        order = Order.objects.get(user=self.user, ordered=False)
+        line = order.items.get()
+        self.assertEqual(line.quantity, 2)
+        self.assertEqual((order.subtotal, order.discount, order.item_count), (20.0, 4.0, 1))
+
+    def test_add_increments_without_reading_quantity(self):
+        self.cart.add(self.shirt)
+        stale = OrderItem.objects.get(user=self.user, item=self.shirt)
+        CartService(self.user).add(self.shirt)
+        self.cart.add(self.shirt)
+        stale.refresh_from_db()
+        self.assertEqual(stale.quantity, 3)
+
+    def test_add_recovers_from_losing_the_open_order_race(self):
+        self.cart.add(self.shirt)
+        # Another request created the order after this one looked for it.
+        with mock.patch.object(CartService, 'get_open_order', return_value=None):
+            self.assertTrue(self.cart.add(self.shirt))
+        order = Order.objects.get(user=self.user, ordered=False)
+        self.assertEqual(order.items.get().quantity, 2)
+        self.assertEqual(order.subtotal, 20.0)
+
+    def test_add_recovers_from_losing_the_open_line_race(self):
+        self.cart.add(self.shirt)
+        open_lines = self.cart.open_lines
+        missed = []
+
+        def miss_first_increment(item):
+            # Another request inserted the line after this one tried to increment it.
+            if not missed:
+                missed.append(item)
+                return OrderItem.objects.none()
+            return open_lines(item)
+
+        with mock.patch.object(self.cart, 'open_lines', side_effect=miss_first_increment):
+            self.assertTrue(self.cart.add(self.shirt))
+        self.assertEqual(missed, [self.shirt])
+        order = Order.objects.get(user=self.user, ordered=False)
+        self.assertEqual(order.items.get().quantity, 2)
+        self.assertEqual(order.subtotal, 20.0)
+
+    def test_remove_single_decrements_then_drops_line(self):
+        self.cart.add(self.shirt)
+        self.cart.add(self.shirt)
+        self.cart.remove_single(self.shirt)
+        self.assertEqual(OrderItem.objects.get(user=self.user, item=self.shirt).quantity, 1)
+        self.cart.remove_single(self.shirt)
+        self.assertFalse(OrderItem.objects.filter(user=self.user, ordered=False).exists())
+        self.assertEqual(Order.objects.get(user=self.user, ordered=False).get_total(), 0)
+
+    def test_remove_drops_whole_line(self):
+        self.cart.add(self.shirt)
+        self.cart.add(self.hat)
+        self.cart.remove(self.shirt)
+        order = Order.objects.get(user=self.user, ordered=False)
+        self.assertEqual(list(order.items.values_list('item__slug', flat=True)), ['hat'])
+        self.assertEqual(order.get_total(), 5.0)
+
+    def test_remove_errors(self):
+        with self.assertRaises(NoActiveOrder):
+            self.cart.remove(self.shirt)
+        self.cart.add(self.hat)
+        with self.assertRaises(ItemNotInCart):
+            self.cart.remove(self.shirt)
+        with self.assertRaises(ItemNotInCart):
+            self.cart.remove_single(self.shirt)
+
+    def test_query_counts_are_bounded(self):
+        # Counts include the savepoints opened by the service's atomic blocks;
+        # the promotions in force are loaded beforehand, as a warm process has them.
+        promotions.compiled()
+        with CaptureQueriesContext(connection) as new_cart:
+            self.cart.add(self.shirt)
+        with CaptureQueriesContext(connection) as new_line:
+            self.cart.add(self.hat)
+        with CaptureQueriesContext(connection) as existing_line:
+            self.cart.add(self.shirt)
+        with CaptureQueriesContext(connection) as decrement:
+            self.cart.remove_single(self.shirt)
+        with CaptureQueriesContext(connection) as removal:
+            self.cart.remove(self.shirt)
+        self.assertLessEqual(len(new_cart), 11)
+        self.assertLessEqual(len(new_line), 9)
+        self.assertLessEqual(len(existing_line), 5)
+        self.assertLessEqual(len(decrement), 5)
+        self.assertLessEqual(len(removal), 7)
+
+    def test_views_use_cart_service(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('core:add-to-cart', kwargs={'slug': 'shirt'}))
+        self.assertRedirects(response, self.shirt.get_absolute_url(), fetch_redirect_response=False)
+        response = self.client.get(reverse('core:add-to-cart', kwargs={'slug': 'shirt'}))
+        self.assertRedirects(response, reverse('core:order-summary'), fetch_redirect_response=False)
+        self.client.get(reverse('core:remove-from-cart', kwargs={'slug': 'shirt'}))
+        self.assertFalse(OrderItem.objects.filter(user=self.user).exists())
+
+
+class CartSummaryCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', password='secret')
+        category = Category.objects.create(name='Shirts', slug='shirts')
+        cls.shirt = create_item(category, 'shirt', price=10.0)
+        cls.hat = create_item(category, 'hat', price=5.0)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def summary(self):
+        return self.client.get(reverse('core:home')).context['cart_summary']
+
+    def visit(self, name, **kwargs):
+        self.summary()
+        self.assertIsNotNone(cache.get(cart_summary_key(self.user.pk)))
+        with self.captureOnCommitCallbacks(execute=True):
+            if name == 'checkout':
+                self.client.post(reverse('core:checkout'), {
+                    'first_name': 'Ann', 'last_name': 'Lee', 'phone_number': '1', 'street_address': 'Main St 1',
+                    'country': 'UA', 'zip': '01001', 'payment_option': 'L',
+                })
+            else:
+                self.client.get(reverse(f'core:{name}', kwargs=kwargs))
+        self.assertIsNone(cache.get(cart_summary_key(self.user.pk)), name)
+        return self.summary()
+
+    def test_every_cart_view_invalidates_the_cached_summary(self):
+        self.assertEqual(self.summary().count, 0)
+        self.assertEqual(self.visit('add-to-cart', slug='shirt').count, 1)
+        self.assertEqual(self.visit('add-to-cart', slug='hat').total, 15.0)
+        self.assertEqual(self.visit('remove-single-item-from-cart', slug='hat').count, 1)
+        self.assertEqual(self.visit('add-to-cart', slug='hat').count, 2)
+        self.assertEqual(self.visit('remove-from-cart', slug='shirt').total, 5.0)
+        self.assertEqual(self.visit('checkout').count, 0)
+        self.assertTrue(Order.objects.get(user=self.user).ordered)
+
+    def test_summary_is_read_once_per_request_and_then_from_cache(self):
+        CartService(self.user).add(self.shirt)
+        self.summary()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.summary().count, 1)
+        self.assertFalse(any('core_order' in query['sql'] for query in queries))
+
+
+class SessionCartTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', password='secret')
+        cls.category = Category.objects.create(name='Shirts', slug='shirts')
+        cls.shirt = create_item(cls.category, 'shirt', price=10.0, discount_price=8.0)
+        cls.hat = create_item(cls.category, 'hat', price=5.0)
+
+    def add(self, item):
+        return self.client.get(reverse('core:add-to-cart', kwargs={'slug': item.slug}))
+
+    def test_anonymous_cart_touches_only_the_item_table(self):
+        with self.assertNumQueries(1):
+            self.add(self.shirt)
+        self.add(self.shirt)
+        self.add(self.hat)
+        self.client.get(reverse('core:remove-single-item-from-cart', kwargs={'slug': 'hat'}))
+        self.assertFalse(Order.objects.exists())
+        response = self.client.get(reverse('core:order-summary'))
+        self.assertEqual([(line.item, line.quantity) for line in response.context['order_items']],
+                         [(self.shirt, 2)])
+        self.assertEqual(response.context['order_total'], 16.0)
+        self.assertEqual(response.context['cart_summary'].count, 1)
+
+    def test_login_merges_session_cart_into_open_order(self):
+        CartService(self.user).add(self.shirt)
+        self.add(self.shirt)
+        self.add(self.hat)
+        self.add(self.hat)
+        self.client.login(username='buyer', password='secret')
+        order = Order.objects.get(user=self.user, ordered=False)
+        self.assertEqual(dict(order.items.values_list('item__slug', 'quantity')), {'shirt': 2, 'hat': 2})
+        self.assertEqual((order.subtotal, order.item_count), (30.0, 2))
+        self.assertNotIn('cart', self.client.session)
+
+
+class CheckoutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', password='secret')
+        cls.category = Category.objects.create(name='Shirts', slug='shirts')
+
+    def billing_address(self):
+        return BillingAddress(user=self.user, first_name='Ann', last_name='Lee', email='ann@example.com',
+                              phone_number='123', street_address='Main St 1', country='UA', zip='01001')
+
+    def fill_cart(self, size):
+        cart = CartService(self.user)
+        for n in range(size):
+            cart.add(create_item(self.category, f'item-{size}-{n}', price=10.0, discount_price=6.0))
+        return cart
+
+    def test_checkout_snapshots_prices(self):
+        self.fill_cart(2).checkout(self.billing_address(), ref_code='ABC')
+        order = Order.objects.get(user=self.user)
+        self.assertTrue(order.ordered)
+        self.assertEqual(order.get_total(), 12.0)
+        Item.objects.update(price=99.0, discount_price=None)
+        line = order.items.first()
+        self.assertTrue(line.ordered)
+        self.assertEqual((line.unit_price, line.unit_discount_price), (10.0, 6.0))
+        self.assertEqual(line.get_final_price(), 6.0)
+        order.update_totals()
+        self.assertEqual(order.get_total(), 12.0)
+
+    def test_checkout_query_count_does_not_depend_on_cart_size(self):
+        counts = []
+        for size in (1, 20):
+            cart = self.fill_cart(size)
+            with CaptureQueriesContext(connection) as queries:
+                cart.checkout(self.billing_address(), ref_code=f'REF{size}')
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_checkout_without_cart(self):
+        with self.assertRaises(NoActiveOrder):
+            CartService(self.user).checkout(self.billing_address(), ref_code='ABC')
+        self.assertFalse(BillingAddress.objects.exists())
+
+
+class OrderHistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = seed_storefront(orders=12, lines_per_order=4)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('core:home'))
+
+    def test_history_pages_by_keyset_newest_first(self):
+        # The user, then one range scan of Order and one of the archive.
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('core:order-list'))
+        first = list(response.context['orders_list'])
+        self.assertEqual(len(first), 10)
+        response = self.client.get(reverse('core:order-list') + f'?cursor={response.context["page_obj"].next_cursor()}')
+        second = list(response.context['orders_list'])
+        placed = list(Order.objects.filter(user=self.user, ordered=True).order_by('-start_date', '-id'))
+        self.assertEqual(first + second, placed)
+        self.assertContains(response, f'${placed[-1].get_total()}')
+
+    def test_detail_query_count_does_not_depend_on_lines(self):
+        order = Order.objects.filter(user=self.user, ordered=True).first()
+        with self.assertNumQueries(3):
+            response = self.client.get(order.get_absolute_url())
+        self.assertEqual(len(response.context['order_items']), 4)
+        other = User.objects.create_user('other', password='secret')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(order.get_absolute_url()).status_code, 404)
+
+
+class AdminTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = seed_storefront(orders=6)
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        for order in Order.objects.filter(ordered=True):
+            Refund.objects.create(order=order, reason='Broken', email='ann@example.com')
+        Order.objects.filter(ordered=True).update(refund_requested=True)
+
+    def test_changelists_render(self):
+        self.client.force_login(self.admin)
+        for model in ('order', 'orderitem', 'refund', 'report'):
+            with self.subTest(model=model):
+                self.assertEqual(self.client.get(reverse(f'admin:core_{model}_changelist')).status_code, 200)
+
+    def test_bulk_refund_query_count_does_not_depend_on_selection(self):
+        counts = []
+        for orders in (Order.objects.filter(pk=Order.objects.filter(ordered=True).first().pk),
+                       Order.objects.filter(ordered=True)):
+            with CaptureQueriesContext(connection) as queries:
+                grant_refunds(orders)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertFalse(Order.objects.filter(ordered=True, refund_granted=False).exists())
+        self.assertFalse(Refund.objects.filter(accepted=False).exists())
+
+    def test_admin_search_by_ref_code(self):
+        self.client.force_login(self.admin)
+        order = Order.objects.filter(ordered=True).first()
+        response = self.client.get(reverse('admin:core_order_changelist'), {'q': order.ref_code.lower()})
+        self.assertEqual(list(response.context['cl'].result_list), [order])
+
+
+class SalesRollupTests(QueryBudgetTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = seed_storefront(orders=4)
+        cls.staff = User.objects.create_user('analyst', password='secret', is_staff=True)
+
+    def snapshot(self):
+        return sorted(SalesRollup.objects.values_list(
+            'day', 'category_id', 'item_id', 'orders', 'units', 'revenue', 'discount',
+            'refunded_units', 'refunds',
+        ))
+
+    def test_checkout_and_refunds_update_rollups_incrementally(self):
+        totals = SalesRollup.objects.aggregate(revenue=Sum('revenue'), units=Sum('units'))
+        placed = Order.objects.filter(ordered=True)
+        self.assertAlmostEqual(totals['revenue'], sum(order.get_total() for order in placed))
+        self.assertEqual(totals['units'], OrderItem.objects.filter(ordered=True).aggregate(n=Sum('quantity'))['n'])
+        order = placed.first()
+        Order.objects.filter(pk=order.pk).update(refund_requested=True)
+        grant_refunds(placed)
+        grant_refunds(placed)
+        self.assertAlmostEqual(SalesRollup.objects.aggregate(n=Sum('refunds'))['n'], order.get_total())
+        incremental = self.snapshot()
+        self.assertEqual(rebuild_rollups(), len(incremental))
+        self.assertEqual(self.snapshot(), incremental)
+
+    def test_sales_stay_in_the_category_they_were_made_in(self):
+        order = Order.objects.filter(ordered=True).first()
+        item = order.items.first().item
+        sold_in = item.category_id
+        item.category = Category.objects.create(name='Moved', slug='moved')
+        item.save()
+        Order.objects.filter(pk=order.pk).update(refund_requested=True)
+        grant_refunds(Order.objects.filter(pk=order.pk))
+        incremental = self.snapshot()
+        self.assertEqual(set(SalesRollup.objects.filter(item=item).values_list('category_id', flat=True)), {sold_in})
+        rebuild_rollups()
+        self.assertEqual(self.snapshot(), incremental)
+
+    def test_rebuild_since_leaves_earlier_days_alone(self):
+        earlier = timezone.localdate() - timedelta(days=10)
+        Order.objects.filter(pk=Order.objects.filter(ordered=True).first().pk).update(ordered_date=earlier)
+        SalesRollup.objects.update(units=0)
+        rebuild_rollups(since=timezone.localdate())
+        self.assertEqual(SalesRollup.objects.filter(day__lt=timezone.localdate()).count(), 0)
+        self.assertFalse(SalesRollup.objects.filter(units=0).exists())
+        rebuild_rollups(since=earlier)
+        self.assertTrue(SalesRollup.objects.filter(day=earlier).exists())
+
+    def test_dashboard_is_staff_only_and_reads_rollups(self):
+        path = reverse('core:sales-dashboard')
+        self.client.force_login(self.customer)
+        self.assertEqual(self.client.get(path).status_code, 302)
+        self.client.force_login(self.staff)
+        response = self.assertWithinQueryBudget(path)
+        self.assertContains(response, 'Category 0')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(path + '?days=7')
+        tables = ' '.join(query['sql'] for query in queries.captured_queries)
+        self.assertNotIn('core_order', tables)
+
+
+class ArchiveTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = seed_storefront(orders=12, lines_per_order=2)
+
+    def test_old_orders_move_to_archive_and_stay_readable(self):
+        old = list(Order.objects.filter(ordered=True).order_by('pk')[:7])
+        Order.objects.filter(pk__in=[order.pk for order in old]).update(ordered_date=date(2020, 1, 1))
+        Refund.objects.create(order=old[0], reason='Broken', email='ann@example.com')
+        rebuild_rollups()
+        rollups = self.snapshot()
+        history = list(Order.objects.filter(ordered=True).order_by('-start_date', '-id').values_list('pk', flat=True))
+
+        self.assertEqual(archive_orders(date(2021, 1, 1), batch_size=4), 6)
+        self.assertEqual(ArchivedOrderItem.objects.count(), 12)
+        self.assertFalse(OrderItem.objects.filter(order__isnull=True).exists())
+        self.assertTrue(Order.objects.filter(pk=old[0].pk).exists())
+        self.client.force_login(self.user)
+        pages, cursor = [], ''
+        while cursor is not None:
+            page = self.client.get(reverse('core:order-list') + f'?cursor={cursor}').context['page_obj']
+            pages.extend(order.pk for order in page)
+            cursor = page.next_cursor()
+        self.assertEqual(pages, history)
+        response = self.client.get(reverse('core:order-detail', args=[old[1].pk]))
+        self.assertEqual(len(response.context['order_items']), 2)
+        self.assertNotContains(response, 'Report a problem')
+        rebuild_rollups()
+        self.assertEqual(self.snapshot(), rollups)
+
+    def test_stale_carts_are_deleted_with_their_lines(self):
+        cart = Order.objects.get(ordered=False)
+        self.assertEqual(delete_stale_carts(timezone.now() - timedelta(days=1)), 0)
+        Order.objects.filter(pk=cart.pk).update(updated_at=timezone.now() - timedelta(days=60))
+        self.assertEqual(delete_stale_carts(timezone.now() - timedelta(days=30)), 1)
+        self.assertFalse(OrderItem.objects.filter(ordered=False).exists())
+        self.assertEqual(Order.objects.filter(ordered=True).count(), 12)
+
+    def snapshot(self):
+        return sorted(SalesRollup.objects.values_list('day', 'item_id', 'units', 'revenue'))
+
+
+class JobQueueTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = seed_storefront(orders=1)
+        cls.order = Order.objects.get(ordered=True)
+
+    def test_refund_request_is_stored_by_a_worker(self):
+        response = self.client.post(reverse('core:request-refund'), {
+            'ref_code': self.order.ref_code, 'message': 'Broken', 'phone_number': '1', 'email': 'ann@example.com',
+        })
+        self.assertRedirects(response, reverse('core:request-refund'))
+        self.assertFalse(Refund.objects.exists())
+        self.assertEqual(work('test'), 1)
+        self.assertEqual(Refund.objects.get().reason, 'Broken')
+        self.assertTrue(Order.objects.get(pk=self.order.pk).refund_requested)
+        self.assertFalse(Job.objects.exists())
+
+    def test_claims_by_priority_and_never_twice(self):
+        low = enqueue('save-refund', {}, priority=0)
+        high = enqueue('save-refund', {}, priority=5)
+        self.assertEqual(claim('a', limit=1), [high])
+        self.assertEqual(claim('b', limit=2), [low])
+        self.assertEqual(claim('c', limit=2), [])
+        # A worker that died loses its lease.
+        later = timezone.now() + timedelta(seconds=settings.JOB_LEASE + 1)
+        self.assertEqual(len(claim('c', limit=2, now=later)), 2)
+
+    def test_a_job_whose_lease_was_lost_is_not_run_twice(self):
+        enqueue('save-refund', {'order_id': self.order.pk, 'reason': 'Broken', 'email': 'ann@example.com'})
+        stalled = claim('a')[0]
+        later = timezone.now() + timedelta(seconds=settings.JOB_LEASE + 1)
+        taken_over = claim('b', now=later)[0]
+        self.assertTrue(run(taken_over, 'b'))
+        self.assertFalse(run(stalled, 'a'))
+        self.assertEqual(Refund.objects.count(), 1)
+        self.assertFalse(Job.objects.exists())
+
+    @override_settings(JOB_MAX_ATTEMPTS=2)
+    def test_failures_back_off_then_go_dead(self):
+        enqueue('save-report', {'order_id': self.order.pk})
+        first = claim('a')[0]
+        self.assertFalse(run(first, 'a'))
+        queued = Job.objects.get()
+        self.assertEqual((queued.state, queued.attempts), ('Q', 1))
+        self.assertGreater(queued.run_at, timezone.now())
+        self.assertIn('TypeError', queued.last_error)
+        self.assertEqual(claim('a'), [])
+
+        second = claim('a', now=queued.run_at)[0]
+        self.assertFalse(run(second, 'a'))
+        self.assertEqual(Job.objects.get().state, 'D')
+        self.assertFalse(Report.objects.exists())
+        self.assertEqual(retry(Job.objects.all()), 1)
+        self.assertEqual(Job.objects.get().attempts, 0)
+
+
+class CatalogImportExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Shirts', slug='shirts')
+        cls.item = create_item(cls.category, 'oxford-shirt')
+
+    def import_csv(self, text, batch_size=2):
+        out, err = io.StringIO(), io.StringIO()
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write(text)
+        self.addCleanup(os.remove, f.name)
+        call_command('import_catalog', f.name, batch_size=batch_size, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_import_upserts_by_slug_and_generates_unique_slugs(self):
+        out, err = self.import_csv(
+            'slug,title,category,price,discount_price,label,description,image\n'
+            'oxford-shirt,Oxford shirt,Shirts,25,20,S,Updated,\n'
+            ',Linen Shirt,Shirts,30,,,,\n'
+            ',Linen shirt,Summer,31,,,,\n'
+            ',Linen shirt,Summer,32,,,,\n'
+            ',No price,Shirts,,,,,\n'
+        )
+        self.assertIn('created 3 item(s) and 1 category(ies), updated 1, left 0 unchanged and skipped 1', out)
+        self.assertIn('line 6: price is required', err)
+        self.item.refresh_from_db()
+        self.assertEqual((self.item.price, self.item.discount_price, self.item.label), (25, 20, 'S'))
+        self.assertEqual(sorted(Item.objects.filter(title__iexact='linen shirt').values_list('slug', flat=True)),
+                         ['linen-shirt', 'linen-shirt-2', 'linen-shirt-3'])
+        self.assertEqual(Item.objects.get(slug='linen-shirt-3').category.slug, 'summer')
+        self.assertEqual(len(get_search_backend().search('linen')), 3)
+
+    def test_export_round_trips_through_import(self):
+        out = io.StringIO()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'catalog.jsonl')
+            call_command('export_catalog', path, chunk_size=1, stderr=out)
+            self.assertIn('Wrote 1 item(s)', out.getvalue())
+            with open(path) as f:
+                self.assertEqual(json.loads(f.readline())['slug'], 'oxford-shirt')
+            call_command('import_catalog', path, stdout=out)
+        self.assertIn('updated 0, left 1 unchanged', out.getvalue())
+        self.assertEqual(Item.objects.count(), 1)
+
+    def test_admin_export_streams_csv(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'secret'))
+        response = self.client.post(reverse('admin:core_item_changelist'), {
+            'action': 'export_items', '_selected_action': [self.item.pk],
+        })
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'slug,title,category,price,discount_price,label,description,image')
+        self.assertTrue(lines[1].startswith('oxford-shirt,Oxford-Shirt,Shirts,10.0'))
+
+
+class RefCodeTests(TestCase):
+    def test_codes_are_unique_and_check_digited(self):
+        codes = [encode_ref_code(n) for n in range(5000)]
+        self.assertEqual(len(set(codes)), len(codes))
+        self.assertTrue(all(len(code) == 10 and is_valid_ref_code(code) for code in codes))
+
+    def test_migration_issues_the_same_codes(self):
+        migration = importlib.import_module('core.migrations.0039_ref_code_allocator')
+        self.assertEqual([migration.encode_ref_code(n) for n in range(500)], [encode_ref_code(n) for n in range(500)])
+        self.assertEqual(migration.SEQUENCE_NAME, SEQUENCE_NAME)
+
+    def test_typos_are_rejected(self):
+        code = encode_ref_code(42)
+        swapped = code[1] + code[0] + code[2:]
+        retyped = code[:3] + ('0' if code[3] != '0' else '1') + code[4:]
+        for typo in (swapped, retyped, code[:-1]):
+            if typo != code:
+                self.assertFalse(is_valid_ref_code(typo), typo)
+
+    def test_allocators_reserve_disjoint_blocks(self):
+        first, second = RefCodeAllocator(block_size=10), RefCodeAllocator(block_size=10)
+        codes = first.allocate(15) + second.allocate(5) + first.allocate(3)
+        self.assertEqual(len(set(codes)), 23)
+
+    def test_form_rejects_invalid_code_after_one_lookup(self):
+        code = encode_ref_code(7)
+        form = RefundForm({'ref_code': code[:-1] + ('0' if code[-1] != '0' else '1'), 'message': 'Broken',
+                           'phone_number': '1', 'email': 'ann@example.com'})
+        with self.assertNumQueries(1):
+            self.assertFalse(form.is_valid())
+        self.assertIn('ref_code', form.errors)
+        form = RefundForm({'ref_code': code.lower(), 'message': 'Broken', 'phone_number': '1',
+                           'email': 'ann@example.com'})
+        with self.assertNumQueries(0):
+            self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data['ref_code'], code)
+
+    def legacy_order(self, ref_code):
+        user, _ = User.objects.get_or_create(username='legacy')
+        return Order.objects.create(user=user, ordered=True, ordered_date=date.today(), ref_code=ref_code)
+
+    def test_form_accepts_legacy_codes_an_order_holds(self):
+        self.legacy_order('LEGACYCODE')
+        self.assertFalse(is_valid_ref_code('LEGACYCODE'))
+        form = RefundForm({'ref_code': 'legacy code', 'message': 'Broken', 'phone_number': '1',
+                           'email': 'ann@example.com'})
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.cleaned_data['ref_code'], 'LEGACYCODE')
+
+    def test_allocator_skips_codes_legacy_orders_hold(self):
+        held = encode_ref_code(Sequence.objects.get(name=SEQUENCE_NAME).next_value)
+        self.legacy_order(held)
+        codes = RefCodeAllocator(block_size=3).allocate(3)
+        self.assertEqual(len(set(codes)), 3)
+        self.assertNotIn(held, codes)
+
+    def test_migration_keeps_existing_codes(self):
+        migration = importlib.import_module('core.migrations.0039_ref_code_allocator')
+        Sequence.objects.all().delete()
+        legacy = self.legacy_order('LEGACYCODE')
+        held = self.legacy_order(encode_ref_code(0))
+        blank = self.legacy_order(None)
+        migration.reissue_ref_codes(django_apps, None)
+        codes = dict(Order.objects.values_list('pk', 'ref_code'))
+        self.assertEqual(
+            (codes[legacy.pk], codes[held.pk], codes[blank.pk]),
+            ('LEGACYCODE', encode_ref_code(0), encode_ref_code(1)),
+        )
+        self.assertEqual(Sequence.objects.get(name=SEQUENCE_NAME).next_value, 2)
+
+
+class InventoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', password='secret')
+        cls.rival = User.objects.create_user('rival', password='secret')
+        cls.shirt = create_item(Category.objects.create(name='Shirts', slug='shirts'), 'shirt')
+
+    def billing_address(self):
+        return BillingAddress(user=self.user, first_name='Ann', last_name='Lee', email='ann@example.com',
+                              phone_number='123', street_address='Main St 1', country='UA', zip='01001')
+
+    def test_cart_holds_stock_until_checkout(self):
+        set_stock(self.shirt, 3, shards=2)
+        cart = CartService(self.user)
+        cart.add(self.shirt)
+        cart.add(self.shirt)
+        self.assertEqual(get_stock(self.shirt), 1)
+        cart.remove_single(self.shirt)
+        self.assertEqual(get_stock(self.shirt), 2)
+        cart.checkout(self.billing_address(), ref_code='ABC')
+        self.assertEqual(get_stock(self.shirt), 2)
+        self.assertFalse(StockHold.objects.exists())
+
+    def test_expired_holds_are_released_and_reclaimed_at_checkout(self):
+        set_stock(self.shirt, 3)
+        cart = CartService(self.user)
+        cart.add(self.shirt)
+        self.assertEqual(release_expired(), 0)
+        self.assertEqual(release_expired(now=timezone.now() + timedelta(days=1)), 1)
+        self.assertEqual(get_stock(self.shirt), 3)
+        cart.checkout(self.billing_address(), ref_code='ABC')
+        self.assertEqual(get_stock(self.shirt), 2)
+
+    def test_no_overselling(self):
+        set_stock(self.shirt, 2, shards=2)
+        CartService(self.rival).add(self.shirt)
+        cart = CartService(self.user)
+        cart.add(self.shirt)
+        with self.assertRaises(OutOfStock):
+            cart.add(self.shirt)
+        self.assertEqual(OrderItem.objects.get(user=self.user).quantity, 1)
+        StockHold.objects.filter(user=self.user).delete()
+        with self.assertRaises(OutOfStock):
+            cart.checkout(self.billing_address(), ref_code='ABC')
+        self.assertFalse(Order.objects.filter(ordered=True).exists())
+
+    def test_reservation_spans_shards_when_none_has_enough(self):
+        set_stock(self.shirt, 4, shards=4)
+        CartService(self.user).merge({self.shirt.pk: 3})
+        self.assertEqual(get_stock(self.shirt), 1)
+        self.assertEqual(StockHold.objects.aggregate(n=Sum('quantity'))['n'], 3)
+
+    def test_restock_adds_to_what_is_left(self):
+        restock(self.shirt, 5)
+        self.assertEqual((self.shirt.stock_shards, get_stock(self.shirt)), (settings.STOCK_SHARDS, 5))
+        CartService(self.user).add(self.shirt)
+        restock(self.shirt, 3)
+        self.assertEqual(get_stock(self.shirt), 7)
+
+    def test_admin_restocks_without_overwriting_reservations(self):
+        set_stock(self.shirt, 4, shards=2)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'secret'))
+        path = reverse('admin:core_item_change', args=[self.shirt.pk])
+        shards = StockShard.objects.filter(item=self.shirt).order_by('shard')
+        data = {
+            'title': 'Shirt', 'price': 10, 'category': self.shirt.category_id, 'label': 'P',
+            'description': 'Shirt', 'slug': 'shirt', 'add_stock': 3,
+            'stockshard_set-TOTAL_FORMS': 2, 'stockshard_set-INITIAL_FORMS': 2,
+            # Quantities are read-only; a posted one is ignored.
+            'stockshard_set-0-quantity': 100,
+        }
+        for n, shard in enumerate(shards):
+            data.update({f'stockshard_set-{n}-id': shard.pk, f'stockshard_set-{n}-item': self.shirt.pk})
+        # A cart reserves a unit while the page is open.
+        CartService(self.user).add(self.shirt)
+        response = self.client.post(path, data)
+        self.assertRedirects(response, reverse('admin:core_item_changelist'))
+        self.assertEqual(get_stock(self.shirt), 6)
+
+
+class PromotionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', password='secret')
+        cls.shirts = Category.objects.create(name='Shirts', slug='shirts')
+        cls.hats = Category.objects.create(name='Hats', slug='hats')
+        cls.shirt = create_item(cls.shirts, 'shirt', price=20.0)
+        cls.sale_shirt = create_item(cls.shirts, 'sale-shirt', price=20.0, discount_price=12.0)
+        cls.hat = create_item(cls.hats, 'hat', price=10.0)
+
+    def tearDown(self):
+        # Rolled back rows send no signals; make the next test recompile.
+        bump_promotion_version()
+
+    def test_cart_gets_best_offer_per_line_then_threshold(self):
+        Promotion.objects.create(name='Shirt week', kind='P', category=self.shirts, percent=25)
+        Promotion.objects.create(name='Hat trick', kind='B', item=self.hat, buy_quantity=2, get_quantity=1)
+        Promotion.objects.create(name='Spend 50', kind='T', min_subtotal=50, amount=5)
+        Promotion.objects.create(name='Expired', kind='P', percent=90,
+                                 ends_at=timezone.now() - timedelta(days=1))
+        lines = [OrderItem(item=self.shirt, quantity=2), OrderItem(item=self.sale_shirt, quantity=1),
+                 OrderItem(item=self.hat, quantity=3)]
+        cart = price_cart(lines)
+        # 2 x 15 with the category sale; 12 beats 25% off 20; 2 of 3 hats paid.
+        self.assertEqual([line.promotion.name if line.promotion else None for line in lines],
+                         ['Shirt week', 'Spend 50', 'Hat trick'])
+        self.assertEqual(cart.cart_rule.name, 'Spend 50')
+        self.assertEqual(cart.total, 30 + 12 + 20 - 5)
+        self.assertAlmostEqual(sum(line.get_final_price() for line in lines), cart.total)
+
+    def test_checkout_freezes_promotions(self):
+        Promotion.objects.create(name='Shirt week', kind='P', category=self.shirts, percent=25)
+        cart = CartService(self.user)
+        cart.add(self.shirt)
+        cart.add(self.hat)
+        cart.checkout(BillingAddress(user=self.user, first_name='Ann', last_name='Lee', email='ann@example.com',
+                                     phone_number='123', street_address='Main St 1', country='UA', zip='01001'),
+                      ref_code='ABC')
+        Promotion.objects.all().delete()
+        order = Order.objects.get(user=self.user)
+        self.assertEqual(recompute_order_totals(Order.objects.all()), 0)
+        self.assertEqual(order.get_total(), 15 + 10)
+        self.assertAlmostEqual(SalesRollup.objects.aggregate(n=Sum('revenue'))['n'], 25)
+
+    def test_rules_missing_their_fields_are_skipped(self):
+        Promotion.objects.create(name='No quantities', kind='B', item=self.hat)
+        Promotion.objects.create(name='No percent', kind='P', item=self.shirt)
+        Promotion.objects.create(name='Both', kind='T', min_subtotal=1, percent=10, amount=5)
+        Promotion.objects.create(name='No minimum', kind='T', amount=5)
+        Promotion.objects.create(name='Hat sale', kind='P', item=self.hat, percent=200)
+        with self.assertLogs('core.promotions', 'WARNING') as logs:
+            cart = price_cart([OrderItem(item=self.shirt, quantity=1), OrderItem(item=self.hat, quantity=3)])
+        self.assertEqual(len(logs.output), 5)
+        self.assertEqual(cart.total, 20 + 30)
+
+    def test_open_cart_totals_include_promotions(self):
+        Promotion.objects.create(name='Shirt week', kind='P', category=self.shirts, percent=25)
+        cart = CartService(self.user)
+        cart.add(self.shirt)
+        cart.add(self.hat)
+        order = Order.objects.get(user=self.user)
+        self.assertEqual(order.get_total(), 15 + 10)
+        self.client.force_login(self.user)
+        cache.clear()
+        self.assertEqual(self.client.get(reverse('core:order-summary')).context['cart_summary'].total, 25)
+        Promotion.objects.create(name='Hat day', kind='P', item=self.hat, percent=50)
+        work('test')
+        self.assertEqual(Order.objects.get(pk=order.pk).get_total(), 15 + 5)
+        self.assertEqual(recompute_order_totals(Order.objects.all()), 0)
+
+    def test_listings_show_promotions_and_registry_loads_once(self):
+        promotions.compiled()
+        with self.assertNumQueries(0):
+            promotions.compiled()
+        self.assertNotContains(self.client.get(reverse('core:home')), 'Shirt week')
+        Promotion.objects.create(name='Shirt week', kind='P', item=self.shirt, percent=25)
+        response = self.client.get(reverse('core:home'))
+        self.assertContains(response, 'Shirt week')
+        self.assertContains(response, '15.0$')
+        self.assertContains(self.client.get(self.shirt.get_absolute_url()), 'Shirt week')
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.shirts = Category.objects.create(name='Shirts', slug='shirts')
+        cls.linen = create_item(cls.shirts, 'linen-shirt')
+        cls.oxford = create_item(cls.shirts, 'oxford-shirt')
+        cls.oxford.description = 'Shirt in linen and cotton'
+        cls.oxford.save()
+
+    def search(self, query):
+        return [item.slug for item in get_search_backend().search(query)]
+
+    def test_words_match_as_prefixes_and_all_must_match(self):
+        self.assertEqual(self.search('oxf'), ['oxford-shirt'])
+        self.assertEqual(self.search('shir cott'), ['oxford-shirt'])
+        self.assertEqual(self.search('socks'), [])
+        self.assertEqual(self.search('  '), [])
+
+    def test_quoted_phrase_matches_consecutive_words(self):
+        self.assertEqual(self.search('"linen shirt"'), ['linen-shirt'])
+        self.assertEqual(sorted(self.search('linen shirt')), ['linen-shirt', 'oxford-shirt'])
+
+    def test_title_matches_rank_above_description_matches(self):
+        self.assertEqual(self.search('linen'), ['linen-shirt', 'oxford-shirt'])
+
+    def test_results_page_through_the_index(self):
+        for n in range(13):
+            create_item(self.shirts, f'plain-tee-{n}')
+        response = self.client.get(reverse('core:search'), {'search': 'plain', 'page': 2})
+        self.assertEqual(response.context['paginator'].count, 13)
+        self.assertEqual(len(response.context['all_search_results']), 1)
+
+    def test_index_follows_item_and_category_changes(self):
+        self.linen.title = 'Hemp Shirt'
+        self.linen.save()
+        self.assertEqual(self.search('hemp'), ['linen-shirt'])
+        self.shirts.name = 'Tops'
+        self.shirts.save()
+        self.assertEqual(sorted(self.search('tops')), ['linen-shirt', 'oxford-shirt'])
+        self.oxford.delete()
+        self.assertEqual(self.search('cotton'), [])
+
+    def test_database_backend_matches_the_same_items(self):
+        get_search_backend.cache_clear()
+        self.addCleanup(get_search_backend.cache_clear)
+        with override_settings(SEARCH_BACKEND='core.search.database.DatabaseSearchBackend'):
+            self.assertEqual(self.search('oxf'), ['oxford-shirt'])
+            self.assertEqual(self.search('"linen shirt"'), ['linen-shirt'])
+            self.assertEqual(self.search('linen shirt'), ['linen-shirt', 'oxford-shirt'])
+
+
+class CatalogCacheTests(TestCase):
+    def test_catalog_version_is_bumped_again_on_commit(self):
+        category = Category.objects.create(name='Shirts', slug='shirts')
+        before = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            create_item(category, 'shirt')
+            during = get_catalog_version()
+        self.assertGreater(during, before)
+        self.assertGreater(get_catalog_version(), during)
+
+    def test_grid_cache_is_keyed_on_the_decoded_cursor(self):
+        seed_storefront(orders=0)
+        cache.clear()
+        self.client.get(reverse('core:home'))
+        keys = set(cache._cache)
+        for cursor in ('junk', 'e30', 'eyJwIjpbMV0sInIiOmZhbHNlfQ', 'eyJwIjpbMV0sInIiOmZhbHNlfQ=='):
+            self.client.get(reverse('core:home') + f'?cursor={cursor}')
+        # Both spellings of the valid token share one entry; the junk starts at the first page.
+        self.assertEqual(len(set(cache._cache) - keys), 1)
+
+
+class CursorPaginatorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Shirts', slug='shirts')
+        # Repeated prices make the id the tie-breaker.
+        for n, price in enumerate([5.0, 5.0, 7.0, 7.0, 7.0, 9.0]):
+            create_item(category, f'shirt-{n}', price=price)
+
+    def paginator(self, per_page=3):
+        return CursorPaginator(Item.objects.all(), per_page, ('-price', 'id'))
+
+    def slugs(self, page):
+        return [item.slug for item in page]
+
+    def test_pages_split_exactly_on_a_multiple_of_per_page(self):
+        paginator = self.paginator()
+        first = paginator.page()
+        self.assertEqual(self.slugs(first), ['shirt-5', 'shirt-2', 'shirt-3'])
+        self.assertEqual((first.has_previous(), first.has_next()), (False, True))
+        self.assertIsNone(first.previous_cursor())
+        last = paginator.page(first.next_cursor())
+        self.assertEqual(self.slugs(last), ['shirt-4', 'shirt-0', 'shirt-1'])
+        self.assertEqual((last.has_previous(), last.has_next()), (True, False))
+        self.assertIsNone(last.next_cursor())
+
+    def test_short_last_page_and_paging_back(self):
+        paginator = self.paginator(per_page=4)
+        last = paginator.page(paginator.page().next_cursor())
+        self.assertEqual(self.slugs(last), ['shirt-0', 'shirt-1'])
+        back = paginator.page(last.previous_cursor())
+        self.assertEqual(self.slugs(back), ['shirt-5', 'shirt-2', 'shirt-3', 'shirt-4'])
+        self.assertEqual((back.has_previous(), back.has_next()), (False, True))
+        self.assertEqual(self.slugs(paginator.page(back.next_cursor())), ['shirt-0', 'shirt-1'])
+
+    def test_paging_back_from_the_middle(self):
+        paginator = self.paginator(per_page=2)
+        middle = paginator.page(paginator.page().next_cursor())
+        self.assertEqual(self.slugs(middle), ['shirt-3', 'shirt-4'])
+        back = paginator.page(middle.previous_cursor())
+        self.assertEqual(self.slugs(back), ['shirt-5', 'shirt-2'])
+        self.assertEqual((back.has_previous(), back.has_next()), (False, True))
+
+    def test_tampered_cursors_are_rejected(self):
+        paginator = self.paginator()
+        valid = paginator.encode_position([7.0, 1], False)
+        tampered = [
+            'not base64!',
+            valid[:-3],
+            paginator.encode_position([7.0], False),
+            paginator.encode_position([7.0, 1, 2], False),
+            paginator.encode_position(['cheap', 1], False),
+            paginator.encode_position(7, False),
+            'eyJwIjpbNywxXX0',  # {"p":[7,1]}, without the direction.
+        ]
+        for cursor in tampered:
+            with self.subTest(cursor=cursor):
+                with self.assertRaises(InvalidCursor):
+                    paginator.page(cursor)
+                self.assertEqual(self.slugs(paginator.get_page(cursor)), ['shirt-5', 'shirt-2', 'shirt-3'])
+                self.assertEqual(paginator.normalize_cursor(cursor), '')
+        self.assertEqual(paginator.normalize_cursor(valid + '=='), valid)
+
+
+class CatalogApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Shirts', slug='shirts')
+        cls.item = create_item(category, 'oxford-shirt')
+        set_stock(cls.item, 5)
+
+    def test_unchanged_catalog_is_answered_with_304(self):
+        path = reverse('core:item-list')
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.client.get(path, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.item.title = 'Oxford'
+        self.item.save()
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_fields_parameter_limits_the_representation(self):
+        path = reverse('core:item-detail', kwargs={'pk': self.item.pk})
+        self.assertEqual(self.client.get(path + '?fields=id,slug').json(), {'id': self.item.pk, 'slug': 'oxford-shirt'})
+        item = self.client.get(path).json()
+        self.assertEqual(item['category'], {'id': self.item.category_id, 'name': 'Shirts', 'slug': 'shirts'})
+        self.assertNotIn('stock_shards', item)
+
+
+class CategoryRegistryTests(TestCase):
+    def test_lookups_are_free_until_a_category_changes(self):
+        shirts = Category.objects.create(name='Shirts', slug='shirts')
+        categories.all()
+        with self.assertNumQueries(0):
+            self.assertEqual(categories.get('shirts').url, reverse('core:filter-by-category', args=['shirts']))
+            self.assertIsNone(categories.get('hats'))
+        shirts.name = 'Tees'
+        shirts.save()
+        Category.objects.create(name='Hats', slug='hats')
+        with self.assertNumQueries(1):
+            self.assertEqual([entry.name for entry in categories.all()], ['Tees', 'Hats'])
+
+
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root, IMAGE_DERIVATIVE_ROOT=f'{media_root}/derivatives')
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.media_root = media_root
+        Image.new('RGB', (800, 600), 'red').save(f'{media_root}/shirt.jpg')
+        self.url = derivative_url('shirt.jpg', 'card')
+
+    def test_renders_preset_once_and_caches_for_good(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        with Image.open(io.BytesIO(b''.join(response.streaming_content))) as image:
+            self.assertEqual((image.format, image.size), ('WEBP', (210, 243)))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_only_the_current_version_is_cached_for_good(self):
+        bare = reverse('core:image-derivative', kwargs={'preset': 'card', 'name': 'shirt.jpg'})
+        response = self.client.get(bare)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=300')
+        Image.new('RGB', (400, 300), 'blue').save(f'{self.media_root}/shirt.jpg')
+        self.assertNotEqual(derivative_url('shirt.jpg', 'card'), self.url)
+        # The outdated URL serves the new rendition, but only briefly.
+        stale = self.client.get(self.url)
+        self.assertEqual(stale['Cache-Control'], 'public, max-age=300')
+        self.assertNotEqual(stale['ETag'], response['ETag'])
+        response = self.client.get(derivative_url('shirt.jpg', 'card'))
+        self.assertEqual((response['ETag'], response['Cache-Control']),
+                         (stale['ETag'], 'public, max-age=31536000, immutable'))
+
+    def test_unknown_images_and_presets_are_not_found(self):
+        missing = reverse('core:image-derivative', kwargs={'preset': 'card', 'name': 'missing.jpg'})
+        unknown = reverse('core:image-derivative', kwargs={'preset': 'huge', 'name': 'shirt.jpg'})
+        self.assertEqual(self.client.get(missing).status_code, 404)
+        self.assertEqual(self.client.get(unknown).status_code, 404)
+
+
+class StaticFilesTests(TestCase):
+    def setUp(self):
+        static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static_root)
+        settings = override_settings(STATIC_ROOT=static_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        with open(f'{static_root}/site.css', 'w') as css:
+            css.write('.card { color: red; }\n' * 100)
+        CompressedManifestStaticFilesStorage(location=static_root).compress('site.css')
+
+    def test_precompressed_variant_is_negotiated(self):
+        compressed = self.client.get('/static/site.css', HTTP_ACCEPT_ENCODING='br, gzip;q=0.8')
+        plain = self.client.get('/static/site.css', HTTP_ACCEPT_ENCODING='identity')
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertLess(int(compressed['Content-Length']), int(plain['Content-Length']))
+        for response in (compressed, plain):
+            self.assertEqual(response['Content-Type'], 'text/css')
+            self.assertEqual(response['Vary'], 'Accept-Encoding')
+
+    def test_paths_outside_static_root_fall_through(self):
+        middleware = StaticFilesMiddleware(lambda request: HttpResponse('fell through'))
+        for path in ('/static/../x', '/static/../../etc/passwd', '/static/%2e%2e/x'):
+            with self.subTest(path=path):
+                request = RequestFactory().get(path)
+                self.assertEqual(middleware(request).content, b'fell through')
+
+    def test_q_values_are_honoured(self):
+        accepted = ['gzip', 'GZIP;q=0.5', 'br, *;q=0.1', 'x-gzip', 'gzip;q=0.001, *;q=0']
+        refused = ['', 'br', 'gzip;q=0', 'gzip; q=0.0, br', '*;q=0', 'gzip;q=0, *', 'gzip;q=high']
+        for header in accepted + refused:
+            with self.subTest(accept_encoding=header):
+                response = self.client.get('/static/site.css', HTTP_ACCEPT_ENCODING=header)
+                self.assertEqual(response.get('Content-Encoding'), 'gzip' if header in accepted else None)
+
+
+class DatasetToolsTests(TestCase):
+    def generate(self, **options):
+        out = io.StringIO()
+        call_command('generate_dataset', categories=3, items=20, users=4, carts=2, orders=12, batch_size=5,
+                     stdout=out, **options)
+        return out.getvalue()
+
+    def test_generate_dataset_creates_consistent_history(self):
+        out = self.generate(stock=5, stock_shards=2)
+        self.assertIn('Created 3 categories, 20 items, 4 users, 12 orders and 2 open carts.', out)
+        placed = Order.objects.filter(ordered=True)
+        self.assertEqual((placed.count(), Order.objects.filter(ordered=False).count()), (12, 2))
+        self.assertEqual(len(set(placed.values_list('ref_code', flat=True))), 12)
+        self.assertTrue(all(is_valid_ref_code(code) for code in placed.values_list('ref_code', flat=True)))
+        for order in Order.objects.all():
+            stored = (order.subtotal, order.discount, order.item_count)
+            recompute_order_totals(Order.objects.filter(pk=order.pk))
+            order.refresh_from_db()
+            self.assertEqual((order.subtotal, order.discount, order.item_count), stored)
+        self.assertEqual(SalesRollup.objects.aggregate(n=Sum('units'))['n'],
+                         OrderItem.objects.filter(ordered=True).aggregate(n=Sum('quantity'))['n'])
+        self.assertEqual({get_stock(item) for item in Item.objects.all()}, {5})
+
+    def test_benchmark_views_reports_every_route(self):
+        self.generate()
+        # The test runner has set up the test environment that the command sets up itself.
+        teardown_test_environment()
+        self.addCleanup(setup_test_environment)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'report.json')
+            call_command('benchmark_views', iterations=2, warmup=0, output=path)
+            with open(path) as f:
+                report = json.load(f)
+        self.assertEqual(report['dataset']['items'], 20)
+        self.assertEqual(set(report['routes']), {pattern.name for pattern in route_patterns()})
+        home = report['routes']['home']
+        self.assertEqual((home['path'], home['status']), (reverse('core:home'), [200]))
+        self.assertLessEqual(home['p50_ms'], home['p99_ms'])
+        self.assertGreater(home['queries']['min'], 0)
+
+
+class QueryPlanAuditTests(TestCase):
+    def scans(self, run):
+        with CaptureQueriesContext(connection) as captured:
+            try:
+                run()
+            except Item.DoesNotExist:
+                pass
+        return [table for query in captured for table, _ in AuditCommand().full_scans(connection.vendor, query['sql'])]
+
+    def test_get_on_unindexed_column_is_reported(self):
+        self.assertEqual(self.scans(lambda: Item.objects.get(title='Missing')), ['core_item'])
+        self.assertEqual(self.scans(lambda: Item.objects.filter(title='Missing').first()), ['core_item'])
+
+    def test_indexed_lookups_and_first_keyset_page_pass(self):
+        self.assertEqual(self.scans(lambda: Item.objects.get(slug='missing')), [])
+        self.assertEqual(self.scans(lambda: list(Item.objects.order_by('-pk')[:12])), [])
+
+
+class ViewQueryBudgetTests(QueryBudgetTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = seed_storefront(stock=20)
+        cls.order = Order.objects.filter(user=cls.user, ordered=True).first()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def budgeted_paths(self):
+        kwargs = {
+            'product': {'slug': 'item-0-1'},
+            'add-to-cart': {'slug': 'item-2-2'},
+            'remove-single-item-from-cart': {'slug': 'item-0-0'},
+            'remove-from-cart': {'slug': 'item-0-1'},
+            'order-detail': {'pk': self.order.pk},
+            'report': {'pk': self.order.pk},
+            'filter-by-category': {'slug': 'category-1'},
+            'item-detail': {'pk': Item.objects.first().pk},
+        }
+        query = {'search': '?search=item'}
+        for pattern in core_urls.urlpatterns:
+            if not isinstance(pattern, URLPattern) or get_query_budget(pattern.callback) is None:
+                continue
+            path = reverse(f'core:{pattern.name}', kwargs=kwargs.get(pattern.name))
+            yield pattern.name, path + query.get(pattern.name, '')
+
+    def test_views_stay_within_query_budget(self):
+        paths = dict(self.budgeted_paths())
+        self.assertIn('home', paths)
+        for name, path in paths.items():
+            with self.subTest(view=name):
+                self.assertWithinQueryBudget(path)
+
+    def test_checkout_stays_within_query_budget(self):
+        self.assertWithinQueryBudget(reverse('core:checkout'), data={
+            'first_name': 'Ann', 'last_name': 'Lee', 'phone_number': '1', 'street_address': 'Main St 1',
+            'country': 'UA', 'zip': '01001', 'payment_option': 'L',
+        })
+        self.assertFalse(Order.objects.filter(user=self.user, ordered=False).exists())
+
+    def test_server_timing_header_is_opt_in(self):
+        with override_settings(SERVER_TIMING=True):
+            response = self.client.get(reverse('core:home'))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", app;dur=[\d.]+$')
+        with override_settings(SERVER_TIMING=False), self.assertLogs('core.performance', 'DEBUG') as logs:
+            response = self.client.get(reverse('core:home'))
+        self.assertNotIn('Server-Timing', response)
+        self.assertRegex(logs.output[0], r'GET core:home ran \d+ queries in [\d.]+ ms of SQL')
+
+
+@override_settings(ROOT_URLCONF='shop.asgi_urls', SERVER_TIMING=True)
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_storefront()
+
+    async def test_read_only_views_are_async(self):
+        paths = {
+            'home': (reverse('core:home'), 'Item 0-0'),
+            'product': (reverse('core:product', kwargs={'slug': 'item-0-1'}), 'Description of item 0-1'),
+            'filter-by-category': (reverse('core:filter-by-category', kwargs={'slug': 'category-1'}), 'Item 1-0'),
+            'search': (reverse('core:search') + '?search=item', 'Item '),
+        }
+        for name, (path, text) in paths.items():
+            with self.subTest(view=name):
+                self.assertTrue(asyncio.iscoroutinefunction(resolve(path.split('?')[0]).func))
+                response = await self.async_client.get(path)
+                self.assertContains(response, text)
+                self.assertIn('Server-Timing', response)
+        response = await self.async_client.get(reverse('core:category-detail', kwargs={'pk': 999}))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_catalog_api_answers_unchanged_catalog_with_304(self):
+        path = reverse('core:item-list')
+        response = await self.async_client.get(path)
+        self.assertEqual(response.status_code, 200)
+        # The async client in Django 4.0 takes extra headers by their HTTP name.
+        response = await self.async_client.get(path, **{'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    def test_hot_item_is_never_oversold(self):
+        shirt = create_item(Category.objects.create(name='Shirts', slug='shirts'), 'shirt')
+        stock, workers = 10, 16
+        set_stock(shirt, stock, shards=4)
+        users = [User.objects.create_user(f'buyer{n}', password='secret') for n in range(workers)]
+        barrier = threading.Barrier(workers)
+        results, durations = [], []
+
+        def buy(user):
+            try:
+                serialize_transactions(connection)
+                barrier.wait()
+                start = time.perf_counter()
+                try:
+                    cart = CartService(user)
+                    cart.add(shirt)
+                    cart.checkout(BillingAddress(user=user, first_name='Ann', last_name='Lee', email='a@example.com',
+                                                 phone_number='1', street_address='Main St 1', country='UA',
+                                                 zip='01001'),
+                                  ref_code=f'REF{user.pk}')
+                    results.append('sold')
+                except OutOfStock:
+                    results.append('out of stock')
+                durations.append(time.perf_counter() - start)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=30)
+
+        self.assertEqual(results.count('sold'), stock)
+        self.assertEqual(results.count('out of stock'), workers - stock)
+        self.assertEqual(Order.objects.filter(ordered=True).count(), stock)
+        self.assertEqual(get_stock(shirt), 0)
+        self.assertLess(max(durations), 5)
+
+
+class ConcurrentCartTests(TransactionTestCase):
+    def test_serialized_adds_lose_no_updates(self):
+        # SQLite has no row locks, so each thread's transaction takes the
+        # write lock up front and the adds run one after another. This checks
+        # that every add lands from its own connection; the unique-constraint
+        # fallbacks for lost races are forced in CartServiceTests.
+        user = User.objects.create_user('buyer', password='secret')
+        shirt = create_item(Category.objects.create(name='Shirts', slug='shirts'), 'shirt')
+        workers = 8
+        barrier = threading.Barrier(workers)
+
+        def add():
+            try:
+                serialize_transactions(connection)
+                barrier.wait()
+                CartService(user).add(shirt)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=add) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        order = Order.objects.get(user=user, ordered=False)
+        self.assertEqual(order.items.get().quantity, workers)
@@ -2,8 +2,9 @@ from django.urls import path, include, re_path
 from rest_framework import routers
 from . import views
 
-# router = routers.DefaultRouter()
-# router.register(r'items', views.ItemViewSet)
+router = routers.SimpleRouter()
+router.register(r'items', views.ItemViewSet)
+router.register(r'categories', views.CategoryViewSet)
 
 
 urlpatterns = [
@@ -19,9 +20,12 @@ urlpatterns = [
     path('request-refund/', views.RequestRefundView.as_view(), name='request-refund'),
     path('order-list/', views.order_list, name='order-list'),
     path('order-detail/<int:pk>/', views.order_detail, name='order-detail'),
+    path('dashboard/sales/', views.sales_dashboard, name='sales-dashboard'),
     path('order/<int:pk>/report/', views.ReportView.as_view(), name='report'),
     path('category/<slug:slug>/', views.filter_by_category, name='filter-by-category'),
     path('search-results/', views.SearchView.as_view(), name='search'),
+    path('images/<slug:preset>/<path:name>', views.image_derivative, name='image-derivative'),
+    path('api/v1/', include(router.urls)),
     path('api/v1/drf-auth/', include('rest_framework.urls')),
     path('api/v1/', include('djoser.urls')),
     re_path(r'ˆauth/', include('djoser.urls.authtoken')),
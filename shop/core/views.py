@@ -1,139 +1,129 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.core.exceptions import ObjectDoesNotExist
-from django.views.generic import ListView, DetailView, View
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist, SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.views.generic import ListView, DetailView, TemplateView, View
 from rest_framework.views import APIView
-from .models import Item, OrderItem, Order, BillingAddress, Refund, Report, Category
+from .models import (Item, OrderItem, Order, BillingAddress, Category, SalesRollup, ArchivedOrder,
+                     ArchivedOrderItem)
 from django.utils import timezone
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.utils.cache import patch_vary_headers
+from django.utils.decorators import method_decorator
+from django.utils.http import parse_etags, quote_etag
+from django.views.decorators.http import condition, require_safe
 from .forms import CheckoutForm, RefundForm, ReportForm
-from django.core.paginator import Paginator
+from django.db.models import Prefetch, Sum
 from rest_framework import generics, viewsets
-from .serializers import ItemSerializer
+from rest_framework.pagination import CursorPagination
+from .serializers import CategorySerializer, ItemSerializer
+from .search import get_search_backend
+from .cart import CartService, ItemNotInCart, NoActiveOrder, SessionCart, get_cart
+from .inventory import OutOfStock
+from .jobs import enqueue
+from .middleware import query_budget
+from .pagination import ChainedCursorPaginator
+from .catalog import catalog_etag, catalog_last_modified, render_item_grid
+from .categories import categories
+from .promotions import annotate_items, price_cart
+from .ref_codes import create_ref_code
+from .images import DERIVATIVE_CONTENT_TYPE, PRESETS, DerivativeError, get_derivative, source_version
 from rest_framework.response import Response
 from rest_framework.decorators import action
-import string
-import random
+import os
+from datetime import timedelta
 
 
-def create_ref_code():
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=10))
+ORDERS_PER_PAGE = 10
+SALES_DASHBOARD_DAYS = (7, 30, 90, 365)
 
 
 class SearchView(ListView):
-    model = Item
+    query_budget = 7
     template_name = 'core/search.html'
     context_object_name = 'all_search_results'
-    categories = Category.objects.all()
-    extra_context = {
-        'categories': categories
-    }
+    paginate_by = 12
+
+    def get_search_query(self):
+        return self.request.GET.get('search', '').strip()
 
     def get_queryset(self):
-        result = super(SearchView, self).get_queryset()
-        query = self.request.GET.get('search')
+        query = self.get_search_query()
         if query:
-            post_result = Item.objects.filter(title__contains=query)
-            result = post_result
-        else:
-            result = None
-        return result
+            return get_search_backend().search(query)
+        return Item.objects.none()
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['search_query'] = self.get_search_query()
+        annotate_items(context['object_list'])
+        return context
 
+
+@query_budget(6)
 def filter_by_category(request, slug):
-    categories = Category.objects.all()
-    category = Category.objects.get(slug=slug)
-    items = Item.objects.filter(category=category)
-    paginator = Paginator(items, 12)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    category = categories.get_or_404(slug)
     context = {
-        'items': items,
         'category': category,
-        'categories': categories,
-        'page_obj': page_obj,
+        'item_grid': render_item_grid(request, Item.objects.filter(category_id=category.id),
+                                      'category', category.id),
     }
     return render(request, 'core/filter_by_category.html', context=context)
 
 
+@query_budget(15)
 def remove_single_item_from_cart(request, slug):
     item = get_object_or_404(Item, slug=slug)
-    order_qs = Order.objects.filter(user=request.user, ordered=False)
-    if order_qs.exists():
-        order = order_qs[0]
-        if order.items.filter(item__slug=item.slug).exists():
-            order_item = OrderItem.objects.filter(
-                user=request.user,
-                item=item,
-                ordered=False)[0]
-            if order_item.quantity > 1:
-                order_item.quantity -= 1
-                order_item.save()
-            else:
-                order.items.remove(order_item)
-            messages.info(request, 'This item quantity was updated.')
-            return redirect('core:order-summary')
-        else:
-            messages.info(request, 'This item was not in your cart.')
-            return redirect('core:product', slug=slug)
-    else:
+    try:
+        get_cart(request).remove_single(item)
+    except NoActiveOrder:
         messages.info(request, 'You don\'t have an active order.')
         return redirect('core:product', slug=slug)
+    except ItemNotInCart:
+        messages.info(request, 'This item was not in your cart.')
+        return redirect('core:product', slug=slug)
+    messages.info(request, 'This item quantity was updated.')
+    return redirect('core:order-summary')
 
 
-@login_required
+@query_budget(14)
 def remove_from_cart(request, slug):
     item = get_object_or_404(Item, slug=slug)
-    order_qs = Order.objects.filter(user=request.user, ordered=False)
-    if order_qs.exists():
-        order = order_qs[0]
-        if order.items.filter(item__slug=item.slug).exists():
-            order_item = OrderItem.objects.filter(
-                user=request.user,
-                item=item,
-                ordered=False)[0]
-            order.items.remove(order_item)
-            messages.info(request, 'This item was removed from your cart.')
-            return redirect('core:order-summary')
-        else:
-            messages.info(request, 'This item was not in your cart.')
-            return redirect('core:order-summary')
-    else:
+    try:
+        get_cart(request).remove(item)
+    except NoActiveOrder:
         messages.info(request, 'You don\'t have an active order.')
         return redirect('core:order-summary')
+    except ItemNotInCart:
+        messages.info(request, 'This item was not in your cart.')
+        return redirect('core:order-summary')
+    messages.info(request, 'This item was removed from your cart.')
+    return redirect('core:order-summary')
 
 
-@login_required
+@query_budget(16)
 def add_to_cart(request, slug):
     item = get_object_or_404(Item, slug=slug)
-    order_item, created = OrderItem.objects.get_or_create(
-        user=request.user,
-        item=item,
-        ordered=False)
-    order_qs = Order.objects.filter(user=request.user, ordered=False)
-    if order_qs.exists():
-        order = order_qs[0]
-        # check if the order item in the order
-        if order.items.filter(item__slug=item.slug).exists():
-            order_item.quantity += 1
-            order_item.save()
-            messages.info(request, 'Item quantity was updated.')
-            return redirect('core:order-summary')
-        else:
-            messages.info(request, 'Item was added to your cart.')
-            order.items.add(order_item)
-            return redirect('core:product', slug=slug)
-    else:
-        ordered_date = timezone.now()
-        order = Order.objects.create(user=request.user, ordered_date=ordered_date)
-        order.items.add(order_item)
+    try:
+        existed = get_cart(request).add(item)
+    except OutOfStock:
+        messages.warning(request, 'Sorry, there is not enough of this item in stock.')
+        return redirect('core:product', slug=slug)
+    if existed:
         messages.info(request, 'Item quantity was updated.')
-
+        return redirect('core:order-summary')
+    messages.info(request, 'Item was added to your cart.')
     return redirect('core:product', slug=slug)
 
 
-class CheckoutView(View):
+class CheckoutView(LoginRequiredMixin, View):
+    # Placing an order: the order lock, address, ref code, stock claim,
+    # promotion prices, line snapshot, totals and sales rollups.
+    query_budget = 20
+
     def get(self, *args, **kwargs):
         form = CheckoutForm()
         order = Order.objects.get(user=self.request.user, ordered=False)
@@ -145,80 +135,101 @@ class CheckoutView(View):
 
     def post(self, *args, **kwargs):
         form = CheckoutForm(self.request.POST or None)
-        try:
-            order = Order.objects.get(user=self.request.user, ordered=False)
-            if form.is_valid():
-                first_name = form.cleaned_data.get('first_name')
-                last_name = form.cleaned_data.get('last_name')
-                email = form.cleaned_data.get('email')
-                phone_number = form.cleaned_data.get('phone_number')
-                street_address = form.cleaned_data.get('street_address')
-                country = form.cleaned_data.get('country')
-                zip = form.cleaned_data.get('zip')
-                # TODO: add functionality for these fields
-                # same_shipping_address = form.cleaned_data.get('same_shipping_address')
-                # save_info = form.cleaned_data.get('save_info')
-                payment_option = form.cleaned_data.get('payment_option')
-                billing_address = BillingAddress(
-                    user=self.request.user,
-                    first_name=first_name,
-                    last_name=last_name,
-                    email=email,
-                    phone_number=phone_number,
-                    street_address=street_address,
-                    country=country,
-                    zip=zip
-                )
-                billing_address.save()
-                order.billing_address = billing_address
-
-                order_items = order.items.all()
-                order_items.update(ordered=True)
-                for item in order_items:
-                    item.save()
-
-                order.ordered = True
-                order.ref_code = create_ref_code()
-                order.save()
-                messages.success(self.request, 'Your order was successful!')
-                return redirect('core:home')
+        if not form.is_valid():
             messages.warning(self.request, 'Failed checkout')
             return redirect('core:checkout')
-        except ObjectDoesNotExist:
+        first_name = form.cleaned_data.get('first_name')
+        last_name = form.cleaned_data.get('last_name')
+        email = form.cleaned_data.get('email')
+        phone_number = form.cleaned_data.get('phone_number')
+        street_address = form.cleaned_data.get('street_address')
+        country = form.cleaned_data.get('country')
+        zip = form.cleaned_data.get('zip')
+        # TODO: add functionality for these fields
+        # same_shipping_address = form.cleaned_data.get('same_shipping_address')
+        # save_info = form.cleaned_data.get('save_info')
+        payment_option = form.cleaned_data.get('payment_option')
+        billing_address = BillingAddress(
+            user=self.request.user,
+            first_name=first_name,
+            last_name=last_name,
+            email=email,
+            phone_number=phone_number,
+            street_address=street_address,
+            country=country,
+            zip=zip
+        )
+        try:
+            CartService(self.request.user).checkout(billing_address, ref_code=create_ref_code())
+        except NoActiveOrder:
             messages.error(self.request, "You don't have an active order.")
             return redirect('core:order-summary')
+        except OutOfStock:
+            messages.error(self.request, 'Some items in your cart are no longer in stock.')
+            return redirect('core:order-summary')
+        messages.success(self.request, 'Your order was successful!')
+        return redirect('core:home')
+
 
+class OrderSummaryView(View):
+    query_budget = 8
 
-class OrderSummaryView(LoginRequiredMixin, View):
     def get(self, *args, **kwargs):
+        if not self.request.user.is_authenticated:
+            return self.session_cart()
         try:
             order = Order.objects.get(user=self.request.user, ordered=False)
+            order_items = list(order.items.select_related('item'))
+            cart = price_cart(order_items)
             context = {
                 "object": order,
+                "order_items": order_items,
+                "order_total": cart.total,
+                "cart_promotion": cart.cart_rule,
             }
             return render(self.request, 'core/order_summary.html', context)
         except ObjectDoesNotExist:
             messages.error(self.request, "You don't have an active order.")
             return redirect('/')
 
+    def session_cart(self):
+        order_items = SessionCart(self.request.session).lines()
+        if not order_items:
+            messages.error(self.request, "You don't have an active order.")
+            return redirect('/')
+        cart = price_cart(order_items)
+        context = {
+            "order_items": order_items,
+            "order_total": cart.total,
+            "cart_promotion": cart.cart_rule,
+        }
+        return render(self.request, 'core/order_summary.html', context)
 
-class HomeView(ListView):
-    model = Item
+
+class HomeView(TemplateView):
+    query_budget = 6
     template_name = 'core/home.html'
-    context_object_name = 'items'
-    categories = Category.objects.all()
-    extra_context = {
-        'categories': categories,
-    }
-    paginate_by = 12
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['item_grid'] = render_item_grid(self.request, Item.objects.all(), 'home')
+        return context
 
 
 class ItemDetailView(DetailView):
+    query_budget = 5
     model = Item
     template_name = 'core/product.html'
 
+    def get_object(self, queryset=None):
+        item = super().get_object(queryset)
+        annotate_items([item])
+        return item
+
 
 class RequestRefundView(View):
+    query_budget = 3
+
     def get(self, *args, **kwargs):
         form = RefundForm()
         context = {
@@ -233,16 +244,14 @@ class RequestRefundView(View):
             message = form.cleaned_data.get('message')
             email = form.cleaned_data.get('email')
             try:
-                order = Order.objects.get(ref_code=ref_code)
-                order.refund_requested = True
-                order.save()
-
-                # store the refund
-                refund = Refund()
-                refund.order = order
-                refund.reason = message
-                refund.email = email
-                refund.save()
+                order = Order.objects.only('pk').get(ref_code=ref_code)
+                # The refund is stored by a worker.
+                enqueue('save-refund', {
+                    'order_id': order.pk,
+                    'reason': message,
+                    'email': email,
+                    'phone_number': form.cleaned_data.get('phone_number'),
+                })
 
                 messages.success(self.request, 'Your request was received.')
                 return redirect('core:request-refund')
@@ -251,31 +260,86 @@ class RequestRefundView(View):
                 messages.info(self.request, 'This order does not exist.')
                 return redirect('core:request-refund')
         else:
-            return render(self.request, 'core/request_refund.html')
+            return render(self.request, 'core/request_refund.html', context={'form': form})
 
 
+@query_budget(4)
+@login_required
 def order_list(request):
-    orders_list = Order.objects.filter(user=request.user).order_by('-start_date')
-    if len(orders_list) < 1:
+    # Totals are stored on the order, so a page is one indexed range scan
+    # of (user, -start_date) in Order and one in the archive, however long
+    # the history is.
+    fields = ['pk', 'ref_code', 'start_date', 'ordered_date', 'received', 'subtotal', 'discount', 'promotion_discount']
+    orders = Order.objects.filter(user=request.user, ordered=True).only(*fields)
+    archived = ArchivedOrder.objects.filter(user=request.user).only(*fields)
+    cursor = request.GET.get('cursor')
+    page = ChainedCursorPaginator([orders, archived], ORDERS_PER_PAGE, ('-start_date', '-id')).get_page(cursor)
+    if not page.object_list and not cursor:
         messages.info(request, 'You have no orders.')
         return redirect('core:home')
     context = {
-        'orders_list': orders_list,
+        'orders_list': page,
+        'page_obj': page,
     }
     return render(request, 'core/order_list.html', context=context)
 
 
+@query_budget(5)
+@login_required
 def order_detail(request, pk):
-    order = get_object_or_404(Order, pk=pk)
-    order_items = order.items.all()
+    # Archived orders keep their primary key, so old links still resolve.
+    lookup = {'pk': pk, 'user': request.user}
+    order = Order.objects.select_related('billing_address').prefetch_related(
+        Prefetch('items', queryset=OrderItem.objects.select_related('item__category').order_by('pk')),
+    ).filter(**lookup).first()
+    if order is None:
+        order = get_object_or_404(
+            ArchivedOrder.objects.select_related('billing_address').prefetch_related(
+                Prefetch('items', queryset=ArchivedOrderItem.objects.select_related('item__category').order_by('pk')),
+            ),
+            **lookup,
+        )
     context = {
         'order': order,
-        'order_items': order_items,
+        'order_items': order.items.all(),
     }
     return render(request, 'core/order_detail.html', context=context)
 
 
+@query_budget(8)
+@staff_member_required
+def sales_dashboard(request):
+    # Reads the daily rollups only; orders and their lines are never scanned.
+    try:
+        days = int(request.GET.get('days', SALES_DASHBOARD_DAYS[1]))
+    except ValueError:
+        days = SALES_DASHBOARD_DAYS[1]
+    if days not in SALES_DASHBOARD_DAYS:
+        days = SALES_DASHBOARD_DAYS[1]
+    since = timezone.localdate() - timedelta(days=days - 1)
+    rollups = SalesRollup.objects.filter(day__gte=since).order_by()
+    sums = {
+        field: Sum(field) for field in ('orders', 'units', 'revenue', 'discount', 'refunded_units', 'refunds')
+    }
+    names = {category.id: category.name for category in categories.all()}
+    by_category = list(rollups.values('category_id').annotate(**sums).order_by('-revenue'))
+    for row in by_category:
+        row['name'] = names.get(row['category_id'], row['category_id'])
+    context = {
+        'days': days,
+        'day_choices': SALES_DASHBOARD_DAYS,
+        'since': since,
+        'totals': rollups.aggregate(**sums),
+        'by_day': rollups.values('day').annotate(**sums).order_by('-day'),
+        'by_category': by_category,
+        'top_items': rollups.values('item_id', 'item__title').annotate(**sums).order_by('-revenue')[:20],
+    }
+    return render(request, 'core/sales_dashboard.html', context=context)
+
+
 class ReportView(LoginRequiredMixin, View):
+    query_budget = 5
+
     def get(self, *args, **kwargs):
         pk = self.kwargs['pk']
         order = get_object_or_404(Order, pk=pk)
@@ -301,16 +365,15 @@ class ReportView(LoginRequiredMixin, View):
             ref_code = form.cleaned_data.get('ref_code')
 
             try:
-                order = Order.objects.get(ref_code=ref_code)
-
-                report = Report()
-                report.order = order
-                report.reason = reason
-                report.full_name = full_name
-                report.phone_number = phone_number
-                report.email = email
-                report.ref_code = ref_code
-                report.save()
+                order = Order.objects.only('pk').get(ref_code=ref_code)
+                enqueue('save-report', {
+                    'order_id': order.pk,
+                    'reason': reason,
+                    'full_name': full_name,
+                    'phone_number': phone_number,
+                    'email': email,
+                    'ref_code': ref_code,
+                })
 
                 messages.info(self.request, 'Your report has been sent.')
                 return redirect('core:order-list')
@@ -318,9 +381,80 @@ class ReportView(LoginRequiredMixin, View):
                 messages.info(self.request, 'This order does not exist.')
                 return redirect('core:order-list')
         else:
-            return render(self.request, 'core/report.html')
+            return render(self.request, 'core/report.html', context={'form': form})
 
 
 class PaymentView(View):
+    query_budget = 3
+
     def get(self, *args, **kwargs):
         return render(self.request, 'core/payment.html')
+
+
+@require_safe
+def image_derivative(request, preset, name):
+    """Serve a resized copy of an uploaded image, rendering it on first request.
+
+    Derivatives are stored under the hash of their source and preset and
+    revalidated by that hash. Only a URL whose ``v`` matches the current
+    source, as ``derivative_url`` builds it, is cached for good; a bare or
+    outdated one is cached briefly, as its image may be replaced.
+    """
+    if preset not in PRESETS:
+        raise Http404('Unknown image preset.')
+    try:
+        path, _ = get_derivative(name, preset)
+        current = request.GET.get('v') == source_version(name)
+    except (DerivativeError, SuspiciousFileOperation):
+        raise Http404('Image not found.')
+    etag = quote_etag(os.path.splitext(os.path.basename(path))[0])
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        response = FileResponse(open(path, 'rb'), content_type=DERIVATIVE_CONTENT_TYPE)
+    response['ETag'] = etag
+    if current:
+        response['Cache-Control'] = f'public, max-age={settings.IMAGE_DERIVATIVE_MAX_AGE}, immutable'
+    else:
+        response['Cache-Control'] = f'public, max-age={settings.IMAGE_DERIVATIVE_UNVERSIONED_MAX_AGE}'
+    return response
+
+
+class CatalogCursorPagination(CursorPagination):
+    ordering = 'id'
+    page_size = 24
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+@method_decorator(condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified), name='dispatch')
+class CatalogViewSet(viewsets.ReadOnlyModelViewSet):
+    """Read-only catalog endpoint answering conditional GETs from the catalog version.
+
+    Unchanged catalogs get a 304 before the view, or the database, is reached.
+    """
+    query_budget = 4
+    pagination_class = CatalogCursorPagination
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        patch_vary_headers(response, ['Accept'])
+        return response
+
+
+class ItemViewSet(CatalogViewSet):
+    queryset = Item.objects.select_related('category')
+    serializer_class = ItemSerializer
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        slug = self.request.query_params.get('category')
+        if slug:
+            category = categories.get(slug)
+            queryset = queryset.filter(category_id=category.id) if category else queryset.none()
+        return queryset
+
+
+class CategoryViewSet(CatalogViewSet):
+    queryset = Category.objects.all()
+    serializer_class = CategorySerializer
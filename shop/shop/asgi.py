@@ -12,5 +12,8 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'shop.settings')
+# Route the read-only storefront pages to core.async_views; set it to 0 to
+# serve the synchronous views under ASGI, e.g. to compare the two.
+os.environ.setdefault('SHOP_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
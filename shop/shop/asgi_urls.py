@@ -0,0 +1,9 @@
+from django.urls import URLResolver, include, path
+from . import urls
+
+# shop/urls.py, routing the core app to its async views (see shop/asgi.py).
+urlpatterns = [
+    path('', include(('core.async_urls', 'core'), namespace='core'))
+    if isinstance(pattern, URLResolver) and pattern.namespace == 'core' else pattern
+    for pattern in urls.urlpatterns
+]
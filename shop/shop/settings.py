@@ -52,7 +52,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.QueryInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'core.staticfiles.StaticFilesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -61,7 +63,9 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'shop.urls'
+# shop/asgi.py turns this on so ASGI servers get the async storefront views.
+ASYNC_VIEWS = os.environ.get('SHOP_ASYNC_VIEWS') == '1'
+ROOT_URLCONF = 'shop.asgi_urls' if ASYNC_VIEWS else 'shop.urls'
 
 TEMPLATES = [
     {
@@ -76,6 +80,8 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'core.context_processors.cart',
+                'core.context_processors.catalog',
             ],
         },
     },
@@ -91,10 +97,50 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # A file rather than memory, so the concurrency tests' threads can each
+        # open a connection that waits on SQLite's lock instead of failing.
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Sessions live only here, so in production this must be a cache every
+    # worker shares (Redis or Memcached) and that does not evict eagerly.
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'sessions',
+    },
+}
+
+# Anonymous visitors browse and fill their session cart without any
+# database reads or writes.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cache'
+SESSION_CACHE_ALIAS = 'sessions'
+
+CART_SUMMARY_CACHE_TIMEOUT = 60 * 60
+# Catalog fragments are keyed on a version that changes with the catalog,
+# so this only bounds how long superseded entries linger.
+CATALOG_CACHE_TIMEOUT = 60 * 60 * 24
+# Order ref codes each process reserves from the shared sequence per UPDATE.
+REF_CODE_BLOCK_SIZE = 100
+# Seconds stock stays reserved for a cart nobody touches before the
+# release_stock_holds sweeper hands it back.
+STOCK_HOLD_TTL = 15 * 60
+# Counters an item's stock is spread over when the admin starts tracking it.
+STOCK_SHARDS = 4
+# Defaults for compact_orders: carts idle this many days are deleted and
+# placed orders this many months old move to the archive tables.
+STALE_CART_DAYS = 30
+ORDER_ARCHIVE_MONTHS = 24
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
@@ -133,8 +179,21 @@ STATIC_URL = 'static/'
 STATICFILES_DIRS = [
     BASE_DIR / 'static'
 ]
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+# collectstatic fingerprints every asset and writes .gz copies that
+# core.staticfiles.StaticFilesMiddleware serves as-is.
+STATICFILES_STORAGE = 'core.staticfiles.CompressedManifestStaticFilesStorage'
+STATIC_HASHED_MAX_AGE = 60 * 60 * 24 * 365
+STATIC_MAX_AGE = 60 * 5
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Resized item images, named by the hash of their source and preset.
+IMAGE_DERIVATIVE_ROOT = os.path.join(MEDIA_ROOT, 'derivatives')
+IMAGE_DERIVATIVE_QUALITY = 80
+# For derivative URLs carrying the current source version; any other URL
+# may start serving a replaced image and is only cached briefly.
+IMAGE_DERIVATIVE_MAX_AGE = 60 * 60 * 24 * 365
+IMAGE_DERIVATIVE_UNVERSIONED_MAX_AGE = 60 * 5
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
@@ -164,3 +223,22 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.SessionAuthentication',
     ),
 }
+
+# Product search
+# core.search.database.DatabaseSearchBackend works on any database.
+SEARCH_BACKEND = 'core.search.fts5.FTS5SearchBackend'
+
+# Query instrumentation
+# Views declare their own query_budget; this applies to the rest.
+QUERY_BUDGET_DEFAULT = None
+SQL_TIME_BUDGET_MS = 200
+QUERY_INSTRUMENTATION_SLOWEST = 3
+# Send the per-request query count and SQL time to clients in a
+# Server-Timing header. They show which endpoints are costly to hit.
+SERVER_TIMING = DEBUG
+
+# Background jobs, worked off by the run_workers command
+JOB_LEASE = 5 * 60
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_BACKOFF = 10
+JOB_RETRY_BACKOFF_MAX = 60 * 60